@@ -11,6 +11,8 @@ from Secweb.XContentTypeOptions import XContentTypeOptions
 from Secweb.XFrameOptions import XFrame
 
 from router import router
+from src.graph_db_pool import close_graph_database_connections
+from src.job_worker import start_job_workers, stop_job_workers
 
 load_dotenv(override=True)
 logger = logging.getLogger(__name__)
@@ -56,6 +58,9 @@ def create_app():
     app.add_middleware(SessionMiddleware, secret_key=os.urandom(24))
     app.add_api_route("/health", health([healthy_condition, healthy]))
     app.include_router(router)
+    app.add_event_handler("startup", start_job_workers)
+    app.add_event_handler("shutdown", stop_job_workers)
+    app.add_event_handler("shutdown", close_graph_database_connections)
 
     return app
 
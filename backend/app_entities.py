@@ -138,7 +138,7 @@ class SourceNode:
     created_at: datetime = None
     updated_at: datetime = None
     processing_time: float = 0.0
-    error_message: str = ""
+    error_message: str = None   # None 时不更新 Document.errorMessage
     total_chunks: int = 0
     language: str = ""
     is_cancelled: bool = False
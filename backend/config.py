@@ -1,10 +1,16 @@
 from pydantic_settings import BaseSettings
+from typing import Optional
 
 START_FROM_BEGINNING  = "start_from_beginning"     
 DELETE_ENTITIES_AND_START_FROM_BEGINNING = "delete_entities_and_start_from_beginning"
 START_FROM_LAST_PROCESSED_POSITION = "start_from_last_processed_position"    
 START_FROM_BEGINNING = "start_from_beginning"
 
+# Chunk 处理阶段位图(Chunk.stages), 断点续跑时按位调度缺失的阶段
+CHUNK_STAGE_EMBEDDED = 1    # 已写入向量
+CHUNK_STAGE_EXTRACTED = 2   # LLM抽取结果已写入并与实体建立 HAS_ENTITY(包括没有抽取到实体的chunk)
+CHUNK_STAGES_ALL = CHUNK_STAGE_EMBEDDED | CHUNK_STAGE_EXTRACTED
+
 
 class Settings(BaseSettings):
 
@@ -15,19 +21,71 @@ class Settings(BaseSettings):
 
     UPDATE_GRPAH_CHUNK_BATCH_SIZE: int
     MAX_TOKEN_CHUNK_SIZE: int
+    CHUNK_GRAPH_WRITE_BATCH_SIZE: int = 1000    # 创建Chunk节点及关系时每个事务的chunk数量
+    PIPELINE_QUEUE_SIZE: int = 1    # 流水线各阶段(embedding/LLM/写入)之间缓冲的批次数
+    CHUNK_SPLITTER_MODE: str = "recursive"  # recursive: 按分隔符递归切分  token: 每页编码一次按token下标切片
+    CHUNK_TOKEN_ENCODING: str = "gpt2"      # 切分使用的 tiktoken 编码
+    CHUNK_PARALLEL_WORKERS: int = 0         # >1 时按页分片到多进程切分, 0/1 表示在当前进程切分
+    CHUNK_PARALLEL_PAGES_PER_TASK: int = 8  # 多进程切分时每个任务的页数
+    PDF_LOADER_MODE: str = "sequential"     # sequential: PyMuPDFLoader 单进程(默认)  parallel: 按页区间多进程解析
+    PDF_LOADER_WORKERS: int = 0         # PDF解析进程数, 0 表示使用全部CPU核
+    PDF_PARALLEL_MIN_PAGES: int = 32    # 页数少于该值时不启用多进程
     KNN_MIN_SCORE:float
+    KNN_MODE: str = "vector_index"  # vector_index: 逐chunk查询向量索引  block: 分页读取embedding后分块计算top-k
+    KNN_BACKEND: str = "numpy"      # block 模式的计算后端 numpy / faiss(需安装 faiss-cpu)
+    KNN_TOP_K: int = 5              # 每个chunk最多的相似chunk数
+    KNN_PAGE_SIZE: int = 10000      # 每页读取的embedding数量
+    KNN_BLOCK_SIZE: int = 4096      # 每次矩阵乘的查询块与语料块的向量数量
+    KNN_WRITE_BATCH_SIZE: int = 1000    # 每次UNWIND写入的SIMILAR关系数量
+    FULLTEXT_INDEX_WAIT_SECONDS: int = 300  # 全文索引新建/替换时等待填充完成的最长秒数, 超时后下次后处理继续切换
+    FULLTEXT_INDEX_POLL_SECONDS: float = 2.0    # 轮询索引填充进度的间隔秒数
+    CONSOLIDATION_BATCH_SIZE: int = 10000   # schema整合时每个事务改写的节点/关系数量
+    CONSOLIDATION_MAX_WORKERS: int = 4      # 并发执行的schema整合分组数量
 
     ENABLE_USER_AGENT: bool
+    SCHEMA_BOOTSTRAP_ON_CONNECT: bool = True  # 首次连接数据库时创建 Document/Chunk/__Entity__ 的约束与索引
+
+    # ===== 抽取任务队列
+    JOB_QUEUE_WORKERS: int = 2          # 抽取 worker 进程数, 0 表示 /extract 在请求内同步执行
+    JOB_QUEUE_DB_PATH: str = ""         # SQLite 任务队列文件, 为空时使用 backend/jobs/extract_jobs.db
+    JOB_LEASE_SECONDS: int = 60         # 任务租约秒数, worker 超过该时间未续约则任务被回收
+    JOB_MAX_ATTEMPTS: int = 3           # 任务因 worker 崩溃被回收的最大尝试次数
+    JOB_POLL_SECONDS: float = 1.0       # 空闲 worker 轮询队列的间隔秒数
+    JOB_CANCEL_POLL_SECONDS: float = 2.0    # 运行中的任务检查取消请求的间隔秒数
+    DOCUMENT_CANCEL_POLL_SECONDS: float = 10.0  # 抽取期间读取 Document.is_cancelled 的间隔(取消请求由其他进程处理时的兜底), 0 表示不轮询
+    JOB_RETENTION_SECONDS: int = 604800     # 结束的任务保留秒数(默认7天), 之后从队列中删除, 0 表示不删除
+    BATCH_EXTRACT_MAX_FILES: int = 8    # 批量抽取时同时处理的文件数, 所有文件的LLM请求共用模型调度器的并发上限
+    BATCH_EMBEDDING_CONCURRENCY: int = 1    # 批量抽取时同时进行的embedding批次数(共享同一个embedding模型)
 
 
     # ===== Model相关
     # ====== Embedding Model ====
     EMBEDDING_MODEL: str
+    EMBEDDING_DEVICE: str = ""              # 为空时自动选择 cuda > mps > cpu
+    EMBEDDING_BATCH_SIZE: int = 32          # 每次前向传播的chunk数量(micro-batch)
+    EMBEDDING_WRITE_BATCH_SIZE: int = 500   # 每次UNWIND写入Neo4j的embedding数量
+    EMBEDDING_CACHE_ENABLED: bool = True    # 按 (模型, chunk sha1) 缓存embedding, 重复入库不再计算
 
     # ======= LLM =====
     LLM_MODEL_deepseek_deepseek_chat: str
     LLM_MODEL_dashscope_qwen3_max: str
 
+    # ======= LLM 请求调度 =====
+    LLM_MAX_CONCURRENCY: int = 8        # 同一模型的最大并发请求数
+    LLM_REQUESTS_PER_MINUTE: int = 0    # 每分钟请求数上限, 0 表示不限制
+    LLM_TOKENS_PER_MINUTE: int = 0      # 每分钟输入token上限, 0 表示不限制
+    LLM_MAX_RETRIES: int = 5            # 限流(429)后的最大重试次数
+    LLM_RETRY_BASE_DELAY: float = 2.0   # 重试退避的基础秒数
+    # 格式 并发数,每分钟请求数,每分钟token数  为空时使用上面的默认值
+    LLM_LIMIT_deepseek_deepseek_chat: str = ""
+    LLM_LIMIT_dashscope_qwen3_max: str = ""
+    # ======= 实体抽取请求打包 =====
+    LLM_INPUT_TOKEN_BUDGET: int = 4000      # 每次抽取请求中chunk文本的token上限(不含提示词), 相邻chunk装满为止; 0 表示按 chunks_to_combine 固定数量合并
+    LLM_INPUT_TOKEN_ENCODING: str = "cl100k_base"   # 估算抽取输入token数使用的 tiktoken 编码
+    # 按模型覆盖 LLM_INPUT_TOKEN_BUDGET, 未设置时使用默认值, 0 表示该模型不按token打包
+    LLM_INPUT_TOKENS_deepseek_deepseek_chat: Optional[int] = None
+    LLM_INPUT_TOKENS_dashscope_qwen3_max: Optional[int] = None
+
 
     GRAPH_CLEAN_MODEL:str
     GENERATE_CYPHER_MODEL:str
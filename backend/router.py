@@ -1,5 +1,6 @@
 import os
 import gc
+import json
 import time
 import logging
 import asyncio
@@ -9,7 +10,6 @@ from fastapi import APIRouter, Depends, Request, UploadFile, File, Form
 from fastapi.responses import StreamingResponse
 from langchain_neo4j import Neo4jGraph
 
-
 from utils import formatted_time, validate_file_path
 from config import settings
 from app_entities import *
@@ -67,18 +67,20 @@ async def upload_large_file_into_chunks(
     totalChunks=Form(None),
     originalname=Form(None),
     model=Form(None),
+    chunkSize=Form(None),
+    fileSize=Form(None),
     credentials: Neo4jCredentials = Depends(get_neo4j_credentials)
 ):
     """ 分块上传 大型文件  为文件创建Document Node"""
     try:
         start = time.time()
-        graph = create_graph_database_connection(credentials) # 创建数据库连接
-        result = await asyncio.to_thread(upload_file, graph, model, file, chunkNumber, totalChunks, originalname, CHUNK_DIR, MERGED_DIR)
+        graph = await asyncio.to_thread(create_graph_database_connection, credentials) # 复用数据库连接池
+        result = await asyncio.to_thread(upload_file, graph, model, file, chunkNumber, totalChunks, originalname, CHUNK_DIR, MERGED_DIR, chunkSize, fileSize)
         end = time.time()
         elapsed_time = end - start
 
-        # 文件分块传输完成
-        if int(chunkNumber) == int(totalChunks):
+        # 文件分块全部到齐(分片可乱序到达)
+        if isinstance(result, dict):
             json_obj = {'api_name':'upload','db_url':credentials.uri,
                         'userName':credentials.userName, 'database':credentials.database, 
                         'chunkNumber':chunkNumber,'totalChunks':totalChunks,
@@ -91,14 +93,82 @@ async def upload_large_file_into_chunks(
     except Exception as e:
         message="Unable to upload file in chunks"
         error_message = str(e)
-        graph = create_graph_database_connection(credentials)   
-        update_exception(graph, originalname, error_message)
+        await create_async_data_access(credentials).update_exception_db(originalname, error_message)
         logger.info(message)
         logger.exception(f'Exception:{error_message}')
         return create_api_response('Failed', message=message + error_message[:100], error=error_message, file_name = originalname)
     finally:
         gc.collect()
 
+@router.post("/upload/session")
+async def create_resumable_upload_session(
+    originalname=Form(None),
+    fileSize=Form(None),
+    chunkSize=Form(None),
+    totalChunks=Form(None),
+):
+    """ 创建可续传的上传会话, 同一文件重复创建时返回已接收的分片 """
+    try:
+        result = await asyncio.to_thread(create_upload_session, originalname, fileSize, chunkSize, totalChunks, CHUNK_DIR)
+        return create_api_response('Success', data=result)
+    except Exception as e:
+        message = "Unable to create upload session"
+        logger.exception(f'Exception:{e}')
+        return create_api_response('Failed', message=message, error=str(e), file_name=originalname)
+
+
+@router.get("/upload/session/{upload_id}")
+async def get_resumable_upload_session(upload_id: str):
+    """ 查询上传会话已接收的分片及其 sha256 """
+    try:
+        result = await asyncio.to_thread(get_upload_session, upload_id, CHUNK_DIR)
+        return create_api_response('Success', data=result)
+    except Exception as e:
+        logger.exception(f'Exception:{e}')
+        return create_api_response('Failed', message="Unable to get upload session", error=str(e))
+
+
+@router.post("/upload/session/{upload_id}/part")
+async def upload_resumable_part(
+    upload_id: str,
+    file: UploadFile = File(...),
+    chunkNumber=Form(None),
+    checksum=Form(None),
+):
+    """ 上传一个分片(可并发、乱序), checksum 为分片的 sha256 """
+    try:
+        result = await asyncio.to_thread(upload_session_part, upload_id, file, chunkNumber, checksum, CHUNK_DIR)
+        return create_api_response('Success', data=result)
+    except Exception as e:
+        logger.exception(f'Exception:{e}')
+        return create_api_response('Failed', message="Unable to upload part", error=str(e))
+    finally:
+        gc.collect()
+
+
+@router.post("/upload/session/{upload_id}/complete")
+async def complete_resumable_upload(
+    upload_id: str,
+    model=Form(None),
+    credentials: Neo4jCredentials = Depends(get_neo4j_credentials)
+):
+    """ 全部分片到齐后完成组装, 为文件创建Document Node """
+    try:
+        start = time.time()
+        graph = await asyncio.to_thread(create_graph_database_connection, credentials)
+        result = await asyncio.to_thread(complete_upload_session, graph, model, upload_id, CHUNK_DIR, MERGED_DIR)
+        json_obj = {'api_name':'upload_complete','db_url':credentials.uri,
+                    'userName':credentials.userName, 'database':credentials.database,
+                    'upload_id':upload_id,'filename':result['file_name'],'model':model, 'email':credentials.email,
+                    'logging_time': formatted_time(datetime.now(timezone.utc)), 'elapsed_api_time':f'{time.time() - start:.2f}'}
+        logger.info(f"Upload log obj:{json_obj}")
+        return create_api_response('Success', data=result, message='Source Node Created Successfully')
+    except Exception as e:
+        message = "Unable to complete upload"
+        logger.exception(f'Exception:{e}')
+        return create_api_response('Failed', message=message, error=str(e))
+
+
 @router.post("/url/scan")
 async def create_source_knowledge_graph_url():
     ...
@@ -118,6 +188,14 @@ async def extract_knowledge_graph_from_file(
         if params.source_type == 'local_file':
             file_name = params.file_name
             merged_file_path = validate_file_path(MERGED_DIR, file_name)
+
+            # 启用任务队列时立即返回任务id, 由 worker 进程执行抽取
+            if settings.JOB_QUEUE_WORKERS > 0:
+                if not os.path.exists(merged_file_path):
+                    return create_api_response('Failed', file_name=file_name, message=f'File {file_name} does not exist')
+                job = await asyncio.to_thread(enqueue_extraction_job, credentials, params, merged_file_path)
+                return create_api_response('Success', data=job, message='Extraction job queued', file_source=params.source_type)
+
             uri_latency, result = await extract_graph_from_file_local_file(credentials, params, merged_file_path)
         
         # 2. web url文件抽取
@@ -152,6 +230,91 @@ async def extract_knowledge_graph_from_file(
 
 
 
+@router.post("/extract/batch")
+async def extract_knowledge_graph_from_files(
+    credentials: Neo4jCredentials = Depends(get_neo4j_credentials),
+    params: SourceScanExtractParams = Depends(get_source_scan_extract_params),
+    file_names: str = Form(...)
+):
+    """
+    批量抽取多个本地文件的知识图谱
+    /
+    file_names 为JSON列表, 所有文件共享 transformer, 连接池和embedding模型;
+    启用任务队列时返回一个批量任务, 任务的 progress 字段记录每个文件的进度
+    """
+    try:
+        start = time.time()
+        names = [name.strip() for name in json.loads(file_names) if name and name.strip()]
+        if not names:
+            return create_api_response('Failed', message='file_names is empty')
+        params.source_type = 'local_file'
+
+        file_paths = {name: validate_file_path(MERGED_DIR, name) for name in dict.fromkeys(names)}
+        missing = [name for name, path in file_paths.items() if not os.path.exists(path)]
+        if missing:
+            return create_api_response('Failed', message=f'Files do not exist: {missing}')
+
+        if settings.JOB_QUEUE_WORKERS > 0:
+            job = await asyncio.to_thread(enqueue_batch_extraction_job, credentials, params, file_paths)
+            return create_api_response('Success', data=job, message='Batch extraction job queued', file_source=params.source_type)
+
+        results = await extract_graph_from_files_local_file(credentials, params, file_paths)
+        failed_count = len([result for result in results if result.get("status") in ("Failed", "Skipped")])
+        logger.info(f"batch extraction of {len(file_paths)} files completed in {time.time() - start:.2f} seconds")
+        return create_api_response(
+            'Success', data=results, success_count=len(results) - failed_count, failed_count=failed_count, file_source=params.source_type
+        )
+    except Exception as e:
+        message = "Unable to extract knowledge graph for files"
+        error_message = str(e)
+        logger.error(f"{message}: {error_message}")
+        return create_api_response('Failed', message=message, error=error_message)
+    finally:
+        gc.collect()
+
+
+@router.post("/cancelled_job")
+async def cancel_extraction_job(
+    credentials: Neo4jCredentials = Depends(get_neo4j_credentials),
+    file_names: str = Form(...)
+):
+    """ 取消文件(JSON列表)的抽取, 在途的LLM请求会被立即中止 """
+    try:
+        names = [name.strip() for name in json.loads(file_names) if name and name.strip()]
+        if not names:
+            return create_api_response('Failed', message='file_names is empty')
+        result = await cancel_extraction(credentials, names)
+        return create_api_response('Success', data=result, message=f"Cancelled {len(result['cancelled'])} files")
+    except Exception as e:
+        message = "Unable to cancel extraction"
+        logger.error(f"{message}: {e}")
+        return create_api_response('Failed', message=message, error=str(e))
+
+
+@router.get("/extract/jobs/{job_id}")
+async def get_extract_job(job_id: str):
+    """ 查询抽取任务状态 """
+    try:
+        job = await asyncio.to_thread(get_extraction_job, job_id)
+        if job is None:
+            return create_api_response('Failed', message=f'Job {job_id} not found')
+        return create_api_response('Success', data=job)
+    except Exception as e:
+        logger.error(f"Unable to get extraction job {job_id}: {e}")
+        return create_api_response('Failed', message='Unable to get extraction job', error=str(e))
+
+
+@router.get("/extract/jobs")
+async def list_extract_jobs(status: str = None, file_name: str = None, limit: int = 100):
+    """ 按状态/文件名查询抽取任务, 按提交时间倒序 """
+    try:
+        jobs = await asyncio.to_thread(list_extraction_jobs, status, file_name, limit)
+        return create_api_response('Success', data=jobs)
+    except Exception as e:
+        logger.error(f"Unable to list extraction jobs: {e}")
+        return create_api_response('Failed', message='Unable to list extraction jobs', error=str(e))
+
+
 @router.post("/backend_connection_configuration")
 async def backend_connection_configuration():
     """ Neo4j 数据库连接 """
@@ -191,37 +354,81 @@ async def backend_connection_configuration():
 
 
 # ========== 索引相关 =========
+@router.post("/graph_schema/status")
+async def graph_schema_status(credentials: Neo4jCredentials = Depends(get_neo4j_credentials)):
+    """ 查询约束与索引是否完整, 返回缺失项 """
+    try:
+        result = await asyncio.to_thread(get_graph_schema_status, credentials)
+        return create_api_response('Success', data=result)
+    except Exception as e:
+        logger.exception(f'Exception:{e}')
+        return create_api_response('Failed', message="Unable to get graph schema status", error=str(e))
+
+
+@router.post("/graph_schema/bootstrap")
+async def graph_schema_bootstrap(credentials: Neo4jCredentials = Depends(get_neo4j_credentials)):
+    """ 幂等地创建缺失的约束与索引 """
+    try:
+        result = await asyncio.to_thread(bootstrap_graph_schema, credentials)
+        message = "Graph schema is complete" if not result["missing"] else f"Missing graph schema: {result['missing']}"
+        return create_api_response('Success', data=result, message=message)
+    except Exception as e:
+        logger.exception(f'Exception:{e}')
+        return create_api_response('Failed', message="Unable to bootstrap graph schema", error=str(e))
+
+
 @router.post("/post_processing")
 async def post_processing(
     tasks=Form(None),
+    scope=Form(None),
+    file_names=Form(None),
     credentials: Neo4jCredentials = Depends(get_neo4j_credentials)
 ):
+    """
+    后处理
+    /
+    scope=incremental 时只处理 file_names(JSON列表) 或自上次后处理以来新完成的文件,
+    完成后在Document上记录水位线 postProcessedAt
+    """
     try:
         start = time.time()
+        incremental = scope == "incremental"
+        scoped_files = None
+        if incremental:
+            scoped_files = await asyncio.to_thread(get_post_processing_files, credentials, json.loads(file_names) if file_names else None)
+            logger.info(f"Incremental post processing for files: {scoped_files}")
+            if not scoped_files:
+                return create_api_response('Success', data=[], message='No new files to post process')
 
         # 实现文本块相似性 
         if "materialize_text_chunk_similarities" in tasks:
-            await update_graph(credentials)
+            await update_graph(credentials, scoped_files)
             logger.info(f"Updated KNN Graph")
 
         # 混合搜索和全文搜索
         if "enable_fulltext_search" in tasks:
-            await create_vector_fulltext_indexes(credentials)
-            logger.info(f"fulltext indexes created")
+            fulltext_reports = await create_vector_fulltext_indexes(credentials)
+            logger.info(f"fulltext indexes maintained: {fulltext_reports}")
 
         # TODO 根据实体创建KNN 和 Vector索引
 
         # graph schema 整合
         if "graph_schema_consolidation" in tasks:
-            await graph_schema_consolidation(credentials)
-            logger.info(f"Updated nodes and relationship labels")
+            consolidation_report = await graph_schema_consolidation(credentials, scoped_files)
+            logger.info(f"Updated nodes and relationship labels: {consolidation_report}")
 
         # TODO 创建communities
         # if "enable_communities" in tasks:
         #     await asyncio.to_thread(create_communities, credentials)
         #     logger.info(f"created communities")
 
-        count_res = update_node_relationship_count(credentials)
+        if incremental:
+            count_res = {}
+            for file_name in scoped_files:
+                count_res.update(await asyncio.to_thread(update_node_relationship_count, credentials, file_name))
+            await asyncio.to_thread(set_post_processing_watermark, credentials, scoped_files)
+        else:
+            count_res = await asyncio.to_thread(update_node_relationship_count, credentials)
         if count_res:
             count_res = [{"filename": filename, **counts} for filename, counts in count_res.items()]
             logging.info(f'Updated source node with community related counts')
@@ -1,10 +1,18 @@
-from src.graph_db_access import GraphDBDataAccess
-from src.document_processors.local_file import get_documents_from_file_by_path
+from src.graph_db_access import GraphDBDataAccess, AsyncGraphDBDataAccess
+from src.graph_db_pool import get_graph, get_async_driver
+from src.graph_schema import verify_graph_schema, ensure_graph_schema
+from src.upload_assembler import UploadAssembler
+from src.job_queue import JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED
+from src.job_worker import get_job_queue
+from src.cancellation import cancellation_key, get_cancellation_registry
+from src.document_processors.local_file import iter_documents_from_file_by_path
 from src.document_processors.doc_chunk import CreateChunksofDocument
+from src.document_processors.text_splitter import pack_chunks_by_token_budget
 from src.graph_llm.graph_transform import LLMGraphTransformer
+from src.graph_llm.scheduler import get_llm_scheduler, get_llm_input_token_budget
 from src.common.prompts import ADDITIONAL_INSTRUCTIONS, GRAPH_CLEANUP_PROMPT
 from src.common.exception import GraphBuilderException
-from src.llm import get_llm
+from src.llm import get_llm, UniversalTokenUsageHandler
 from src.rag.agent import SimpleGraphRagAgent
 from src.embedding import load_embedding_model
 
@@ -12,50 +20,60 @@ from app_entities import Neo4jCredentials, SourceNode, SourceScanExtractParams
 from config import *
 from utils import (
     sanitize_additional_instruction, 
+    get_text_normalizer,
     clean_nodes_and_relationships, 
     delete_uploaded_local_file
 )
 
 
-from langchain_neo4j import Neo4jGraph
 from langchain_core.documents import Document
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage
 from langchain_core.output_parsers import JsonOutputParser
 
+import asyncio
 import json
 import os
 import logging
-import shutil
 import time
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Callable, Optional
 
 
 logger = logging.getLogger(__name__)
 
 
 def merge_chunks_local(file_name, total_chunks, chunk_dir, merged_dir):
-    """合并chunk文件"""
+    """合并chunk文件(分片已写入最终偏移, 这里只校验位图并移动到merged_dir)"""
 
-    if not os.path.exists(merged_dir):
-        os.mkdir(merged_dir)
     logger.info(f"Merged File Path: {merged_dir}")
-
-    merged_file_path = os.path.join(merged_dir, file_name)
-    with open(merged_file_path, "wb") as write_stream:
-        for i in range(1, total_chunks + 1):
-            chunk_file_path = os.path.join(chunk_dir, f"{file_name}_part_{i}")
-            logger.info(f"Chunk File Path While Merging Parts:{chunk_file_path}")
-            with open(chunk_file_path, "rb") as chunk_file:
-                shutil.copyfileobj(
-                    chunk_file, write_stream
-                )  # 将chunk的内容拷贝到 merge上
-            os.unlink(chunk_file_path)  # 删除merge过的chunk
+    file_size = UploadAssembler(file_name, chunk_dir).finalize(total_chunks, merged_dir)
     logger.info("Chunks merged successfully and return file size")
-    file_size = os.path.getsize(merged_file_path)
     return file_size
 
 
+def create_local_source_node(graph, file_name, file_size, model):
+    """为上传完成的本地文件创建Document Node, 返回文件扩展名"""
+    file_extension = file_name.split(".")[-1]
+    obj_source_node = SourceNode()
+    obj_source_node.file_name = file_name
+    obj_source_node.file_type = file_extension
+    obj_source_node.file_size = file_size
+    obj_source_node.file_source = "local file"
+    obj_source_node.model = model
+    obj_source_node.created_at = datetime.now()
+    obj_source_node.chunkNodeCount = 0
+    obj_source_node.chunkRelCount = 0
+    obj_source_node.entityNodeCount = 0
+    obj_source_node.entityEntityRelCount = 0
+    obj_source_node.communityNodeCount = 0
+    obj_source_node.communityRelCount = 0
+    db_access = GraphDBDataAccess(graph)
+    db_access.create_source_node(obj_source_node)
+    return file_extension
+
+
 def upload_file(
     graph,
     model,
@@ -65,45 +83,36 @@ def upload_file(
     file_name,
     chunk_dir,
     merged_dir,
+    chunk_size: int = None,
+    file_size: int = None,
 ):
     """上传文件"""
 
     file_name = file_name.strip() if isinstance(file_name, str) else file_name
+    chunk_number, total_chunks = int(chunk_number), int(total_chunks)
+    assembler = UploadAssembler(file_name, chunk_dir)
     # TODO: OSS上传文件
     OSS = False
     if OSS:
         ...
     else:
-        if not os.path.exists(chunk_dir):
-            os.mkdir(chunk_dir)
-        chunk_file_path = os.path.join(chunk_dir, f"{file_name}_part_{chunk_number}")
-        logger.info(f"Chunk File Path:{chunk_file_path}")
-        with open(chunk_file_path, "wb") as chunk_file:
-            chunk_file.write(chunk.file.read())
-
-    # 文件分块上传完成，需要合并chunk
-    if int(chunk_number) == int(total_chunks):
+        # 分片流式写入目标文件的对应偏移, 不整块读入内存
+        # 该接口没有上传会话, 第1个分片开始新的上传, 丢弃同名文件之前未完成的上传
+        assembler.write_part(
+            chunk.file, chunk_number, total_chunks,
+            chunk_size=int(chunk_size) if chunk_size else None,
+            file_size=int(file_size) if file_size else None,
+            restart=chunk_number == 1,
+        )
+
+    # 文件分块全部到齐，完成组装
+    if assembler.is_complete(total_chunks):
         if OSS:
             ...
         else:
-            file_size = merge_chunks_local(file_name, int(total_chunks), chunk_dir, merged_dir)
+            file_size = merge_chunks_local(file_name, total_chunks, chunk_dir, merged_dir)
         logger.info("File merged successfully!")
-        file_extension = file_name.split(".")[-1]
-        obj_source_node = SourceNode()
-        obj_source_node.file_name = file_name
-        obj_source_node.file_type = file_extension
-        obj_source_node.file_size = file_size
-        obj_source_node.file_source = "local file"
-        obj_source_node.model = model
-        obj_source_node.created_at = datetime.now()
-        obj_source_node.chunkNodeCount = 0
-        obj_source_node.chunkRelCount = 0
-        obj_source_node.entityNodeCount = 0
-        obj_source_node.entityEntityRelCount = 0
-        obj_source_node.communityNodeCount = 0
-        obj_source_node.communityRelCount = 0
-        db_access = GraphDBDataAccess(graph)
-        db_access.create_source_node(obj_source_node)
+        file_extension = create_local_source_node(graph, file_name, file_size, model)
         return {
             "file_size": file_size,
             "file_name": file_name,
@@ -113,31 +122,67 @@ def upload_file(
     return f"Chunk {chunk_number}/{total_chunks} saved"
 
 
+def create_upload_session(file_name, file_size, chunk_size, total_chunks, chunk_dir):
+    """创建(或恢复)可续传的上传会话, 返回已接收的分片"""
+    file_name = file_name.strip() if isinstance(file_name, str) else file_name
+    return UploadAssembler(file_name, chunk_dir).create_session(int(file_size), int(chunk_size), int(total_chunks))
+
+
+def get_upload_session(upload_id, chunk_dir):
+    """查询上传会话已接收的分片及校验和"""
+    return UploadAssembler.from_session(upload_id, chunk_dir).status()
+
+
+def upload_session_part(upload_id, chunk, chunk_number, checksum, chunk_dir):
+    """上传会话中的一个分片, 分片可并发、乱序、重复上传"""
+    assembler = UploadAssembler.from_session(upload_id, chunk_dir)
+    meta = assembler.read_meta()
+    assembler.write_part(
+        chunk.file, int(chunk_number), meta["totalChunks"],
+        chunk_size=meta["chunkSize"], file_size=meta["fileSize"], checksum=checksum,
+    )
+    return {"chunkNumber": int(chunk_number), "receivedParts": len(assembler.received_parts()), "totalChunks": meta["totalChunks"]}
+
+
+def complete_upload_session(graph, model, upload_id, chunk_dir, merged_dir):
+    """校验全部分片到齐后完成组装, 为文件创建Document Node"""
+    assembler = UploadAssembler.from_session(upload_id, chunk_dir)
+    file_name = assembler.file_name
+    file_size = merge_chunks_local(file_name, assembler.read_meta()["totalChunks"], chunk_dir, merged_dir)
+    file_extension = create_local_source_node(graph, file_name, file_size, model)
+    return {
+        "file_size": file_size,
+        "file_name": file_name,
+        "file_extension": file_extension,
+        "message": f"Upload {upload_id} completed",
+    }
+
+
 def create_graph_database_connection(credentials: Neo4jCredentials, refresh_schema=False):
-    """创建数据库连接"""
-    enable_user_agent = settings.ENABLE_USER_AGENT
-    if enable_user_agent:
-        graph = Neo4jGraph(
-            url=credentials.uri,
-            database=credentials.database,
-            username=credentials.userName,
-            password=credentials.password,
-            refresh_schema=refresh_schema,
-            sanitize=True,
-            driver_config={"user_agent": "LLM-Graph-Builder"},
-        )
-    else:
-        graph = Neo4jGraph(
-            url=credentials.uri,
-            database=credentials.database,
-            username=credentials.userName,
-            password=credentials.password,
-            refresh_schema=refresh_schema,
-            sanitize=True,
-        )
+    """创建数据库连接(进程内按凭证复用连接池)"""
+    graph = get_graph(credentials)
+    if refresh_schema:
+        graph.refresh_schema()
     return graph
 
 
+def get_graph_schema_status(credentials: Neo4jCredentials):
+    """查询热点键(Document.fileName / Chunk.id / __Entity__.id 等)的约束与索引是否存在"""
+    graph = create_graph_database_connection(credentials)
+    return verify_graph_schema(graph)
+
+
+def bootstrap_graph_schema(credentials: Neo4jCredentials):
+    """创建缺失的约束与索引并等待其上线"""
+    graph = create_graph_database_connection(credentials)
+    return ensure_graph_schema(graph, wait_seconds=300)
+
+
+def create_async_data_access(credentials: Neo4jCredentials):
+    """创建异步数据库访问对象(进程内按凭证复用异步驱动)"""
+    return AsyncGraphDBDataAccess(get_async_driver(credentials), credentials.database)
+
+
 def update_exception(graph, file_name, error_message):
     """更新节点错误信息"""
     db_access = GraphDBDataAccess(graph)
@@ -157,6 +202,61 @@ def update_node_relationship_count(credentials, file_name=None):
     return data_access.update_node_relationship_count(file_name)
 
 
+def iter_chunkId_chunkDoc_batches(
+    data_access: GraphDBDataAccess,
+    file_name,
+    docs,
+    token_chunk_size,
+    chunk_overlap,
+    batch_size,
+    source_type=None,
+):
+    """
+    流式分块: 逐页 清洗 -> 切分 -> 哈希, 每凑满一批就创建ChunkNode及relationships
+    /
+    docs 可以是逐页产出的生成器, 内存占用只与批大小有关
+    产出 (start, end, [{"chunk_id", "chunk_doc"}]), start/end 为chunk在文件中的下标区间
+    """
+    logger.info("Break down file into chunks")
+
+    normalize = get_text_normalizer(source_type)
+
+    def clean_pages():
+        # 替换不必要的字符串(单次 str.translate), 原地更新页面内容
+        for doc in docs:
+            doc.page_content = normalize(doc.page_content)
+            yield doc
+
+    # 上一批的接续状态
+    position = 1
+    previous_chunk_id = ""
+    content_offset = 0
+
+    def flush(chunks):
+        nonlocal position, previous_chunk_id, content_offset
+        chunkId_chunkDoc_list = data_access.create_relation_between_chunks(
+            file_name, chunks,
+            start_position=position,
+            previous_chunk_id=previous_chunk_id,
+            content_offset=content_offset,
+        )
+        start = position - 1
+        position += len(chunks)
+        previous_chunk_id = chunkId_chunkDoc_list[-1]["chunk_id"]
+        content_offset += sum(len(chunk.page_content) for chunk in chunks)
+        return start, position - 1, chunkId_chunkDoc_list
+
+    chunks = []
+    for chunk in CreateChunksofDocument(clean_pages()).iter_chunks(token_chunk_size, chunk_overlap):
+        chunks.append(chunk)
+        if len(chunks) >= batch_size:
+            yield flush(chunks)
+            chunks = []
+    if chunks:
+        yield flush(chunks)
+    logger.info('Total chunks created: %d', position - 1)
+
+
 def get_chunkId_chunkDoc_list(
     data_access: GraphDBDataAccess,
     file_name,
@@ -176,274 +276,360 @@ def get_chunkId_chunkDoc_list(
         DELETE_ENTITIES_AND_START_FROM_BEGINNING,
         START_FROM_LAST_PROCESSED_POSITION,
     ]:
-        logger.info("Break down file into chunks")
-
-        # 1. 替换不必要的字符串
-        bad_chars = ['"', "\n", "'"]
-        for i in range(0, len(docs)):
-            text = docs[i].page_content
-            for j in bad_chars:
-                if j == "\n":
-                    text = text.replace(j, " ")
-                else:
-                    text = text.replace(j, "")
-            docs[i] = Document(page_content=str(text), metadata=docs[i].metadata)
-
-        # 2. 切分docs
-        create_chunks_obj = CreateChunksofDocument(docs)
-        chunks = create_chunks_obj.split_file_into_chunks(
-            token_chunk_size, chunk_overlap
-        )
-
-        # 3. 创建chunkNode 并建立relationships
-        chunkId_chunkDoc_list = data_access.create_relation_between_chunks(
-            file_name, chunks
-        )
-        return len(chunks), chunkId_chunkDoc_list
+        chunkId_chunkDoc_list = []
+        for _, _, batch in iter_chunkId_chunkDoc_batches(
+            data_access, file_name, docs, token_chunk_size, chunk_overlap,
+            settings.UPDATE_GRPAH_CHUNK_BATCH_SIZE,
+        ):
+            chunkId_chunkDoc_list.extend(batch)
+        return len(chunkId_chunkDoc_list), chunkId_chunkDoc_list
 
     # 非首次, 需要根据策略获取filename下没处理完的chunk
     else:
-        chunkId_chunkDoc_list = []  # 最终返回的chunk集合
-        chunks = data_access.get_chunks_by_fileName(file_name)
+        resume = retry_condition == START_FROM_LAST_PROCESSED_POSITION
+        if resume:
+            chunks = data_access.get_chunk_stages(file_name)
+        else:
+            chunks = data_access.get_chunks_by_fileName(file_name)
 
         # file的chunk不存在
-        if chunks[0]["text"] is None or chunks[0]["text"] == "" or not chunks:
+        if not chunks or chunks[0]["text"] is None or chunks[0]["text"] == "":
             raise Exception(
                 f"Chunks are not created for {file_name}. Please re-upload file or reprocess the file with option Start From Beginning."
             )
 
-        else:
-            for chunk in chunks:
-                chunk_doc = Document(
-                    page_content=chunk["text"],
-                    metadata={"id": chunk["id"], "position": chunk["position"]},
-                )
-                chunkId_chunkDoc_list.append(
-                    {"chunk_id": chunk["id"], "chunk_doc": chunk_doc}
-                )
+        chunkId_chunkDoc_list = []  # 最终返回的chunk集合
+        for chunk in chunks:
+            chunk_doc = Document(
+                page_content=chunk["text"],
+                metadata={"id": chunk["id"], "position": chunk["position"]},
+            )
+            chunkId_chunkDoc_list.append(
+                {"chunk_id": chunk["id"], "chunk_doc": chunk_doc, "stages": chunk.get("stages", 0)}
+            )
 
-            # 从上次处理位置继续
-            if retry_condition == START_FROM_LAST_PROCESSED_POSITION:
-                logger.info(f"Retry: start from last processed position")
-                starting_chunk = data_access.get_last_processed_chunk(file_name)
-
-                # 情况1:  中间位置恢复
-                if starting_chunk and starting_chunk[0]["position"] < len(
-                    chunkId_chunkDoc_list
-                ):
-                    return (
-                        len(chunks),
-                        chunkId_chunkDoc_list[starting_chunk[0]["position"] - 1 :],
-                    )
-
-                # 情况2： 全部chunk处理完毕，但是有遗漏的(有的chunk没有提取Entity实体)
-                elif starting_chunk and starting_chunk[0]["position"] == len(
-                    chunkId_chunkDoc_list
-                ):
-                    # 查询处没有进行实体抽取的 chunk
-                    starting_chunk = (
-                        data_access.get_last_processed_without_entity_chunk(file_name)
-                    )
-                    return (
-                        len(chunks),
-                        chunkId_chunkDoc_list[starting_chunk[0]["position"] - 1 :],
-                    )
-
-                # 情况3: 全部完成
-                else:
-                    raise Exception(
-                        f"All chunks of file {file_name} are already processed. If you want to re-process, Please start from begnning"
-                    )
-
-            # 从头开始
-            else:
-                logger.info(
-                    f"Retry : start_from_beginning with chunks {len(chunkId_chunkDoc_list)}"
+        # 从上次处理位置继续: 只调度缺少阶段的chunk, 流水线中每个阶段只处理缺少该阶段的chunk
+        if resume:
+            pending = [chunk for chunk in chunkId_chunkDoc_list if chunk["stages"] & CHUNK_STAGES_ALL != CHUNK_STAGES_ALL]
+            logger.info(
+                f"Retry: start from last processed position, {len(pending)}/{len(chunkId_chunkDoc_list)} chunks "
+                f"({sum(1 for chunk in pending if not chunk['stages'] & CHUNK_STAGE_EMBEDDED)} to embed, "
+                f"{sum(1 for chunk in pending if not chunk['stages'] & CHUNK_STAGE_EXTRACTED)} to extract)"
+            )
+            if not pending:
+                raise Exception(
+                    f"All chunks of file {file_name} are already processed. If you want to re-process, Please start from begnning"
                 )
-                return len(chunks), chunkId_chunkDoc_list
+            return len(chunks), pending
 
+        # 从头开始
+        else:
+            logger.info(
+                f"Retry : start_from_beginning with chunks {len(chunkId_chunkDoc_list)}"
+            )
+            data_access.reset_chunk_stages(file_name)
+            return len(chunks), chunkId_chunkDoc_list
 
-def get_combied_chunks(chunks: list, chunks_to_combine: int):
-    """合并小chunk为一个Document"""
-    # 1. 按照chunks_to_combine合并文本内容
-    combined_chunks_page_content = [
-        "".join(
-            chunk["chunk_doc"].page_content
-            for chunk in chunks[i : i + chunks_to_combine]
-        )
-        for i in range(0, len(chunks), chunks_to_combine)
-    ]
 
-    combined_chunks_ids = [
-        [chunk["chunk_id"] for chunk in chunks[i : i + chunks_to_combine]]
-        for i in range(0, len(chunks), chunks_to_combine)
-    ]
+def get_combied_chunks(chunks: list, chunks_to_combine: int = None, token_budget: int = 0):
+    """
+    合并小chunk为一个Document
+    /
+    token_budget > 0 时按token预算打包相邻chunk, chunks_to_combine 作为每个请求的chunk数上限;
+    否则按 chunks_to_combine 固定数量合并
+    每个Document的 input_tokens 供LLM调度器的token预算使用, 与打包使用同一个计数
+    """
+    # 1. 分组
+    groups = pack_chunks_by_token_budget(chunks, token_budget or 0, settings.LLM_INPUT_TOKEN_ENCODING, chunks_to_combine)
 
     # 2. 按照合并后的chunk 创建新的doc
     combined_chunk_doc_list = []
-    for i in range(len(combined_chunks_page_content)):
+    for group, input_tokens in groups:
         combined_chunk_doc_list.append(
             Document(
-                page_content=combined_chunks_page_content[i],
-                metadata={"combined_chunk_ids": combined_chunks_ids[i]},
+                page_content="".join(chunk["chunk_doc"].page_content for chunk in group),
+                metadata={"combined_chunk_ids": [chunk["chunk_id"] for chunk in group], "input_tokens": input_tokens},
             )
         )
     return combined_chunk_doc_list
 
 
-async def get_graph_from_llm(chunks: list, params: SourceScanExtractParams):
-    """使用LLM提取知识图谱的关系节点"""
+def create_graph_transformer(params: SourceScanExtractParams) -> LLMGraphTransformer:
+    """ 按抽取参数创建 LLMGraphTransformer, 批量抽取时多个文件共享同一个实例 """
+    # 1. 获取LLM
+    model = params.model
+    llm, model_name, _ = get_llm(model)
+    logger.info(f"Using model: {model_name}")
+
+    # 2. 允许的节点Node
+    allowedNodes = params.allowedNodes
+    allowed_nodes = []
+    if allowedNodes:
+        for node in allowedNodes.split(","):
+            allowed_nodes.append(node.strip())
+    logger.info(f"Allowed nodes: {allowed_nodes}")
+
+    # 3. 允许的关系Relationship
+    allowedRelationship = params.allowedRelationship # eg: node1, rel1, node2, node3, rel2, node4
+    allowed_relationships = []
+    if allowedRelationship:
+        items = [
+            item.strip()
+            for item in allowed_relationships.split(",")
+            if item.strip()
+        ]
+        if len(items) % 3 != 0:
+            raise Exception(
+                "allowedRelationship must be a multiple of 3 (source, relationship, target)"
+            )
+        for i in range(0, len(items), 3):
+            source, relation, target = items[i : i + 3]
+            if source not in allowed_nodes:
+                raise Exception(
+                    f"Invalid relationship ({source}, {relation}, {target}): "
+                    f"source or target not in allowedNodes"
+                )
+            allowed_relationships.append((source, relation, target))
+        logger.info(f"Allowed relationships: {allowed_relationships}")
+
+    else:
+        # 没有提供允许的关系
+        logger.info("No allowed relationships provided")
+
+    # 4. 额外的抽取指令
+    additional_instructions = params.additional_instructions
+    additional_instructions = sanitize_additional_instruction(
+        additional_instructions
+    )
+    return LLMGraphTransformer(
+        llm,
+        allowed_nodes,
+        allowed_relationships,
+        strict_mode=True,
+        node_properties=["description"],
+        relationship_properties=["description"],
+        additional_instructions=(
+            ADDITIONAL_INSTRUCTIONS + additional_instructions
+            if additional_instructions
+            else ""
+        ),
+    )
+
+
+async def get_graph_from_llm(chunks: list, params: SourceScanExtractParams, graph_llm: LLMGraphTransformer = None):
+    """
+    使用LLM提取知识图谱的关系节点, graph_llm 为空时按参数新建
+    /
+    返回 (GraphDocument列表, token用量, 抽取失败的chunk id)
+    """
     try:
-        # 1. 获取LLM
-        model = params.model
-        llm, model_name, callback_handler = get_llm(model)
-        logger.info(f"Using model: {model_name}")
+        if graph_llm is None:
+            graph_llm = create_graph_transformer(params)
 
-        # 2. 合并chunk
+        # 1. 合并chunk: 按模型的输入token预算打包相邻chunk, chunks_to_combine 为每个请求的chunk数上限
         chunks_to_combine = (
             params.chunks_to_combine
         )  #  多少个chunk合并为一个大chunk用于实体抽取
-        combined_chunk_doc_list = get_combied_chunks(chunks, chunks_to_combine)
-        logger.info(f"Combined {len(combined_chunk_doc_list)} chunks")
-
-        # 3. 允许的节点Node
-        allowedNodes = params.allowedNodes
-        allowed_nodes = []
-        if allowedNodes:
-            for node in allowedNodes.split(","):
-                allowed_nodes.append(node.strip())
-        logger.info(f"Allowed nodes: {allowed_nodes}")
-
-        # 4. 允许的关系Relationship
-        allowedRelationship = params.allowedRelationship # eg: node1, rel1, node2, node3, rel2, node4
-        allowed_relationships = []
-        if allowedRelationship:
-            items = [
-                item.strip()
-                for item in allowed_relationships.split(",")
-                if item.strip()
-            ]
-            if len(items) % 3 != 0:
-                raise Exception(
-                    "allowedRelationship must be a multiple of 3 (source, relationship, target)"
-                )
-            for i in range(0, len(items), 3):
-                source, relation, target = items[i : i + 3]
-                if source not in allowed_nodes:
-                    raise Exception(
-                        f"Invalid relationship ({source}, {relation}, {target}): "
-                        f"source or target not in allowedNodes"
-                    )
-                allowed_relationships.append((source, relation, target))
-            logger.info(f"Allowed relationships: {allowed_relationships}")
+        token_budget = get_llm_input_token_budget(params.model)
+        # tiktoken 编码是CPU密集操作, 放到线程中执行, 不阻塞流水线的事件循环
+        combined_chunk_doc_list = await asyncio.to_thread(get_combied_chunks, chunks, chunks_to_combine, token_budget)
+        logger.info(f"Combined {len(chunks)} chunks into {len(combined_chunk_doc_list)} requests (token budget {token_budget})")
 
-        else:
-            # 没有提供允许的关系
-            logger.info("No allowed relationships provided")
-
-        # 5. 使用LLM提取知识图谱
-        additional_instructions = params.additional_instructions
-        additional_instructions = sanitize_additional_instruction(
-            additional_instructions
-        )
-        graph_llm = LLMGraphTransformer(
-            llm,
-            allowed_nodes,
-            allowed_relationships,
-            strict_mode=True,
-            node_properties=["description"],
-            relationship_properties=["description"],
-            additional_instructions=(
-                ADDITIONAL_INSTRUCTIONS + additional_instructions
-                if additional_instructions
-                else ""
-            ),
-        )
+        # 2. 使用LLM提取知识图谱, 每次调用单独统计token(共享的transformer可能同时服务多个文件)
+        callback_handler = UniversalTokenUsageHandler()
         config = RunnableConfig(callbacks=[callback_handler])
+        failed_chunk_ids = []
         graph_document_list = await graph_llm.convert_to_graph_documents(
-            combined_chunk_doc_list, config=config
+            combined_chunk_doc_list, config=config, scheduler=get_llm_scheduler(params.model),
+            failed_chunk_ids=failed_chunk_ids,
         )
         usage = callback_handler.report()
         token_usage = usage.get("total_tokens", 0)
-        return graph_document_list, token_usage
+        return graph_document_list, token_usage, failed_chunk_ids
     except Exception as e:
         logger.error(f"Error in get_graph_from_llm: {e}", exc_info=True)
         raise e
 
 
-async def processing_chunks(
-    chunks: list,
-    data_access: GraphDBDataAccess,
-    params: SourceScanExtractParams,
-):
-    try:
-        # 统计处理chunk各步骤的时间
-        latency_processing_chunk = {}
+def embed_chunks(chunks: list, data_access: GraphDBDataAccess, file_name: str):
+    """ 流水线阶段1: 给chunk创建向量嵌入 """
+    latency_processing_chunk = {}
+    start_update_embedding = time.time()
+    data_access.create_chunk_embeddings(chunks, file_name)
+    end_update_embedding = time.time()
+    elapsed_update_embedding = end_update_embedding - start_update_embedding
+    logger.info(
+        f"Time taken to update embedding in chunk node: {elapsed_update_embedding:.2f} seconds"
+    )
+    latency_processing_chunk["update_embedding"] = f"{elapsed_update_embedding:.2f}"
+    return latency_processing_chunk
+
+
+async def extract_chunks(chunks: list, params: SourceScanExtractParams, graph_llm: LLMGraphTransformer = None):
+    """ 流水线阶段2: 使用LLM进行知识图谱提取, 失败的chunk不会置位 extracted 阶段, 断点续跑时重新抽取 """
+    latency_processing_chunk = {}
+    start_entity_extraction = time.time()
+    graph_documents, token_usage, failed_chunk_ids = await get_graph_from_llm(chunks, params, graph_llm)
+    end_entity_extraction = time.time()
+    elapsed_entity_extraction = end_entity_extraction - start_entity_extraction
+    logger.info(
+        f"Time taken to extract enitities from LLM Graph Builder: {elapsed_entity_extraction:.2f} seconds"
+    )
+    latency_processing_chunk["entity_extraction"] = f"{elapsed_entity_extraction:.2f}"
+    return graph_documents, token_usage, failed_chunk_ids, latency_processing_chunk
+
+
+def write_chunks_graph(graph_documents: list, data_access: GraphDBDataAccess, file_name: str):
+    """ 流水线阶段3: 保存知识图谱并关联chunk与实体, 增量更新Document计数 """
+    latency_processing_chunk = {}
+
+    # 1. 保存知识图谱到Neo4j数据库, 同一事务中将chunk 和 对应提取的知识图谱 关联起来
+    start_save_graphDocuments = time.time()
+    cleaned_graph_documents = clean_nodes_and_relationships(graph_documents)
+    write_counts = data_access.save_graph_documents(cleaned_graph_documents, file_name)
+    end_save_graphDocuments = time.time()
+    elapsed_save_graphDocuments = end_save_graphDocuments - start_save_graphDocuments
+    logger.info(
+        f"Time taken to save graph document and chunk entity relationships in neo4j: {elapsed_save_graphDocuments:.2f} seconds"
+    )
+    latency_processing_chunk["save_graphDocuments"] = (
+        f"{elapsed_save_graphDocuments:.2f}"
+    )
 
-        # 1. 构建知识图谱参数基本信息提取
-        file_name = params.file_name
+    # 2. 根据写入结果增量更新Document的node和relationship的数量(全量统计只在任务结束时进行)
+    res = data_access.increment_node_relationship_count(file_name, {
+        "chunkRelCount": write_counts["hasEntityRelCount"],
+        "entityNodeCount": write_counts["entityNodeCount"],
+        "entityEntityRelCount": write_counts["entityEntityRelCount"],
+    })
+    node_count = res.get("nodeCount", "0")
+    rel_count = res.get("relationshipCount", "0")
 
-        # TODO: 用户 Token使用限制检查
+    return node_count, rel_count, latency_processing_chunk
 
-        # 2. 给chunk创建向量嵌入
-        start_update_embedding = time.time()
-        data_access.create_chunk_embeddings(chunks, file_name)
-        end_update_embedding = time.time()
-        elapsed_update_embedding = end_update_embedding - start_update_embedding
-        logger.info(
-            f"Time taken to update embedding in chunk node: {elapsed_update_embedding:.2f} seconds"
-        )
-        latency_processing_chunk["update_embedding"] = f"{elapsed_update_embedding:.2f}"
-
-        # 3. 使用LLM进行知识图谱提取
-        start_entity_extraction = time.time()
-        graph_documents, token_usage = await get_graph_from_llm(chunks, params)
-        end_entity_extraction = time.time()
-        elapsed_entity_extraction = end_entity_extraction - start_entity_extraction
-        logger.info(
-            f"Time taken to extract enitities from LLM Graph Builder: {elapsed_entity_extraction:.2f} seconds"
-        )
-        latency_processing_chunk["entity_extraction"] = f"{elapsed_entity_extraction:.2f}"
-
-        # 4. 保存知识图谱到Neo4j数据库
-        start_save_graphDocuments = time.time()
-        cleaned_graph_documents = clean_nodes_and_relationships(graph_documents)
-        data_access.save_graph_documents(cleaned_graph_documents)
-        end_save_graphDocuments = time.time()
-        elapsed_save_graphDocuments = end_save_graphDocuments - start_save_graphDocuments
-        logger.info(
-            f"Time taken to save graph document in neo4j: {elapsed_save_graphDocuments:.2f} seconds"
-        )
-        latency_processing_chunk["save_graphDocuments"] = (
-            f"{elapsed_save_graphDocuments:.2f}"
-        )
 
-        # 5. 将chunk 和 对应提取的知识图谱 关联起来
-        start_relationship = time.time()
-        data_access.merge_relationship_between_chunk_and_graph_entities(
-            cleaned_graph_documents
-        )
-        end_relationship = time.time()
-        elapsed_relationship = end_relationship - start_relationship
-        logger.info(
-            f"Time taken to create relationship between chunk and entities: {elapsed_relationship:.2f} seconds"
-        )
-        latency_processing_chunk["relationship_between_chunk_entity"] = (
-            f"{elapsed_relationship:.2f}"
-        )
+@dataclass
+class SharedExtractionResources:
+    """ 批量抽取时多个文件共享的资源 """
+    graph_llm: LLMGraphTransformer                  # 共享的 transformer, LLM请求都进入同一个模型调度器
+    embedding_semaphore: asyncio.Semaphore          # 所有文件的embedding批次共用的并发上限
+    on_progress: Optional[Callable[[str, dict], None]] = None  # 每个文件的进度回调 (file_name, progress)
 
-        # 6. 更新Document的node和relationship的数量
-        res = data_access.update_node_relationship_count(file_name)
-        node_count = res[file_name].get("nodeCount", "0")
-        rel_count = res[file_name].get("relationshipCount", "0")
 
-        return node_count, rel_count, latency_processing_chunk, token_usage
-    except Exception as e:
-        data_access.update_exception_db(file_name, str(e), params.retry_condition)
+async def processing_chunks_pipeline(
+    batches,
+    data_access: GraphDBDataAccess,
+    params: SourceScanExtractParams,
+    cancel_event: asyncio.Event,
+    on_batch_processed,
+    resources: SharedExtractionResources = None,
+):
+    """
+    流水线处理chunk批次: embedding -> LLM抽取 -> Neo4j写入
+    /
+    三个阶段通过有界队列连接, batch N+1 做embedding时 batch N 在LLM中抽取, batch N-1 在写入Neo4j
+    batches: [(start, end, chunks)] 或逐批产出的(阻塞)迭代器, 迭代器在线程中推进
+    cancel_event: 取消信号, 置位后立即取消 embedding/抽取 阶段(包括在途的LLM请求), 已抽取完成的批次仍会写入
+    on_batch_processed: 异步回调, 写入阶段按批次顺序调用 (start, end, node_count, rel_count, latency, token_usage, failed_chunk_ids)
+    resources: 批量抽取时共享的 transformer 与 embedding 并发上限, 多个文件的批次在其中交错执行
+    返回是否因取消而提前结束
+    """
+    file_name = params.file_name
+    queue_size = settings.PIPELINE_QUEUE_SIZE
+    extract_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    cancelled = False
+    extract_done = False
+    graph_llm = resources.graph_llm if resources else None
+    embedding_semaphore = resources.embedding_semaphore if resources else None
+
+    async def embed_stage():
+        batch_iter = iter(batches)
+        try:
+            while not cancel_event.is_set():
+                # 流式分块时取下一批会切分并写入ChunkNode, 放到线程中执行
+                batch = await asyncio.to_thread(next, batch_iter, None)
+                if batch is None:
+                    break
+                start, end, chunks = batch
+                # 断点续跑时跳过已写入向量的chunk
+                to_embed = [chunk for chunk in chunks if not chunk.get("stages", 0) & CHUNK_STAGE_EMBEDDED]
+                if not to_embed:
+                    latency = {}
+                elif embedding_semaphore is None:
+                    latency = await asyncio.to_thread(embed_chunks, to_embed, data_access, file_name)
+                else:
+                    async with embedding_semaphore:
+                        latency = await asyncio.to_thread(embed_chunks, to_embed, data_access, file_name)
+                await extract_queue.put((start, end, chunks, latency))
+            await extract_queue.put(None)
+        except asyncio.CancelledError:
+            if not cancelled:
+                raise
+
+    async def extract_stage():
+        nonlocal extract_done
+        try:
+            while (item := await extract_queue.get()) is not None:
+                start, end, chunks, latency = item
+                # 断点续跑时跳过已抽取并写入的chunk, 整批都已抽取时不调用LLM
+                to_extract = [chunk for chunk in chunks if not chunk.get("stages", 0) & CHUNK_STAGE_EXTRACTED]
+                if to_extract:
+                    graph_documents, token_usage, failed_chunk_ids, extract_latency = await extract_chunks(to_extract, params, graph_llm)
+                    latency.update(extract_latency)
+                else:
+                    graph_documents, token_usage, failed_chunk_ids = [], 0, []
+                await write_queue.put((start, end, graph_documents, token_usage, failed_chunk_ids, latency))
+        except asyncio.CancelledError:
+            if not cancelled:
+                raise
+            logger.info(f"Aborted in-flight LLM extraction for file {file_name}")
+        extract_done = True
+        await write_queue.put(None)
+
+    async def write_stage():
+        while (item := await write_queue.get()) is not None:
+            start, end, graph_documents, token_usage, failed_chunk_ids, latency = item
+            node_count, rel_count, write_latency = await asyncio.to_thread(
+                write_chunks_graph, graph_documents, data_access, file_name
+            )
+            latency.update(write_latency)
+            await on_batch_processed(start, end, node_count, rel_count, latency, token_usage, failed_chunk_ids)
+
+    tasks = [
+        asyncio.create_task(embed_stage()),
+        asyncio.create_task(extract_stage()),
+        asyncio.create_task(write_stage()),
+    ]
+
+    async def cancel_watcher():
+        # 取消信号置位后立即中断 embedding 和 LLM 抽取, 写入阶段把已抽取的结果写完后结束
+        nonlocal cancelled
+        await cancel_event.wait()
+        cancelled = True
+        logger.info(f"Cancelling extraction pipeline for file {file_name}")
+        tasks[0].cancel()
+        if not extract_done:
+            tasks[1].cancel()
+
+    watcher = asyncio.create_task(cancel_watcher())
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException as e:
+        # 任一阶段失败, 停止其他阶段
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if isinstance(e, Exception):
+            await asyncio.to_thread(data_access.update_exception_db, file_name, str(e), params.retry_condition)
         raise e
+    finally:
+        watcher.cancel()
+    return cancelled or cancel_event.is_set()
+
 
 async def processing_source(
-    credentials, params, docs, file_path=None, is_uploaded_from_local=True
+    credentials, params, docs, file_path=None, is_uploaded_from_local=True, resources: SharedExtractionResources = None
 ):
     file_name = params.file_name
     response = {} # 最终返回的字典
@@ -451,25 +637,52 @@ async def processing_source(
     start_time = datetime.now()
     processing_source_start_time = time.time()
 
-    # 1. 创建neo4j数据库连接
+    # 1. 创建neo4j数据库连接(复用连接池), 状态/进度等轻量读写走异步驱动
     graph = create_graph_database_connection(credentials)
+    async_data_access = create_async_data_access(credentials)
 
     # 2. 创建图数据库操作类  给chunk创建向量索引
     data_access = GraphDBDataAccess(graph)
-    data_access.create_chunk_vector_index()  
+    if resources is None:
+        # 批量抽取时在开始前统一检查一次
+        await asyncio.to_thread(data_access.create_chunk_vector_index)
 
     # 3. 分块 并 创建chunkNode 和 RelationShips 并与Document建立关系
-    total_chunks, chunkId_chunkDoc_list = get_chunkId_chunkDoc_list(
-        data_access,
-        file_name,
-        docs,
-        params.token_chunk_size,
-        params.chunk_overlap,
-        params.retry_condition,
-    )
+    update_graph_chunk_batch_size = settings.UPDATE_GRPAH_CHUNK_BATCH_SIZE
+    is_streaming = params.retry_condition in ["", None] or params.retry_condition not in [
+        DELETE_ENTITIES_AND_START_FROM_BEGINNING,
+        START_FROM_LAST_PROCESSED_POSITION,
+    ]
+    if is_streaming:
+        # 首次处理: 流水线中逐批分块入库, 总chunk数在处理结束时确定
+        total_chunks = None
+        batches = iter_chunkId_chunkDoc_batches(
+            data_access,
+            file_name,
+            docs,
+            params.token_chunk_size,
+            params.chunk_overlap,
+            update_graph_chunk_batch_size,
+            params.source_type,
+        )
+    else:
+        total_chunks, chunkId_chunkDoc_list = await asyncio.to_thread(
+            get_chunkId_chunkDoc_list,
+            data_access,
+            file_name,
+            docs,
+            params.token_chunk_size,
+            params.chunk_overlap,
+            params.retry_condition,
+        )
+        batches = []
+        for i in range(0, len(chunkId_chunkDoc_list), update_graph_chunk_batch_size):
+            # 确定批量处理chunk
+            select_chunks_upto = min(i + update_graph_chunk_batch_size, len(chunkId_chunkDoc_list))
+            batches.append((i, select_chunks_upto, chunkId_chunkDoc_list[i:select_chunks_upto]))
 
     # 4. 获取Document node节点
-    result = data_access.get_current_status_document_node(file_name)
+    result = await async_data_access.get_current_status_document_node(file_name)
     
     #  5. 更新Document node的元数据
     select_chunks_with_retry = 0
@@ -485,70 +698,92 @@ async def processing_source(
             obj_source_node.total_chunks = total_chunks
             obj_source_node.model = params.model
             if params.retry_condition == START_FROM_LAST_PROCESSED_POSITION:
-                select_chunks_with_retry = result[0]["processed_chunk"]
+                # 已完成全部阶段的chunk, 本次只处理其余chunk
+                select_chunks_with_retry = total_chunks - len(chunkId_chunkDoc_list)
             obj_source_node.processed_chunk = select_chunks_with_retry
             logger.info(obj_source_node)
 
             # 更新Doc的统计计数以及状态
-            data_access.update_source_node(obj_source_node)  # 更新状态和进度 状态为; Processing
-            data_access.update_node_relationship_count(file_name)  # 校准节点关系计数
+            await async_data_access.update_source_node(obj_source_node)  # 更新状态和进度 状态为; Processing
            
             logger.info("Update the status as Processing")
 
-            # 核心: 批处理chunk, 从中抽取知识图谱并建立关系
-            update_graph_chunk_batch_size = settings.UPDATE_GRPAH_CHUNK_BATCH_SIZE
+            # 核心: 流水线批处理chunk, 从中抽取知识图谱并建立关系
             is_cancelled_status = False
             job_status = "Completed"
             tokens_per_file = 0
-            for i in range(0, len(chunkId_chunkDoc_list), update_graph_chunk_batch_size):
-                # 确定批量处理chunk
-                select_chunks_upto = i + update_graph_chunk_batch_size
-                logger.info(f"Selected Chunks upto:{select_chunks_upto}")
-                if len(chunkId_chunkDoc_list) <= select_chunks_upto:
-                    select_chunks_upto = len(chunkId_chunkDoc_list)
-
-                selected_chunks = chunkId_chunkDoc_list[i:select_chunks_upto]
-
-                # 再次获取Document node节点, 查看最新的status(防止用户取消)
-                result = data_access.get_current_status_document_node(file_name)
-                is_cancelled_status = result[0]["is_cancelled"]
-                logger.info(f"Value of is_cancelled: {result[0]['is_cancelled']}")
-
-                # 如果用户取消了Doc, 则跳出循环
-                if bool(is_cancelled_status) == True:
+            chunks_created = 0
+            failed_chunk_ids = []   # LLM抽取失败的chunk, 没有置位 extracted 阶段, 断点续跑时重新抽取
+            node_count = result[0].get("nodeCount") or 0
+            rel_count = result[0].get("relationshipCount") or 0
+
+            # 进程内取消信号, 由取消接口(或 worker 的取消轮询)置位, Document.is_cancelled 只是它的镜像
+            cancel_key = cancellation_key(credentials.uri, credentials.database, file_name)
+            cancel_event = get_cancellation_registry().register(cancel_key)
+
+            async def on_batch_processed(start, select_chunks_upto, batch_node_count, batch_rel_count, latency_processed_chunk, token_usage, batch_failed_chunk_ids):
+                nonlocal tokens_per_file, node_count, rel_count, chunks_created
+                chunks_created = select_chunks_upto
+                if batch_failed_chunk_ids:
+                    failed_chunk_ids.extend(batch_failed_chunk_ids)
+                    logger.warning(f"Graph extraction failed for {len(batch_failed_chunk_ids)} chunks of {file_name}")
+                logger.info("Token used in processing chunks: %s", token_usage)
+                tokens_per_file += token_usage
+                logger.info("Total token used per file: %s", tokens_per_file)
+                uri_latency[f'processed_chunk_detail_{start}-{select_chunks_upto}'] = latency_processed_chunk
+                node_count, rel_count = batch_node_count, batch_rel_count
+
+                end_time = datetime.now()
+                processed_time = end_time - start_time
+                obj_source_node = SourceNode()
+                obj_source_node.file_name = file_name
+                obj_source_node.updated_at = end_time
+                obj_source_node.processing_time = processed_time
+                obj_source_node.processed_chunk = select_chunks_upto + select_chunks_with_retry - len(failed_chunk_ids)
+                obj_source_node.token_usage = tokens_per_file
+                obj_source_node.node_count = node_count
+                obj_source_node.relationship_count = rel_count
+                # 只写入 True, 避免覆盖其他进程(取消接口)已写入的 is_cancelled
+                obj_source_node.is_cancelled = True if cancel_event.is_set() else None
+                await async_data_access.update_source_node(obj_source_node)
+                if resources is not None and resources.on_progress:
+                    resources.on_progress(file_name, {
+                        "status": "Processing",
+                        "processed_chunk": obj_source_node.processed_chunk,
+                        "total_chunks": total_chunks,
+                        "token_usage": tokens_per_file,
+                    })
+
+            async def poll_document_cancelled():
+                # 兜底: 取消请求由其他进程处理(同步 /extract 的多 uvicorn worker)时进程内信号不会置位,
+                # 按固定间隔读取 Document.is_cancelled 并置位取消信号
+                while not cancel_event.is_set():
+                    await asyncio.sleep(settings.DOCUMENT_CANCEL_POLL_SECONDS)
+                    try:
+                        status = await async_data_access.get_current_status_document_node(file_name)
+                    except Exception as e:
+                        logger.warning(f"Unable to poll cancellation of {file_name}: {e}")
+                        continue
+                    if status and status[0]["is_cancelled"]:
+                        logger.info(f"Document {file_name} was cancelled by another process")
+                        cancel_event.set()
+
+            cancel_poller = asyncio.create_task(poll_document_cancelled()) if settings.DOCUMENT_CANCEL_POLL_SECONDS > 0 else None
+            try:
+                if await processing_chunks_pipeline(batches, data_access, params, cancel_event, on_batch_processed, resources):
                     job_status = "Cancelled"
-                    break
-
-                # 如果没取消, 则批处理chunk
-                else:
-                    (node_count, rel_count, latency_processed_chunk, token_usage) = (
-                        await processing_chunks(selected_chunks, data_access, params)
-                    )
-                    logger.info("Token used in processing chunks: %s", token_usage)
-                    tokens_per_file += token_usage
-                    logger.info("Total token used per file: %s", tokens_per_file)
-                    uri_latency[f'processed_chunk_detail_{i}-{select_chunks_upto}'] = latency_processed_chunk
-            
-                    end_time = datetime.now()
-                    processed_time = end_time - start_time
-                    obj_source_node = SourceNode()
-                    obj_source_node.file_name = file_name
-                    obj_source_node.updated_at = end_time
-                    obj_source_node.processing_time = processed_time
-                    obj_source_node.processed_chunk = select_chunks_upto + select_chunks_with_retry
-                    obj_source_node.token_usage = tokens_per_file
-                    obj_source_node.node_count = node_count
-                    obj_source_node.relationship_count = rel_count
-                    data_access.update_source_node(obj_source_node)
-                    data_access.update_node_relationship_count(file_name)
+            finally:
+                if cancel_poller is not None:
+                    cancel_poller.cancel()
+                get_cancellation_registry().unregister(cancel_key, cancel_event)
             
             
             # TODO 统计用户使用的token
           
 
-            # 获取最新的Document信息
-            result = data_access.get_current_status_document_node(file_name)
-            is_cancelled_status = result[0]["is_cancelled"]
+            # 获取最新的Document信息(其他进程只更新了 Document.is_cancelled 时也视为取消)
+            result = await async_data_access.get_current_status_document_node(file_name)
+            is_cancelled_status = result[0]["is_cancelled"] or job_status == "Cancelled"
             if bool(is_cancelled_status) == True:
                 logger.info("Document is Cancelled at the end extraction")
                 job_status = "Cancelled"
@@ -558,12 +793,29 @@ async def processing_source(
             obj_source_node = SourceNode()
             obj_source_node.file_name = file_name
             obj_source_node.status = job_status
+            obj_source_node.updated_at = end_time
             obj_source_node.processing_time = processed_time
             obj_source_node.token_usage = tokens_per_file
-
-            # 更新最终doc node 信息
-            data_access.update_source_node(obj_source_node)
-            data_access.update_node_relationship_count(file_name)
+            obj_source_node.is_cancelled = job_status == "Cancelled"
+            # 部分chunk抽取失败时文件仍完成, 在 errorMessage 中报告, 成功的处理清除之前的错误信息
+            obj_source_node.error_message = (
+                f"Graph extraction failed for {len(failed_chunk_ids)} chunks, "
+                f"retry with {START_FROM_LAST_PROCESSED_POSITION} to re-extract them"
+                if failed_chunk_ids else ""
+            )
+            if is_streaming:
+                obj_source_node.total_chunks = chunks_created
+                if chunks_created == 0 and job_status == "Completed":
+                    # Document 已经是 Processing, 需要先标记失败, 否则之后的重试都会被拒绝
+                    error_message = f"File content is not available for file : {file_name}"
+                    await async_data_access.update_exception_db(file_name, error_message, params.retry_condition)
+                    raise Exception(error_message)
+
+            # 更新最终doc node 信息, 任务结束时全量校准一次计数
+            await async_data_access.update_source_node(obj_source_node)
+            final_counts = (await asyncio.to_thread(data_access.update_node_relationship_count, file_name)).get(file_name, {})
+            node_count = final_counts.get("nodeCount", node_count)
+            rel_count = final_counts.get("relationshipCount", rel_count)
             logger.info('Updated the nodeCount and relCount properties in Document node')
             logger.info(f'file:{params.file_name} extraction has been completed')
             
@@ -588,6 +840,7 @@ async def processing_source(
             response["fileName"] = file_name
             response["total_processing_time"] = round(processed_time.total_seconds(),2)
             response["status"] = job_status
+            response["failed_chunk_count"] = len(failed_chunk_ids)
             response["model"] = params.model
             response["success_count"] = 1
     
@@ -601,7 +854,7 @@ async def processing_source(
         raise Exception(err_msg)
 
 
-async def extract_graph_from_file_local_file(credentials, params, file_path):
+async def extract_graph_from_file_local_file(credentials, params, file_path, resources: SharedExtractionResources = None):
     logger.info(f"Process file name: {params.file_name} from local file system!")
 
     # 重试策略
@@ -609,17 +862,50 @@ async def extract_graph_from_file_local_file(credentials, params, file_path):
         DELETE_ENTITIES_AND_START_FROM_BEGINNING,
         START_FROM_LAST_PROCESSED_POSITION,
     ]:  
-        # 1. loader文件 -> docs
-        file_name, docs, _ = get_documents_from_file_by_path(
-            file_path, params.file_name
-        )
-        if docs == None or len(docs) == 0:
-            raise Exception(f"File content is not available for file : {file_name}")
-        
+        # 1. loader文件 -> 逐页产出的docs, 在流水线中边读取边分块入库
+        docs = iter_documents_from_file_by_path(file_path, params.file_name)
+
         # 2. 分块docs -> chunks 并入库
-        return await processing_source(credentials, params, docs, file_path, True)
+        return await processing_source(credentials, params, docs, file_path, True, resources)
     else:
-        return await processing_source(credentials, params, [], file_path, True)
+        return await processing_source(credentials, params, [], file_path, True, resources)
+
+
+async def extract_graph_from_files_local_file(credentials, params, file_paths: dict, on_progress=None):
+    """
+    批量抽取多个本地文件
+    /
+    所有文件共享同一个数据库连接池, LLMGraphTransformer 和 embedding模型, 向量索引只检查一次,
+    最多 BATCH_EXTRACT_MAX_FILES 个文件同时处理, 它们的LLM请求进入同一个模型调度器, embedding批次共用同一个并发上限
+    file_paths: {file_name: file_path}, 返回每个文件的抽取结果, 单个文件失败不影响其他文件
+    """
+    graph = create_graph_database_connection(credentials)
+    await asyncio.to_thread(GraphDBDataAccess(graph).create_chunk_vector_index)
+    resources = SharedExtractionResources(
+        graph_llm=create_graph_transformer(params),
+        embedding_semaphore=asyncio.Semaphore(settings.BATCH_EMBEDDING_CONCURRENCY),
+        on_progress=on_progress,
+    )
+    file_semaphore = asyncio.Semaphore(settings.BATCH_EXTRACT_MAX_FILES)
+
+    async def extract_one(file_name, file_path):
+        async with file_semaphore:
+            file_params = params.model_copy(update={"file_name": file_name})
+            try:
+                uri_latency, result = await extract_graph_from_file_local_file(credentials, file_params, file_path, resources)
+                if not result:
+                    result = {"fileName": file_name, "status": "Skipped", "error": "File is already in Processing status"}
+            except Exception as e:
+                logger.error(f"Batch extraction failed for file {file_name}: {e}")
+                result = {"fileName": file_name, "status": "Failed", "error": str(e)}
+            if on_progress:
+                on_progress(file_name, {k: v for k, v in result.items() if k in ("status", "error", "nodeCount", "relationshipCount", "total_processing_time")})
+            return result
+
+    start = time.time()
+    results = await asyncio.gather(*(extract_one(file_name, file_path) for file_name, file_path in file_paths.items()))
+    logger.info(f"Batch extraction of {len(file_paths)} files completed in {time.time() - start:.2f} seconds")
+    return results
 
 
 async def extract_graph_from_web_page(credentials, params): ...
@@ -631,13 +917,145 @@ async def extract_graph_from_file_bilibili(credentials, params): ...
 async def extract_graph_from_file_Wikipedia(credentials, params): ...
 
 
-async def graph_schema_consolidation(credentials):
-    """ 整合图数据库的schema """
+# ============ 抽取任务队列 =================
+def _job_key_prefix(credentials):
+    """ 任务 dedupe_key 的数据库前缀 """
+    return f"{credentials.uri}|{credentials.database}|"
+
+
+def enqueue_extraction_job(credentials, params, file_path):
+    """ 提交本地文件抽取任务, 同一数据库的同一文件已有未结束的任务时返回该任务 """
+    payload = {"credentials": credentials.model_dump(), "params": params.model_dump(), "file_path": file_path}
+    dedupe_key = f"{_job_key_prefix(credentials)}{params.source_type}|{params.file_name}"
+    return get_job_queue().enqueue(payload, dedupe_key, params.file_name, params.source_type)
+
+
+def enqueue_batch_extraction_job(credentials, params, file_paths: dict):
+    """ 提交多文件批量抽取任务, 由一个 worker 共享资源处理全部文件 """
+    payload = {"credentials": credentials.model_dump(), "params": params.model_dump(), "file_paths": file_paths}
+    dedupe_key = f"{_job_key_prefix(credentials)}{params.source_type}|batch:{json.dumps(sorted(file_paths))}"
+    return get_job_queue().enqueue(payload, dedupe_key, None, params.source_type)
+
+
+def get_extraction_job(job_id):
+    return get_job_queue().get(job_id)
+
+
+def list_extraction_jobs(status=None, file_name=None, limit=100):
+    return get_job_queue().list(status, file_name, limit)
+
+
+def _job_file_names(payload):
+    return list(payload["file_paths"]) if "file_paths" in payload else [payload["params"]["file_name"]]
+
+
+async def _reset_reclaimed_documents(credentials, file_names, attempt):
+    """
+    上一次运行的 worker 已崩溃, Document 停留在 Processing, 重置后才能重新处理
+    /
+    返回已被用户取消的文件
+    """
+    async_data_access = create_async_data_access(credentials)
+    cancelled = []
+    for file_name in file_names:
+        result = await async_data_access.get_current_status_document_node(file_name)
+        if result and result[0]["is_cancelled"]:
+            cancelled.append(file_name)
+        elif result and result[0]["Status"] == "Processing":
+            await async_data_access.update_exception_db(
+                file_name, f"Extraction worker crashed, retrying (attempt {attempt})"
+            )
+    return cancelled
+
+
+async def run_extraction_job(job):
+    """ 在 worker 进程中执行抽取任务(单文件或批量), 返回 (任务状态, 结果) """
+    payload = job["payload"]
+    credentials = Neo4jCredentials(**payload["credentials"])
+    params = SourceScanExtractParams(**payload["params"])
+
+    # 排队期间被取消的文件(取消接口只在任务上记录 cancelled_files), 每次运行都先排除, 不再进入抽取
+    cancelled = set(await asyncio.to_thread(get_job_queue().get_cancelled_files, job["id"]))
+    if job["attempts"] > 1:
+        remaining = [name for name in _job_file_names(payload) if name not in cancelled]
+        cancelled.update(await _reset_reclaimed_documents(credentials, remaining, job["attempts"]))
+
+    start = time.time()
+    if "file_paths" in payload:
+        file_paths = {name: path for name, path in payload["file_paths"].items() if name not in cancelled}
+        progress = {name: {"status": "Cancelled"} for name in sorted(cancelled)}
+        progress.update({name: {"status": "Queued"} for name in file_paths})
+        await asyncio.to_thread(get_job_queue().update_progress, job["id"], job["worker_id"], progress)
+        if not file_paths:
+            return JOB_CANCELLED, {"files": [], "success_count": 0, "failed_count": 0, "cancelled": sorted(cancelled)}
+
+        def on_progress(file_name, file_progress):
+            progress[file_name] = {**progress.get(file_name, {}), **file_progress}
+            get_job_queue().update_progress(job["id"], job["worker_id"], progress)
+
+        results = await extract_graph_from_files_local_file(credentials, params, file_paths, on_progress)
+        logger.info(f"extraction job {job['id']} completed in {time.time() - start:.2f} seconds for {len(file_paths)} files")
+        failed = [result for result in results if result.get("status") in ("Failed", "Skipped")]
+        status = JOB_FAILED if results and len(failed) == len(results) else JOB_COMPLETED
+        return status, {
+            "files": results,
+            "success_count": len(results) - len(failed),
+            "failed_count": len(failed),
+            "cancelled": sorted(cancelled),
+        }
+
+    if cancelled:
+        return JOB_CANCELLED, {"fileName": params.file_name, "status": "Cancelled"}
+    uri_latency, result = await extract_graph_from_file_local_file(credentials, params, payload["file_path"])
+    if not result:
+        raise Exception(f"File {params.file_name} is already in Processing status")
+    logger.info(f"extraction job {job['id']} completed in {time.time() - start:.2f} seconds for file name {params.file_name}")
+    result.update(uri_latency)
+    return (JOB_CANCELLED if result.get("status") == "Cancelled" else JOB_COMPLETED), result
+
+
+async def cancel_extraction(credentials, file_names):
+    """
+    取消文件的抽取
+    /
+    1. 置位本进程中的取消信号, 在途的LLM请求立即中止
+    2. 任务队列中记录取消, 排队中的任务不再执行, 运行中的任务由 worker 轮询后置位其进程内的取消信号
+    3. 将正在处理/排队中的 Document 标记为 Cancelled (is_cancelled 作为镜像)
+    """
+    registry = get_cancellation_registry()
+    signalled = [
+        file_name for file_name in file_names
+        if registry.cancel(cancellation_key(credentials.uri, credentials.database, file_name))
+    ]
+    jobs = await asyncio.to_thread(get_job_queue().request_cancel, _job_key_prefix(credentials), file_names)
+
+    pending = sorted({file_name for job in jobs for file_name in job["cancelled_files"]})
+    cancelled = await create_async_data_access(credentials).set_documents_cancelled(file_names, pending)
+    logger.info(f"Cancelled extraction for {cancelled}, in-process: {signalled}, jobs: {jobs}")
+    return {"cancelled": cancelled, "signalled": signalled, "jobs": jobs}
+
+
+async def fail_extraction_job_document(job, error_message):
+    """ 任务多次丢失后放弃, 同步 Document 状态为 Failed """
+    credentials = Neo4jCredentials(**job["payload"]["credentials"])
+    async_data_access = create_async_data_access(credentials)
+    for file_name in _job_file_names(job["payload"]):
+        try:
+            await async_data_access.update_exception_db(file_name, error_message)
+        except Exception as e:
+            logger.error(f"Unable to update Document status of {file_name}: {e}")
+
+
+async def graph_schema_consolidation(credentials, file_names=None):
+    """ 整合图数据库的schema, file_names 不为空时只整合这些文件中出现的标签和关系类型 """
     graph = create_graph_database_connection(credentials)
     data_access = GraphDBDataAccess(graph)
 
     # 1. 获取原来的 node, relationship labels
-    node_labels, relationship_labels = data_access.get_nodelabels_relationships()
+    node_labels, relationship_labels = await asyncio.to_thread(data_access.get_nodelabels_relationships, file_names)
+    if not node_labels and not relationship_labels:
+        logger.info("No node labels or relationship types to consolidate")
+        return {}
 
     graph_clean_model = settings.GRAPH_CLEAN_MODEL
     llm,_,_ = get_llm(graph_clean_model)
@@ -657,38 +1075,55 @@ async def graph_schema_consolidation(credentials):
     logger.info(f"Node Labels: Total = {len(node_labels)}, Reduced to = {len(set(node_mapping.values()))} (from {len(node_mapping)})")
     logger.info(f"Relationship Types: Total = {len(relationship_labels)}, Reduced to = {len(set(relation_mapping.values()))} (from {len(relation_mapping)})")
 
-    # 4. 根据LLM的结果，重建node relationship
-    data_access.node_relationship_consolidation(node_mapping, relation_mapping)
+    # 4. 根据LLM的结果，分批改写 node label, relationship type
+    return await asyncio.to_thread(data_access.node_relationship_consolidation, node_mapping, relation_mapping)
 
 
 
 
 
 # ============ 知识图谱索引构建 =================
-async def update_graph(credentials):
+async def update_graph(credentials, file_names=None):
+    """ 建立chunk之间的SIMILAR关系, file_names 不为空时只处理这些文件 """
     graph = create_graph_database_connection(credentials)
     data_access = GraphDBDataAccess(graph)
-    data_access.update_KNN_graph()
+    return await asyncio.to_thread(data_access.update_KNN_graph, file_names)
 
 
 async def create_vector_fulltext_indexes(credentials):
-    """ 对entity和chunk建立fulltext索引 """
+    """ 对entity和chunk维护fulltext索引, 只创建缺失或定义变化的索引, 返回每个索引的处理结果 """
     types = ["entities", "hybrid"]
     logger.info("Starting the process of creating full-text indexes.")
 
     graph = create_graph_database_connection(credentials)
     data_access = GraphDBDataAccess(graph)
     
-    # 创建fulltext索引
+    # 维护fulltext索引
+    reports = {}
     for index_type in types:
-        data_access.create_fulltext_indexes(index_type)
+        reports[index_type] = await asyncio.to_thread(data_access.create_fulltext_indexes, index_type)
+    return reports
+
+
+def get_post_processing_files(credentials, file_names=None):
+    """ 增量后处理的文件范围: 指定的文件, 或自上次后处理以来新完成的文件 """
+    if file_names:
+        return file_names
+    graph = create_graph_database_connection(credentials)
+    return GraphDBDataAccess(graph).get_pending_post_processing_files()
+
+
+def set_post_processing_watermark(credentials, file_names):
+    """ 记录增量后处理的水位线 """
+    graph = create_graph_database_connection(credentials)
+    GraphDBDataAccess(graph).set_post_processing_watermark(file_names)
     
 
 
 # ============= Graph Chat相关 ===============
 async def simple_graph_chat(credentials, model, question, document_names, session_id, mode):
     """ 简单的图数据库聊天(cypher 生成)  """
-    graph = create_graph_database_connection(credentials,refresh_schema=True)
+    graph = await asyncio.to_thread(create_graph_database_connection, credentials, True)
     simple_rag_agent = SimpleGraphRagAgent(model, graph, mode=mode, file_names=document_names)
     agent = simple_rag_agent._create_agent()
     input = {
@@ -0,0 +1,63 @@
+from threading import Lock
+from typing import Dict, List, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cancellation_key(uri: str, database: str, file_name: str) -> Tuple[str, str, str]:
+    """ 同一个文件名在不同数据库中是不同的抽取任务 """
+    return (uri or "", database or "", file_name)
+
+
+class CancellationRegistry:
+    """
+    进程内的抽取取消信号
+    /
+    每个正在抽取的文件注册一个 asyncio.Event, 取消接口(或 worker 的取消轮询线程)置位后,
+    流水线立即停止投递新批次并取消在途的LLM请求, 不再需要每批查询 Document 节点
+    cancel 可以在任意线程中调用, 通过事件循环的 call_soon_threadsafe 置位
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._events: Dict[tuple, Tuple[asyncio.Event, asyncio.AbstractEventLoop]] = {}
+
+    def register(self, key: tuple) -> asyncio.Event:
+        """ 在抽取所在的事件循环中调用 """
+        event = asyncio.Event()
+        with self._lock:
+            self._events[key] = (event, asyncio.get_running_loop())
+        return event
+
+    def unregister(self, key: tuple, event: asyncio.Event) -> None:
+        with self._lock:
+            if key in self._events and self._events[key][0] is event:
+                del self._events[key]
+
+    def cancel(self, key: tuple) -> bool:
+        """ 置位取消信号, 当前进程中没有该文件的抽取时返回 False """
+        with self._lock:
+            entry = self._events.get(key)
+        if entry is None:
+            return False
+        event, loop = entry
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # 事件循环已关闭, 抽取已经结束
+            return False
+        logger.info(f"Cancellation requested for {key[2]}")
+        return True
+
+    def active(self) -> List[tuple]:
+        with self._lock:
+            return list(self._events)
+
+
+_registry = CancellationRegistry()
+
+
+def get_cancellation_registry() -> CancellationRegistry:
+    return _registry
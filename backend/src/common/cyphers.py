@@ -1,6 +1,56 @@
 FILTER_LABELS = ["Chunk","Document","__Community__"]
 
 
+# 创建Document节点
+CREATE_SOURCE_NODE = (
+    "MERGE(d:Document{fileName :$fn})"
+    "SET d.fileSize = $fs, d.fileType = $ft, d.status = $st,"
+    "d.url = $url, d.awsAccessKeyId = $awsacc_key_id, d.fileSource = $f_source,"
+    "d.createdAt = $c_at, d.updatedAt = $u_at, d.processingTime = $pt,"
+    "d.errorMessage = $e_message, d.nodeCount= $n_count,"
+    "d.relationshipCount = $r_count, d.model= $model,"
+    "d.gcsBucket=$gcs_bucket, d.gcsBucketFolder= $gcs_bucket_folder, d.gcsProjectId= $gcs_project_id,"
+    "d.language= $language, "
+    "d.is_cancelled=False, "
+    "d.total_chunks=0, d.processed_chunk=0,"
+    "d.access_token=$access_token,"
+    "d.chunkNodeCount=$chunkNodeCount,d.chunkRelCount=$chunkRelCount,"
+    "d.entityNodeCount=$entityNodeCount,d.entityEntityRelCount=$entityEntityRelCount,"
+    "d.communityNodeCount=$communityNodeCount,d.communityRelCount=$communityRelCount"
+)
+
+# 更新Document节点属性
+UPDATE_SOURCE_NODE = "MERGE (d:Document {fileName: $props.fileName}) SET d += $props"
+
+# 更新Document节点的错误信息
+UPDATE_DOCUMENT_EXCEPTION = """MERGE(d:Document {fileName :$fName}) 
+                             SET d.status = $status, d.errorMessage = $error_msg"""
+
+UPDATE_DOCUMENT_EXCEPTION_AND_RETRY_CONDITION = """MERGE(d:Document {fileName :$fName}) 
+                            SET d.status = $status, d.errorMessage = $error_msg, 
+                                d.retry_condition = $retry_condition"""
+
+# 查询Document节点的当前状态
+GET_CURRENT_STATUS_DOCUMENT_NODE = """
+                MATCH(d:Document {fileName : $file_name}) 
+                RETURN d.status AS Status , d.processingTime AS processingTime, 
+                d.model as model,
+                d.nodeCount AS nodeCount,
+                d.relationshipCount as relationshipCount,
+                d.total_chunks AS total_chunks , d.fileSize as fileSize, 
+                d.processed_chunk as processed_chunk, d.fileSource as fileSource,
+                d.chunkNodeCount AS chunkNodeCount,
+                d.chunkRelCount AS chunkRelCount,
+                d.entityNodeCount AS entityNodeCount,
+                d.entityEntityRelCount AS entityEntityRelCount,
+                d.communityNodeCount AS communityNodeCount,
+                d.communityRelCount AS communityRelCount,
+                d.createdAt AS created_time,
+                d.is_cancelled as is_cancelled,
+                coalesce(d.token_usage, 0) AS token_usage
+                """
+
+
 
 # 节点关系计数(包含Community)
 NODEREL_COUNT_QUERY_WITH_COMMUNITY = """
@@ -98,22 +148,121 @@ SET d.chunkNodeCount = $chunkNodeCount,
 """
 
 
+# 根据写入结果增量更新Document节点计数
+INCREMENT_DOCUMENT_NODE_COUNT = """
+MATCH (d:Document {fileName:$f_name})
+SET d.chunkNodeCount = coalesce(d.chunkNodeCount, 0) + $chunkNodeCount,
+    d.chunkRelCount = coalesce(d.chunkRelCount, 0) + $chunkRelCount,
+    d.entityNodeCount = coalesce(d.entityNodeCount, 0) + $entityNodeCount,
+    d.entityEntityRelCount = coalesce(d.entityEntityRelCount, 0) + $entityEntityRelCount
+SET d.nodeCount = d.chunkNodeCount + d.entityNodeCount + coalesce(d.communityNodeCount, 0),
+    d.relationshipCount = d.chunkRelCount + d.entityEntityRelCount + coalesce(d.communityRelCount, 0)
+RETURN d.nodeCount AS nodeCount, d.relationshipCount AS relationshipCount
+"""
+
+
+# 一条query创建一批Chunk: Chunk节点 + PART_OF + FIRST_CHUNK + NEXT_CHUNK链
+# 每个chunk只有一次按id的索引查找, 链上的前后节点直接从collect的列表中取, 返回新建的 PART_OF / NEXT_CHUNK 数
+CREATE_CHUNK_GRAPH_BATCH = """
+MATCH (d:Document {fileName: $f_name})
+CALL {
+    WITH d
+    UNWIND $batch_data AS data
+    MERGE (c:Chunk {id: data.id})
+    SET c.text = data.pg_content, c.position = data.position, c.length = data.length,
+        c.fileName = $f_name, c.content_offset = data.content_offset,
+        c.page_number = data.page_number,
+        c.start_time = data.start_time,
+        c.end_time = data.end_time
+    WITH d, c, data, EXISTS { (c)-[:PART_OF]->(d) } AS linked
+    MERGE (c)-[:PART_OF]->(d)
+    WITH c, linked, data.position AS position ORDER BY position
+    RETURN collect(c) AS chunks, sum(CASE WHEN linked THEN 0 ELSE 1 END) AS newPartOf
+}
+OPTIONAL MATCH (prev:Chunk {id: $previous_chunk_id})
+WITH d, chunks, newPartOf, CASE WHEN prev IS NULL THEN chunks ELSE [prev] + chunks END AS chain
+CALL {
+    WITH d, chunks
+    WITH d, chunks WHERE $start_position = 1 AND size(chunks) > 0
+    WITH d, chunks[0] AS first
+    MERGE (d)-[:FIRST_CHUNK]->(first)
+}
+CALL {
+    WITH chain
+    UNWIND range(0, size(chain) - 2) AS i
+    WITH chain[i] AS pc, chain[i + 1] AS c
+    WITH pc, c, EXISTS { (pc)-[:NEXT_CHUNK]->(c) } AS linked
+    MERGE (pc)-[:NEXT_CHUNK]->(c)
+    RETURN sum(CASE WHEN linked THEN 0 ELSE 1 END) AS newNextChunk
+}
+RETURN newPartOf, newNextChunk
+"""
+
+
 # 更新或创建Chunk Node的 embedding
 CREATE_OR_UPDATE_CHUNK_EMBEDDING = """
 UNWIND $data AS row
 MATCH (d:Document {fileName: $f_name})
 MERGE (c:Chunk {id: row.id})
-SET c.embedding = row.embeddings
+SET c.embedding = row.embeddings,
+    c.stages = coalesce(c.stages, 0) + CASE WHEN coalesce(c.stages, 0) % 2 = 0 THEN 1 ELSE 0 END
 MERGE (c)-[:PART_OF]->(d)
 """
 
+# 置位 chunk 的处理阶段(Cypher 没有位运算, 用 整除/取余 判断该位是否已置位)
+MARK_CHUNK_STAGE = """
+UNWIND $ids AS id
+MATCH (c:Chunk {id: id})
+WITH c, coalesce(c.stages, 0) AS stages
+SET c.stages = stages + CASE WHEN (stages / $bit) % 2 = 0 THEN $bit ELSE 0 END
+"""
+
+# 文件全部chunk及其处理阶段, 没有 stages 的旧数据按 embedding / HAS_ENTITY 推断并回填
+GET_CHUNK_STAGES = """
+MATCH (d:Document {fileName: $f_name})<-[:PART_OF]-(c:Chunk)
+SET c.stages = coalesce(
+    c.stages,
+    CASE WHEN c.embedding IS NOT NULL THEN 1 ELSE 0 END
+    + CASE WHEN exists { (c)-[:HAS_ENTITY]->() } THEN 2 ELSE 0 END
+)
+RETURN c.id AS id, c.text AS text, c.position AS position, c.stages AS stages
+ORDER BY c.position
+"""
+
+# 从头重新处理前清空文件chunk的处理阶段
+RESET_CHUNK_STAGES = """
+MATCH (d:Document {fileName: $f_name})<-[:PART_OF]-(c:Chunk)
+SET c.stages = 0
+"""
+
+
+# 批量写入实体节点(按label分组, 不依赖apoc动态label)
+BULK_MERGE_ENTITY_NODES = """
+UNWIND $rows AS row
+MERGE (n:{label} {{id: row.id}})
+SET n:__Entity__
+SET n += row.properties
+"""
+
+# 批量写入实体间关系(按 起点label, 关系类型, 终点label 分组)
+BULK_MERGE_ENTITY_RELATIONSHIPS = """
+UNWIND $rows AS row
+MATCH (s:{source_label} {{id: row.source_id}})
+MATCH (t:{target_label} {{id: row.target_id}})
+MERGE (s)-[r:{rel_type}]->(t)
+SET r += row.properties
+"""
 
-# 知识图谱实体与chunk建立关系
-MERGE_CHUNK_AND_ENTITES_RELATION = """
-UNWIND $batch_data AS data
-MATCH (c:Chunk {id: data.chunk_id})
-CALL apoc.merge.node([data.node_type], {id: data.node_id}) YIELD node as n
+# 批量建立chunk与实体的 HAS_ENTITY 关系, 并返回该文档新关联的实体数
+BULK_MERGE_CHUNK_ENTITY_RELATIONS = """
+UNWIND $rows AS row
+MATCH (c:Chunk {{id: row.chunk_id}})
+MATCH (n:{label} {{id: row.node_id}})
+WITH c, n, NOT EXISTS {{
+    (n)<-[:HAS_ENTITY]-(:Chunk)-[:PART_OF]->(:Document {{fileName: $f_name}})
+}} AS new_to_document
 MERGE (c)-[:HAS_ENTITY]->(n)
+RETURN count(DISTINCT CASE WHEN new_to_document THEN n END) AS newEntityCount
 """
 
 
@@ -134,34 +283,48 @@ MERGE (c)-[rel:SIMILAR]-(node)
 SET rel.score = score
 """
 
-
-DROP_INDEX_ENTITIES = """
-DROP INDEX entities IF EXISTS
+# 按 Chunk.id 键集分页读取 embedding (Block KNN)
+GET_CHUNK_EMBEDDINGS_PAGE = """
+MATCH (c:Chunk)
+WHERE c.id > $after AND c.embedding IS NOT NULL
+RETURN c.id AS id, c.embedding AS embedding
+ORDER BY c.id
+LIMIT $limit
 """
 
-DROP_INDEX_HYBRID_SEARCH = """
-DROP INDEX keyword IF EXISTS
+GET_FILE_CHUNK_EMBEDDINGS_PAGE = """
+MATCH (c:Chunk)
+WHERE c.fileName IN $file_names AND c.id > $after AND c.embedding IS NOT NULL
+RETURN c.id AS id, c.embedding AS embedding
+ORDER BY c.id
+LIMIT $limit
 """
 
-DROP_INDEX_COMMUNITY = """
-DROP INDEX community_keyword IF EXISTS
+# 批量写入无向 SIMILAR 关系
+MERGE_SIMILAR_CHUNK_RELATIONSHIPS = """
+UNWIND $rows AS row
+MATCH (a:Chunk {id: row.source})
+MATCH (b:Chunk {id: row.target})
+MERGE (a)-[rel:SIMILAR]-(b)
+SET rel.score = row.score
+RETURN count(rel) AS count
 """
 
-# 给entities建立full_text
-CREATE_FULL_TEXT_INDEX_ENTITIES = """
-CREATE FULLTEXT INDEX entities 
-FOR (n{labels_str}) ON EACH [n.id, n.description]
+# 只为指定文件的chunk建立相似关系(向量索引模式的增量版本)
+CREATE_OR_UPDATE_SIMILAR_CHUNK_RELATIONSHIP_FOR_FILES = """
+MATCH (c:Chunk)
+WHERE c.fileName IN $file_names AND c.embedding IS NOT NULL AND COUNT { (c)-[:SIMILAR]-() } < 5
+CALL db.index.vector.queryNodes('vector', 6, c.embedding) yield node, score
+WHERE node <> c and score >= $score 
+MERGE (c)-[rel:SIMILAR]-(node)
+SET rel.score = score
 """
 
-# 给chunk的text建立 full_text
-CREATE_FULL_TEXT_INDEX_HYBRID_SEARCH = """
-CREATE FULLTEXT INDEX keyword 
-FOR (n:Chunk) ON EACH [n.text]
-"""
 
-CREATE_FULL_TEXT_INDEX_COMMUNITY = """
-CREATE FULLTEXT INDEX community_keyword 
-FOR (n:`__Community__`) ON EACH [n.summary]
+# 全文索引定义及填充状态
+LIST_FULLTEXT_INDEXES = """
+SHOW FULLTEXT INDEXES YIELD name, labelsOrTypes, properties, state, populationPercent
+RETURN name, labelsOrTypes, properties, state, populationPercent
 """
 
 
@@ -181,6 +344,78 @@ RETURN relationshipType order by relationshipType
 """
 
 
+# 指定文件的实体标签 / 实体间关系类型 (增量的schema整合)
+GET_FILE_NODE_LABELS = """
+MATCH (d:Document)<-[:PART_OF]-(:Chunk)-[:HAS_ENTITY]->(e)
+WHERE d.fileName IN $file_names
+UNWIND labels(e) AS label
+WITH DISTINCT label
+WHERE NOT label IN ['Document', 'Chunk', '_Bloom_Perspective_', '__Community__', '__Entity__']
+RETURN label order by label
+"""
+
+GET_FILE_RELATIONSHIPS = """
+MATCH (d:Document)<-[:PART_OF]-(:Chunk)-[:HAS_ENTITY]->(e)-[r]-(:`__Entity__`)
+WHERE d.fileName IN $file_names
+WITH DISTINCT type(r) AS relationshipType
+WHERE NOT relationshipType IN ['PART_OF', 'NEXT_CHUNK', 'HAS_ENTITY', '_Bloom_Perspective_','FIRST_CHUNK','SIMILAR','IN_COMMUNITY','PARENT_COMMUNITY'] 
+RETURN relationshipType order by relationshipType
+"""
+
+# 自上次后处理以来新完成(或重新处理)的文件
+GET_PENDING_POST_PROCESSING_FILES = """
+MATCH (d:Document)
+WHERE d.status = 'Completed' AND (d.postProcessedAt IS NULL OR d.updatedAt > d.postProcessedAt)
+RETURN d.fileName AS fileName
+ORDER BY d.fileName
+"""
+
+# 后处理水位线, $now 由应用进程传入(与 updatedAt 同一个时钟), 不使用数据库服务器的 localdatetime()
+SET_POST_PROCESSING_WATERMARK = """
+UNWIND $file_names AS file_name
+MATCH (d:Document {fileName: file_name})
+SET d.postProcessedAt = $now
+"""
+
+# 取消抽取: 只标记正在处理, 或排队中(pending_file_names)的文件, updatedAt 使用应用进程传入的 $now
+SET_DOCUMENTS_CANCELLED = """
+UNWIND $file_names AS file_name
+MATCH (d:Document {fileName: file_name})
+WHERE d.status = 'Processing' OR file_name IN $pending_file_names
+SET d.status = 'Cancelled', d.is_cancelled = true, d.updatedAt = $now
+RETURN d.fileName AS fileName
+"""
+
+
+# schema 整合: 分批改写节点标签 / 关系类型 (需在自动提交事务中执行)
+COUNT_LABEL_NODES = """
+MATCH (n:`{old}`) RETURN count(n) AS count
+"""
+
+COUNT_TYPE_RELATIONSHIPS = """
+MATCH ()-[r:`{old}`]->() RETURN count(r) AS count
+"""
+
+RELABEL_NODES_IN_TRANSACTIONS = """
+MATCH (n:`{old}`)
+CALL {{
+    WITH n
+    SET n:`{new}`
+    REMOVE n:`{old}`
+}} IN TRANSACTIONS OF $batch_size ROWS
+"""
+
+# 关系类型无法修改, 新建关系并复制全部属性后删除旧关系
+RETYPE_RELATIONSHIPS_IN_TRANSACTIONS = """
+MATCH (n)-[r:`{old}`]->(m)
+CALL {{
+    WITH n, r, m
+    CREATE (n)-[r2:`{new}`]->(m)
+    SET r2 = properties(r)
+    DELETE r
+}} IN TRANSACTIONS OF $batch_size ROWS
+"""
+
 
 
 # Retriever query for graph rag
@@ -2,25 +2,103 @@ from langchain_core.documents import Document
 from langchain_neo4j import Neo4jGraph
 from config import settings
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from .text_splitter import get_text_splitter
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Iterable, Iterator
+import multiprocessing
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+_chunk_pool = None
+_chunk_pool_lock = Lock()
+
+
+def _get_chunk_pool(workers: int) -> ProcessPoolExecutor:
+    """ 进程内共享的切分进程池(spawn, 避免fork时继承驱动线程) """
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            _chunk_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _chunk_pool
+
+
+def _split_page_texts(texts: list[str], chunk_size: int, chunk_overlap: int, mode: str, encoding_name: str) -> list[list[str]]:
+    """ 子进程中切分若干页, 返回每页的chunk文本 """
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap, encoding_name, mode)
+    return [text_splitter.split_text(text) for text in texts]
+
+
 class CreateChunksofDocument:
 
-    def __init__(self, docs: list[Document]):
+    def __init__(self, docs: Iterable[Document]):
         self.docs = docs
 
-    
+    def iter_chunks(self, token_chunk_size: int, chunk_overlap: int) -> Iterator[Document]:
+        """
+        逐页切分并惰性产出chunk, docs 可以是生成器
+        /
+        与 split_file_into_chunks 一致: 每页单独切分, 分页文档的 page_number 为页序号(从1开始)
+        CHUNK_PARALLEL_WORKERS > 1 时将页面分片交给进程池切分, 产出顺序不变,
+        因此 create_relation_between_chunks 按顺序累加的 content_offset / NEXT_CHUNK 链保持正确
+        """
+        if settings.CHUNK_PARALLEL_WORKERS > 1:
+            yield from self._iter_chunks_parallel(token_chunk_size, chunk_overlap)
+            return
+
+        text_splitter = get_text_splitter(token_chunk_size, chunk_overlap)
+        paged = None
+        for i, doc in enumerate(self.docs):
+            if paged is None:
+                paged = 'page' in doc.metadata
+            for chunk in text_splitter.split_documents([doc]):
+                if paged:
+                    yield Document(page_content=chunk.page_content, metadata={'page_number': i + 1})
+                else:
+                    yield chunk
+
+    def _iter_chunks_parallel(self, token_chunk_size: int, chunk_overlap: int) -> Iterator[Document]:
+        """ 每 CHUNK_PARALLEL_PAGES_PER_TASK 页一个任务, 最多 2*workers 个任务在途, 按提交顺序产出 """
+        workers = settings.CHUNK_PARALLEL_WORKERS
+        pages_per_task = max(1, settings.CHUNK_PARALLEL_PAGES_PER_TASK)
+        splitter_args = (token_chunk_size, chunk_overlap, settings.CHUNK_SPLITTER_MODE, settings.CHUNK_TOKEN_ENCODING)
+        pool = _get_chunk_pool(workers)
+
+        in_flight = deque()  # (future, [(page_index, doc)])
+        paged = None
+
+        def drain(future, pages):
+            for (i, doc), texts in zip(pages, future.result()):
+                for text in texts:
+                    if paged:
+                        yield Document(page_content=text, metadata={'page_number': i + 1})
+                    else:
+                        yield Document(page_content=text, metadata=dict(doc.metadata))
+
+        pages = []
+        for i, doc in enumerate(self.docs):
+            if paged is None:
+                paged = 'page' in doc.metadata
+            pages.append((i, doc))
+            if len(pages) >= pages_per_task:
+                in_flight.append((pool.submit(_split_page_texts, [d.page_content for _, d in pages], *splitter_args), pages))
+                pages = []
+                if len(in_flight) >= 2 * workers:
+                    yield from drain(*in_flight.popleft())
+        if pages:
+            in_flight.append((pool.submit(_split_page_texts, [d.page_content for _, d in pages], *splitter_args), pages))
+        while in_flight:
+            yield from drain(*in_flight.popleft())
+
     def split_file_into_chunks(self, token_chunk_size: int, chunk_overlap: int):
         logger.info("Split file into smaller chunks")
 
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            chunk_size=token_chunk_size, chunk_overlap=chunk_overlap
-        )
+        text_splitter = get_text_splitter(token_chunk_size, chunk_overlap)
         max_token_chunk_size = settings.MAX_TOKEN_CHUNK_SIZE
         # chunk_to_be_created = int(max_token_chunk_size / token_chunk_size)
 
@@ -1,6 +1,12 @@
 from langchain_community.document_loaders import PyMuPDFLoader, UnstructuredFileLoader
 from langchain_core.documents import Document
+from config import settings
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from threading import Lock
+import multiprocessing
 import os
 
 import logging
@@ -8,6 +14,86 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+PDF_LOADER_SEQUENTIAL = "sequential"  # 默认: PyMuPDFLoader 在当前进程逐页解析
+PDF_LOADER_PARALLEL = "parallel"      # 可选: 按页区间多进程解析
+
+_pdf_pool = None
+_pdf_pool_lock = Lock()
+
+
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    """ 进程内共享的PDF解析进程池(spawn, 避免fork时继承驱动线程) """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def _pdf_workers() -> int:
+    return settings.PDF_LOADER_WORKERS or os.cpu_count() or 1
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int):
+    """ 子进程中用 PyMuPDF 提取 [start, end) 页的文本 """
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        return [(page_number, pdf[page_number].get_text()) for page_number in range(start, end)]
+
+
+def iter_pdf_pages_parallel(file_path):
+    """
+    按页区间并行解析PDF, 按页码顺序逐页产出 Document
+    /
+    页数较少时在当前进程解析, 否则将页区间分给进程池(最多 workers 个区间在途, 内存不随页数增长),
+    metadata 与 PyMuPDFLoader 保持一致(page 从0开始), CreateChunksofDocument 依赖 page 字段
+    """
+    import fitz
+
+    file_path = str(file_path)
+    with fitz.open(file_path) as pdf:
+        total_pages = pdf.page_count
+        pdf_metadata = {k: v for k, v in (pdf.metadata or {}).items() if isinstance(v, (str, int))}
+
+    def to_document(page_number, text):
+        return Document(
+            page_content=text,
+            metadata={
+                **pdf_metadata,
+                "source": file_path,
+                "file_path": file_path,
+                "page": page_number,
+                "total_pages": total_pages,
+            },
+        )
+
+    workers = _pdf_workers()
+    if total_pages < settings.PDF_PARALLEL_MIN_PAGES or workers <= 1:
+        with fitz.open(file_path) as pdf:
+            for page_number in range(total_pages):
+                yield to_document(page_number, pdf[page_number].get_text())
+        return
+
+    # 区间数取 worker 的2倍, 平衡不同页面的解析耗时
+    span = max(1, -(-total_pages // (workers * 2)))
+    ranges = deque((start, min(start + span, total_pages)) for start in range(0, total_pages, span))
+    pool = _get_pdf_pool(workers)
+    in_flight = deque()
+    while ranges or in_flight:
+        while ranges and len(in_flight) < workers:
+            start, end = ranges.popleft()
+            in_flight.append(pool.submit(_extract_pdf_page_range, file_path, start, end))
+        for page_number, text in in_flight.popleft().result():
+            yield to_document(page_number, text)
+    logger.info(f"Loaded {total_pages} pdf pages with {workers} processes")
+
+
+def load_pdf_parallel(file_path) -> list[Document]:
+    """ 按页区间并行解析PDF """
+    return list(iter_pdf_pages_parallel(file_path))
+
+
 def load_document_content(file_path):
     file_extension = Path(file_path).suffix.lower()
     encoding_flag = False
@@ -81,7 +167,9 @@ def get_documents_from_file_by_path(file_path, file_name):
         file_extension = file_path.suffix.lower()
 
         # txt pdf 文件
-        if file_extension == ".txt" or file_extension == ".pdf":
+        if file_extension == ".pdf" and settings.PDF_LOADER_MODE == PDF_LOADER_PARALLEL:
+            docs = load_pdf_parallel(file_path)
+        elif file_extension == ".txt" or file_extension == ".pdf":
             docs = loader.load()
         else:
             unstructured_docs = loader.load()
@@ -91,4 +179,23 @@ def get_documents_from_file_by_path(file_path, file_name):
     return file_name, docs, file_extension
 
 
+def iter_documents_from_file_by_path(file_path, file_name):
+    """ 逐页加载文件, PDF/txt 按页(元素)惰性产出, 其他类型需整体解析后按页号重组 """
+    file_path = Path(file_path)
+    if not file_path.exists():
+        logger.info('File %s does not exist', file_name)
+        raise Exception(f'File {file_name} does not exist')
+    logger.info('file %s processing', file_name)
 
+    file_extension = file_path.suffix.lower()
+    try:
+        if file_extension == ".pdf" and settings.PDF_LOADER_MODE == PDF_LOADER_PARALLEL:
+            yield from iter_pdf_pages_parallel(file_path)
+        elif file_extension == ".txt" or file_extension == ".pdf":
+            loader, _ = load_document_content(file_path)
+            yield from loader.lazy_load()
+        else:
+            loader, _ = load_document_content(file_path)
+            yield from get_docs_with_page_numbers(loader.load())
+    except Exception as exc:
+        raise Exception(f'Error while reading the file content or metadata, {exc}')
@@ -0,0 +1,111 @@
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from config import settings
+
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SPLITTER_RECURSIVE = "recursive"  # 按分隔符递归切分, 用token数度量长度
+SPLITTER_TOKEN = "token"          # 每页只编码一次, 按token下标切片
+
+
+@lru_cache(maxsize=None)
+def get_tiktoken_encoding(encoding_name: str):
+    """ tiktoken 编码器单例 """
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str) -> int:
+    """ 文本的token数(不缓存文本, 避免长期持有chunk内容) """
+    return len(get_tiktoken_encoding(encoding_name).encode_ordinary(text)) if text else 0
+
+
+def pack_chunks_by_token_budget(chunks: list, token_budget: int, encoding_name: str, max_chunks: int = None) -> List[Tuple[list, int]]:
+    """
+    按token预算把相邻chunk装箱, 返回每个请求的 (chunk列表, token数)
+    /
+    顺序遍历chunk, 加入下一个chunk会超过 token_budget(或达到 max_chunks)时开始新的请求,
+    单个超过预算的chunk独占一个请求(不切分); 只合并相邻chunk, 保持原文顺序
+    token_budget <= 0 时不按token限制, 只按 max_chunks(默认1)分组
+    """
+    max_chunks = max_chunks if token_budget > 0 else (max_chunks or 1)
+    groups, current, current_tokens = [], [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk["chunk_doc"].page_content, encoding_name)
+        over_budget = token_budget > 0 and current_tokens + tokens > token_budget
+        if current and (over_budget or (max_chunks and len(current) >= max_chunks)):
+            groups.append((current, current_tokens))
+            current, current_tokens = [], 0
+        current.append(chunk)
+        current_tokens += tokens
+    if current:
+        groups.append((current, current_tokens))
+    return groups
+
+
+class TokenOffsetSplitter:
+    """
+    基于token下标的切分器
+    /
+    每页文本只编码一次, 按 (chunk_size - chunk_overlap) 的步长在token序列上开窗,
+    通过 decode_with_offsets 得到每个token的字符偏移, 直接从原文切片(不会截断多字节字符)
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, encoding_name: str = "gpt2"):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap {chunk_overlap} must be smaller than chunk_size {chunk_size}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = get_tiktoken_encoding(encoding_name)
+
+    def split_text(self, text: str) -> List[str]:
+        if not text:
+            return []
+        tokens = self.encoding.encode_ordinary(text)
+        if len(tokens) <= self.chunk_size:
+            return [text] if text.strip() else []
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+
+        chunks = []
+        stride = self.chunk_size - self.chunk_overlap
+        for start in range(0, len(tokens), stride):
+            end = min(start + self.chunk_size, len(tokens))
+            chunk = text[offsets[start] : offsets[end] if end < len(tokens) else len(text)]
+            if chunk.strip():
+                chunks.append(chunk)
+            if end == len(tokens):
+                break
+        return chunks
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc in documents
+            for chunk in self.split_text(doc.page_content)
+        ]
+
+
+@lru_cache(maxsize=32)
+def _cached_text_splitter(mode: str, chunk_size: int, chunk_overlap: int, encoding_name: str):
+    logger.info(f"Create {mode} text splitter: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}, encoding={encoding_name}")
+    if mode == SPLITTER_TOKEN:
+        return TokenOffsetSplitter(chunk_size, chunk_overlap, encoding_name)
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+def get_text_splitter(chunk_size: int, chunk_overlap: int, encoding_name: str = None, mode: str = None):
+    """ 按 (模式, chunk_size, overlap, 编码) 缓存切分器, 切分器无状态可跨线程共享 """
+    return _cached_text_splitter(
+        mode or settings.CHUNK_SPLITTER_MODE,
+        int(chunk_size),
+        int(chunk_overlap),
+        encoding_name or settings.CHUNK_TOKEN_ENCODING,
+    )
@@ -1,6 +1,8 @@
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from modelscope import snapshot_download
 
+from config import settings
+
 from threading import Lock
 import logging
 import os
@@ -25,16 +27,32 @@ def load_embedding_model(model_name: str):
     return embeddings, dimension
 
 
+def get_embedding_device():
+    """ 选择embedding模型运行的设备: 配置优先, 否则 cuda > mps > cpu """
+    device = settings.EMBEDDING_DEVICE
+    if device:
+        return device
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+            return "mps"
+    except ImportError:
+        pass
+    return "cpu"
+
+
 def get_local_sentence_transformer_embedding():
     """ 加载 sentence transformer embedding"""
     # DCL
-    global _embedding_instance
+    global _embedding_instance, _dimension
     if _embedding_instance is not None:
-        return _embedding_instance
+        return _embedding_instance, _dimension
     
     with _lock:
         if _embedding_instance is not None:
-            return _embedding_instance
+            return _embedding_instance, _dimension
         # 1. 判断模型是否下载了
         model_path = os.path.join(MODEL_PATH, MODEL_NAME.replace(".","___").replace("/","\\") if "." in MODEL_NAME else MODEL_NAME.replace("/","\\"))
         
@@ -47,9 +65,18 @@ def get_local_sentence_transformer_embedding():
             model_dir = snapshot_download(MODEL_NAME, cache_dir=MODEL_PATH)
             logger.info(f"Model:{MODEL_NAME} downloaded and saved:{model_dir}.")
         
-        _embedding_instance = HuggingFaceEmbeddings(model_name=model_path, query_encode_kwargs={"prompt_name":"query"})
+        # 3. 按设备加载, encode 内部按 EMBEDDING_BATCH_SIZE 做 micro-batch 前向
+        device = get_embedding_device()
+        logger.info(f"Embedding model device: {device}")
+        embedding_instance = HuggingFaceEmbeddings(
+            model_name=model_path,
+            model_kwargs={"device": device},
+            encode_kwargs={"batch_size": settings.EMBEDDING_BATCH_SIZE},
+            query_encode_kwargs={"prompt_name":"query"},
+        )
         logger.info("Embedding model initialized.")
-        _dimension = len(_embedding_instance.embed_query("test"))
+        _dimension = len(embedding_instance.embed_query("test"))
+        _embedding_instance = embedding_instance
         return _embedding_instance, _dimension
 
 
@@ -0,0 +1,203 @@
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+from threading import Lock
+from typing import Dict, List, Optional
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "embedding_cache")
+KEY_SIZE = 20  # sha1 digest 字节数
+
+_registry_lock = Lock()
+_cache_registry: Dict[str, "EmbeddingCache"] = {}
+
+
+def content_sha1(text: str) -> str:
+    """ 文本内容哈希, 与Chunk id 的生成方式一致 """
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _model_slug(model_name: str) -> str:
+    name = os.path.basename(str(model_name).replace("\\", "/").rstrip("/")) or str(model_name)
+    return re.sub(r"[^0-9A-Za-z_.-]+", "_", name)
+
+
+class EmbeddingCache:
+    """
+    基于内容寻址的持久化 embedding 缓存
+    /
+    每个 (模型, 类型) 一个目录:
+      - vectors.f32: float32 行矩阵, 通过 np.memmap 读取
+      - keys.bin:    每行 20 字节 sha1 digest, 行号即向量在矩阵中的位置
+    写入只追加(先向量后key), 多进程间使用 flock 互斥
+    """
+
+    def __init__(self, namespace: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.namespace = namespace
+        self.cache_dir = os.path.join(cache_dir, namespace)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.keys_path = os.path.join(self.cache_dir, "keys.bin")
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.meta_path = os.path.join(self.cache_dir, "meta.json")
+        self.lock_path = os.path.join(self.cache_dir, ".lock")
+
+        self._lock = Lock()
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._keys_bytes_loaded = 0
+        self._vectors: Optional[np.memmap] = None
+        self.dimension: Optional[int] = None
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf8") as f:
+                self.dimension = json.load(f)["dimension"]
+        self._refresh()
+
+    def _refresh(self):
+        """ 读取其他进程新追加的key """
+        if not os.path.exists(self.keys_path) or self.dimension is None:
+            return
+        keys_size = os.path.getsize(self.keys_path)
+        vectors_rows = os.path.getsize(self.vectors_path) // (4 * self.dimension) if os.path.exists(self.vectors_path) else 0
+        rows = min(keys_size // KEY_SIZE, vectors_rows)
+        if rows <= self._rows:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._rows * KEY_SIZE)
+            data = f.read((rows - self._rows) * KEY_SIZE)
+        for i in range(0, len(data), KEY_SIZE):
+            self._index[data[i : i + KEY_SIZE]] = self._rows + i // KEY_SIZE
+        self._rows = rows
+        self._vectors = None  # 行数变化, 重新映射
+
+    def _matrix(self) -> Optional[np.memmap]:
+        if self._rows == 0:
+            return None
+        if self._vectors is None:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dimension))
+        return self._vectors
+
+    def __len__(self):
+        return self._rows
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """ 批量查询, 返回命中的 {sha1: vector} """
+        with self._lock:
+            self._refresh()
+            matrix = self._matrix()
+            if matrix is None:
+                return {}
+            hits = {}
+            for key in keys:
+                row = self._index.get(bytes.fromhex(key))
+                if row is not None:
+                    hits[key] = matrix[row].tolist()
+            return hits
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        """ 批量写入(已存在的key跳过) """
+        if not keys:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        if array.ndim != 2 or array.shape[0] != len(keys):
+            raise ValueError("keys and vectors must have the same length")
+
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.dimension is None:
+                    self.dimension = int(array.shape[1])
+                    with open(self.meta_path, "w", encoding="utf8") as f:
+                        json.dump({"namespace": self.namespace, "dimension": self.dimension}, f)
+                elif array.shape[1] != self.dimension:
+                    raise ValueError(f"Embedding dimension {array.shape[1]} does not match cache dimension {self.dimension}")
+
+                self._refresh()
+                # 截掉崩溃时残留的半行, 保证 keys 与 vectors 行对齐
+                for path, row_bytes in ((self.vectors_path, 4 * self.dimension), (self.keys_path, KEY_SIZE)):
+                    if os.path.exists(path) and os.path.getsize(path) != self._rows * row_bytes:
+                        os.truncate(path, self._rows * row_bytes)
+
+                new_rows = []
+                new_keys = []
+                seen = set()
+                for i, key in enumerate(keys):
+                    digest = bytes.fromhex(key)
+                    if digest in self._index or digest in seen:
+                        continue
+                    seen.add(digest)
+                    new_rows.append(i)
+                    new_keys.append(digest)
+                if not new_rows:
+                    return
+
+                with open(self.vectors_path, "ab") as f:
+                    f.write(array[new_rows].tobytes())
+                with open(self.keys_path, "ab") as f:
+                    f.write(b"".join(new_keys))
+                self._refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_embedding_cache(model_name: str, kind: str = "document") -> EmbeddingCache:
+    """ 获取 (模型, 类型) 对应的缓存单例, query 与 document 的向量分开存储 """
+    namespace = f"{_model_slug(model_name)}__{kind}"
+    cache = _cache_registry.get(namespace)
+    if cache is not None:
+        return cache
+    with _registry_lock:
+        if namespace not in _cache_registry:
+            _cache_registry[namespace] = EmbeddingCache(namespace)
+        return _cache_registry[namespace]
+
+
+class CachedEmbeddings(Embeddings):
+    """ 在调用模型前先查 embedding 缓存的 Embeddings 包装 """
+
+    def __init__(self, embeddings: Embeddings, model_name: str):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.document_cache = get_embedding_cache(model_name, "document")
+        self.query_cache = get_embedding_cache(model_name, "query")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_sha1(text) for text in texts]
+        hits = self.document_cache.get_many(keys)
+
+        # 未命中的文本去重后再调用模型
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in hits and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.document_cache.put_many(list(missing.keys()), vectors)
+            hits.update(zip(missing.keys(), vectors))
+        return [list(hits[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = content_sha1(text)
+        hit = self.query_cache.get_many([key]).get(key)
+        if hit is not None:
+            return hit
+        vector = self.embeddings.embed_query(text)
+        self.query_cache.put_many([key], [vector])
+        return vector
+
+
+def with_embedding_cache(embeddings: Embeddings, model_name: Optional[str] = None) -> Embeddings:
+    """ 给 Embeddings 套上缓存, 已经包装过的直接返回 """
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings
+    model_name = model_name or getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+    return CachedEmbeddings(embeddings, model_name)
@@ -0,0 +1,148 @@
+from langchain_neo4j import Neo4jGraph
+
+from .common.cyphers import LIST_FULLTEXT_INDEXES
+
+from typing import Callable, List, Optional
+import hashlib
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# 全文索引的逻辑名称(检索侧使用的稳定名称)与期望定义
+# labels 为 None 时表示动态标签(db.labels() 去掉 FILTER_LABELS)
+FULLTEXT_INDEX_DEFINITIONS = {
+    "entities": {"name": "entities", "labels": None, "properties": ["id", "description"]},
+    "hybrid": {"name": "keyword", "labels": ["Chunk"], "properties": ["text"]},
+    "community": {"name": "community_keyword", "labels": ["__Community__"], "properties": ["summary"]},
+}
+
+
+def _definition_key(labels: List[str], properties: List[str]) -> tuple:
+    return tuple(sorted(labels or [])), tuple(sorted(properties or []))
+
+
+def _versioned_name(base: str, labels: List[str], properties: List[str]) -> str:
+    """ 定义变化时新索引的名称: {base}_v{定义hash}, 同一定义总是得到同一名称 """
+    digest = hashlib.sha1(repr(_definition_key(labels, properties)).encode("utf-8")).hexdigest()[:8]
+    return f"{base}_v{digest}"
+
+
+def _create_statement(name: str, labels: List[str], properties: List[str]) -> str:
+    labels_str = ":" + "|".join(f"`{label}`" for label in labels)
+    properties_str = ", ".join(f"n.`{prop}`" for prop in properties)
+    return f"CREATE FULLTEXT INDEX `{name}` IF NOT EXISTS FOR (n{labels_str}) ON EACH [{properties_str}]"
+
+
+def list_fulltext_indexes(graph: Neo4jGraph, base: str) -> List[dict]:
+    """ 逻辑名称 base 对应的全部全文索引(稳定名称及其版本化名称) """
+    pattern = re.compile(rf"^{re.escape(base)}(_v[0-9a-f]{{8}})?$")
+    return [index for index in graph.query(LIST_FULLTEXT_INDEXES) if pattern.match(index["name"])]
+
+
+def resolve_fulltext_index_name(graph: Neo4jGraph, base: str) -> str:
+    """
+    检索时使用的索引名称
+    /
+    定义变化后新索引在后台填充, 填充完成前继续使用旧索引; 优先返回 ONLINE 的索引
+    """
+    try:
+        indexes = list_fulltext_indexes(graph, base)
+    except Exception as e:
+        logger.warning(f"Unable to resolve fulltext index {base}: {e}")
+        return base
+    online = [index for index in indexes if index["state"] == "ONLINE"]
+    if not online:
+        return base
+    online.sort(key=lambda index: index["name"] != base)
+    return online[0]["name"]
+
+
+def wait_for_fulltext_index(graph: Neo4jGraph,
+                            name: str,
+                            timeout: float,
+                            poll_interval: float = 2.0,
+                            on_progress: Optional[Callable[[dict], None]] = None
+                            ) -> dict:
+    """ 轮询索引状态直到 ONLINE/FAILED 或超时, 每次轮询通过 on_progress 报告 populationPercent """
+    deadline = time.time() + timeout
+    while True:
+        rows = [index for index in graph.query(LIST_FULLTEXT_INDEXES) if index["name"] == name]
+        index = rows[0] if rows else {"name": name, "state": "MISSING", "populationPercent": None}
+        if on_progress:
+            on_progress(index)
+        logger.info(f"Fulltext index {name}: {index['state']} {index['populationPercent'] or 0:.1f}%")
+        if index["state"] in ("ONLINE", "FAILED", "MISSING") or time.time() >= deadline:
+            return index
+        time.sleep(min(poll_interval, max(0.0, deadline - time.time())))
+
+
+def ensure_fulltext_index(graph: Neo4jGraph,
+                          base: str,
+                          labels: List[str],
+                          properties: List[str],
+                          wait_seconds: float = 300,
+                          poll_interval: float = 2.0,
+                          on_progress: Optional[Callable[[dict], None]] = None
+                          ) -> dict:
+    """
+    在线维护全文索引, 不 DROP 正在使用的索引
+    /
+    - 已有索引的 标签/属性 与期望一致: 不做任何操作
+    - 不存在: 以稳定名称 IF NOT EXISTS 创建
+    - 定义变化: 以版本化名称创建新索引, 等待 ONLINE 后再删除旧索引, 填充期间检索继续使用旧索引
+    等待超时时保留新旧索引, 下次调用会继续等待并完成切换
+    """
+    start = time.time()
+    desired = _definition_key(labels, properties)
+    existing = list_fulltext_indexes(graph, base)
+
+    # FAILED 的索引无法恢复, 删除后重建
+    for index in [index for index in existing if index["state"] == "FAILED"]:
+        logger.warning(f"Fulltext index {index['name']} is FAILED, dropping it")
+        graph.query(f"DROP INDEX `{index['name']}` IF EXISTS")
+        existing.remove(index)
+
+    current = next(
+        (index for index in existing if _definition_key(index["labelsOrTypes"], index["properties"]) == desired),
+        None,
+    )
+    if current is not None and current["state"] == "ONLINE" and len(existing) == 1:
+        logger.info(f"Fulltext index {current['name']} is up to date")
+        return {"name": current["name"], "action": "unchanged", "state": "ONLINE", "populationPercent": 100.0, "dropped": []}
+
+    action = "pending"
+    if current is None:
+        names = {index["name"] for index in existing}
+        name = base if base not in names else _versioned_name(base, labels, properties)
+        graph.query(_create_statement(name, labels, properties))
+        action = "created" if not existing else "replacing"
+        logger.info(f"Creating fulltext index {name} on {labels} {properties} ({action})")
+    else:
+        name = current["name"]
+
+    index = wait_for_fulltext_index(graph, name, wait_seconds, poll_interval, on_progress)
+
+    # 新索引 ONLINE 后删除定义过期的旧索引
+    dropped = []
+    if index["state"] == "ONLINE":
+        for old in existing:
+            if old["name"] != name:
+                graph.query(f"DROP INDEX `{old['name']}` IF EXISTS")
+                dropped.append(old["name"])
+        if dropped:
+            action = "replaced"
+            logger.info(f"Dropped obsolete fulltext indexes {dropped}")
+        elif action == "pending":
+            action = "populated"
+
+    logger.info(f"Fulltext index {name} {action} in {time.time() - start:.2f} seconds")
+    return {
+        "name": name,
+        "action": action,
+        "state": index["state"],
+        "populationPercent": index["populationPercent"],
+        "dropped": dropped,
+    }
@@ -1,14 +1,21 @@
 import time
 import hashlib
+from datetime import datetime
 from dotenv import load_dotenv
 from langchain_neo4j import Neo4jGraph, Neo4jVector
 from langchain_neo4j.graphs.graph_document import GraphDocument
 from langchain_core.documents import Document
+from neo4j import AsyncDriver
 from neo4j.exceptions import TransientError
 
 
 from config import settings
 from .embedding import load_embedding_model
+from .embedding_cache import get_embedding_cache
+from .graph_writer import BulkGraphWriter
+from .knn_builder import BlockKNNBuilder
+from .fulltext_index import FULLTEXT_INDEX_DEFINITIONS, ensure_fulltext_index
+from .schema_consolidation import SchemaConsolidator
 from .common.cyphers import *
 from app_entities import SourceNode
 import logging
@@ -17,6 +24,96 @@ logger = logging.getLogger(__name__)
 load_dotenv(override=True)
 
 
+def source_node_create_params(obj_source_node: SourceNode):
+    """ 创建Document Node 的参数 """
+    return {
+        "fn": obj_source_node.file_name,
+        "fs": obj_source_node.file_size,
+        "ft": obj_source_node.file_type,
+        "st": "New",
+        "url": obj_source_node.url,
+        "awsacc_key_id": obj_source_node.awsAccessKeyId,
+        "f_source": obj_source_node.file_source,
+        "c_at": obj_source_node.created_at,
+        "u_at": obj_source_node.created_at,
+        "pt": 0,
+        "e_message": "",
+        "n_count": 0,
+        "r_count": 0,
+        "model": obj_source_node.model,
+        # gcs 相关 后面替换成OSS
+        "gcs_bucket": obj_source_node.gcsBucket,
+        "gcs_bucket_folder": obj_source_node.gcsBucketFolder,
+        "gcs_project_id": obj_source_node.gcsProjectId,
+        "language": obj_source_node.language,
+        "access_token": obj_source_node.access_token,
+        "chunkNodeCount": obj_source_node.chunkNodeCount,
+        "chunkRelCount": obj_source_node.chunkRelCount,
+        "entityNodeCount": obj_source_node.entityNodeCount,
+        "entityEntityRelCount": obj_source_node.entityEntityRelCount,
+        "communityNodeCount": obj_source_node.communityNodeCount,
+        "communityRelCount": obj_source_node.communityRelCount,
+    }
+
+
+def source_node_update_props(obj_source_node: SourceNode):
+    """ 更新Document Node 的属性, 只包含有值的字段 """
+    params = {}
+    if (
+        obj_source_node.file_name is not None
+        and obj_source_node.file_name != ""
+    ):
+        params["fileName"] = obj_source_node.file_name
+
+    if obj_source_node.status is not None and obj_source_node.status != "":
+        params["status"] = obj_source_node.status
+
+    if obj_source_node.created_at is not None:
+        params["createdAt"] = obj_source_node.created_at
+
+    if obj_source_node.updated_at is not None:
+        params["updatedAt"] = obj_source_node.updated_at
+
+    if (
+        obj_source_node.processing_time is not None
+        and obj_source_node.processing_time != 0
+    ):
+        params["processingTime"] = round(
+            obj_source_node.processing_time.total_seconds(), 2
+        )
+
+    if obj_source_node.node_count is not None:
+        params["nodeCount"] = obj_source_node.node_count
+
+    if obj_source_node.relationship_count is not None:
+        params["relationshipCount"] = obj_source_node.relationship_count
+
+    if obj_source_node.model is not None and obj_source_node.model != "":
+        params["model"] = obj_source_node.model
+
+    if (
+        obj_source_node.total_chunks is not None
+        and obj_source_node.total_chunks != 0
+    ):
+        params["total_chunks"] = obj_source_node.total_chunks
+
+    if obj_source_node.is_cancelled is not None:
+        params["is_cancelled"] = obj_source_node.is_cancelled
+
+    if obj_source_node.processed_chunk is not None:
+        params["processed_chunk"] = obj_source_node.processed_chunk
+
+    if obj_source_node.retry_condition is not None:
+        params["retry_condition"] = obj_source_node.retry_condition
+
+    if obj_source_node.token_usage is not None:
+        params["token_usage"] = obj_source_node.token_usage
+
+    if obj_source_node.error_message is not None:
+        params["errorMessage"] = obj_source_node.error_message
+    return params
+
+
 class GraphDBDataAccess:
 
     def __init__(self, graph: Neo4jGraph):
@@ -46,6 +143,13 @@ class GraphDBDataAccess:
             "Query execution failed after multiple retries due to deadlock."
         )
 
+    def execute_query_with_counters(self, query, param: dict = None):
+        """ 执行写入query, 同时返回写入统计(nodes_created, relationships_created 等) """
+        records, summary, _ = self.graph._driver.execute_query(
+            query, parameters_=param or {}, database_=self.graph._database
+        )
+        return [record.data() for record in records], summary.counters
+
     def update_exception_db(self, file_name, err_msg, retry_condition=None):
         """ document Node 的错误更新 """
         try:
@@ -57,25 +161,19 @@ class GraphDBDataAccess:
                     job_status = "Cancelled"
 
             if retry_condition is not None:
-                retry_condition = None
-                cypher1 = """MERGE(d:Document {fileName :$fName}) 
-                            SET d.status = $status, d.errorMessage = $error_msg, 
-                                d.retry_condition = $retry_condition"""
                 self.graph.query(
-                    cypher1,
+                    UPDATE_DOCUMENT_EXCEPTION_AND_RETRY_CONDITION,
                     {
                         "fName": file_name,
                         "status": job_status,
                         "error_msg": err_msg,
-                        "retry_condition": retry_condition,
+                        "retry_condition": None,
                     },
                     session_params={"database": self.graph._database},
                 )
             else:
-                cypher2 = """MERGE(d:Document {fileName :$fName}) 
-                             SET d.status = $status, d.errorMessage = $error_msg"""
                 self.graph.query(
-                    cypher2,
+                    UPDATE_DOCUMENT_EXCEPTION,
                     {"fName": file_name, "status": job_status, "error_msg": err_msg},
                     session_params={"database": self.graph._database},
                 )
@@ -92,55 +190,11 @@ class GraphDBDataAccess:
     def create_source_node(self, obj_source_node: SourceNode):
         """创建Document Node"""
         try:
-            job_status = "New"
             logger.info(f"Creating source node if does not exist in database.")
 
-            create_document_cypher = (
-                "MERGE(d:Document{fileName :$fn})"
-                "SET d.fileSize = $fs, d.fileType = $ft, d.status = $st,"
-                "d.url = $url, d.awsAccessKeyId = $awsacc_key_id, d.fileSource = $f_source,"
-                "d.createdAt = $c_at, d.updatedAt = $u_at, d.processingTime = $pt,"
-                "d.errorMessage = $e_message, d.nodeCount= $n_count,"
-                "d.relationshipCount = $r_count, d.model= $model,"
-                "d.gcsBucket=$gcs_bucket, d.gcsBucketFolder= $gcs_bucket_folder, d.gcsProjectId= $gcs_project_id,"
-                "d.language= $language, "
-                "d.is_cancelled=False, "
-                "d.total_chunks=0, d.processed_chunk=0,"
-                "d.access_token=$access_token,"
-                "d.chunkNodeCount=$chunkNodeCount,d.chunkRelCount=$chunkRelCount,"
-                "d.entityNodeCount=$entityNodeCount,d.entityEntityRelCount=$entityEntityRelCount,"
-                "d.communityNodeCount=$communityNodeCount,d.communityRelCount=$communityRelCount"
-            )
-            params = {
-                "fn": obj_source_node.file_name,
-                "fs": obj_source_node.file_size,
-                "ft": obj_source_node.file_type,
-                "st": job_status,
-                "url": obj_source_node.url,
-                "awsacc_key_id": obj_source_node.awsAccessKeyId,
-                "f_source": obj_source_node.file_source,
-                "c_at": obj_source_node.created_at,
-                "u_at": obj_source_node.created_at,
-                "pt": 0,
-                "e_message": "",
-                "n_count": 0,
-                "r_count": 0,
-                "model": obj_source_node.model,
-                # gcs 相关 后面替换成OSS
-                "gcs_bucket": obj_source_node.gcsBucket,
-                "gcs_bucket_folder": obj_source_node.gcsBucketFolder,
-                "gcs_project_id": obj_source_node.gcsProjectId,
-                "language": obj_source_node.language,
-                "access_token": obj_source_node.access_token,
-                "chunkNodeCount": obj_source_node.chunkNodeCount,
-                "chunkRelCount": obj_source_node.chunkRelCount,
-                "entityNodeCount": obj_source_node.entityNodeCount,
-                "entityEntityRelCount": obj_source_node.entityEntityRelCount,
-                "communityNodeCount": obj_source_node.communityNodeCount,
-                "communityRelCount": obj_source_node.communityRelCount,
-            }
+            params = source_node_create_params(obj_source_node)
             self.graph.query(
-                create_document_cypher,
+                CREATE_SOURCE_NODE,
                 params,
                 session_params={"database": self.graph._database},
             )
@@ -153,29 +207,26 @@ class GraphDBDataAccess:
             raise Exception(error_message)
 
     # 新增Chunk Node 和 建立 Doc, Chunk 等relationships
-    def create_relation_between_chunks(self, file_name, chunks: list[Document]):
+    def create_relation_between_chunks(self, file_name, chunks: list[Document],
+                                       start_position: int = 1, previous_chunk_id: str = "", content_offset: int = 0):
         """
         创建Chunk Node 与 Document建立relationship,
         并在Chunks 间建立 relationship
+        /
+        分批流式写入时通过 start_position / previous_chunk_id / content_offset 接续上一批
         """
 
         logger.info("Create First Chunk and Next Chunk relationships between chunks")
-        current_chunk_id = ""
+        current_chunk_id = previous_chunk_id
         lst_chunks_including_hash = []
         batch_data = []
-        relationships = []
-        offset = 0
+        offset = content_offset
         for i, chunk in enumerate(chunks):
             page_content_shai = hashlib.sha1(chunk.page_content.encode())
-            previous_chunk_id = current_chunk_id
             current_chunk_id = page_content_shai.hexdigest()
-            position = i + 1
+            position = start_position + i
             if i > 0:
                 offset += len(chunks[i - 1].page_content)
-            if i == 0:
-                firstChunk = True
-            else:
-                firstChunk = False
 
             # 构造chunk Node 数据
             chunk_data = {
@@ -183,8 +234,6 @@ class GraphDBDataAccess:
                 "pg_content": chunk.page_content,
                 "position": position,
                 "length": len(chunk.page_content),
-                "f_name": file_name,
-                "previous_id": previous_chunk_id,
                 "content_offset": offset,
             }
             if "page_number" in chunk.metadata:
@@ -202,144 +251,94 @@ class GraphDBDataAccess:
                 {"chunk_id": current_chunk_id, "chunk_doc": chunk}
             )
 
-            # 创建chunk间的 relationships
-            if firstChunk:
-                relationships.append(
-                    {"type": "FIRST_CHUNK", "chunk_id": current_chunk_id}
-                )
-            else:
-                relationships.append(
-                    {
-                        "type": "NEXT_CHUNK",
-                        "previous_chunk_id": previous_chunk_id,
-                        "current_chunk_id": current_chunk_id,
-                    }
-                )
-
-        # 1. 创建 chunk Node 并与 Document 建立 relationship(PART_OF)
-        create_chunk_and_relation_to_doc = """
-            UNWIND $batch_data AS data
-            MERGE (c:Chunk {id: data.id})
-            SET c.text = data.pg_content, c.position = data.position, c.length = data.length, 
-                c.fileName=data.f_name, c.content_offset=data.content_offset,
-                c.page_number = CASE WHEN data.page_number IS NOT NULL THEN data.page_number END,
-                c.start_time = CASE WHEN data.start_time IS NOT NULL THEN data.start_time END,
-                c.end_time = CASE WHEN data.end_time IS NOT NULL THEN data.end_time END
-            WITH data, c
-            MATCH (d:Document {fileName: data.f_name})
-            MERGE (c)-[:PART_OF]->(d)
-        """
-        self.execute_query(
-            create_chunk_and_relation_to_doc, param={"batch_data": batch_data}
-        )
-
-        # 2. Document到其第一个Chunk建立relationship为FIRST_CHUNK
-        create_first_chunk_relation = """
-            UNWIND $relationships AS relationship
-            MATCH (d:Document {fileName: $f_name})
-            MATCH (c:Chunk {id: relationship.chunk_id})
-            FOREACH (r IN CASE WHEN relationship.type = 'FIRST_CHUNK' THEN [1] ELSE [] END |
-                    MERGE (d)-[:FIRST_CHUNK]->(c))
-        """
-        self.execute_query(
-            create_first_chunk_relation,
-            param={"relationships": relationships, "f_name": file_name},
-        )
+        # 按子批次写入, 每个子批次一个事务: Chunk + PART_OF + FIRST_CHUNK + NEXT_CHUNK
+        new_part_of = 0
+        new_next_chunk = 0
+        sub_batch_size = max(1, settings.CHUNK_GRAPH_WRITE_BATCH_SIZE)
+        for i in range(0, len(batch_data), sub_batch_size):
+            sub_batch = batch_data[i : i + sub_batch_size]
+            result = self.execute_query(CREATE_CHUNK_GRAPH_BATCH, param={
+                "f_name": file_name,
+                "batch_data": sub_batch,
+                "start_position": sub_batch[0]["position"],
+                "previous_chunk_id": previous_chunk_id,
+            })
+            if result:
+                new_part_of += result[0]["newPartOf"]
+                new_next_chunk += result[0]["newNextChunk"]
+            previous_chunk_id = sub_batch[-1]["id"]
 
-        # 3. 建立Chunk之间的关系 NEXT_CHUNK
-        create_next_chunk_relation_between_chunk = """
-            UNWIND $relationships AS relationship
-            MATCH (c:Chunk {id: relationship.current_chunk_id})
-            WITH c, relationship
-            MATCH (pc:Chunk {id: relationship.previous_chunk_id})
-            FOREACH (r IN CASE WHEN relationship.type = 'NEXT_CHUNK' THEN [1] ELSE [] END |
-                    MERGE (pc)-[:NEXT_CHUNK]->(c))
-        """
-        self.execute_query(
-            create_next_chunk_relation_between_chunk,
-            param={"relationships": relationships},
-        )
+        # 增量更新Document计数, 新建的PART_OF数即该文档新增的chunk数
+        self.increment_node_relationship_count(file_name, {
+            "chunkNodeCount": new_part_of,
+            "chunkRelCount": new_part_of + new_next_chunk,
+        })
 
         return lst_chunks_including_hash
 
-
-
     def create_chunk_embeddings(self, chunks, file_name):
         """ 给chunk创建embedding向量 """
         embeddings, dimension = load_embedding_model(settings.EMBEDDING_MODEL)
         logger.info(f"embedding model: {embeddings} and dimension: {dimension}")
 
-        embedding_chunks = []
+        embedding_batch_size = settings.EMBEDDING_BATCH_SIZE
+        write_batch_size = settings.EMBEDDING_WRITE_BATCH_SIZE
 
-        for row in chunks:
-            embedding_vector = embeddings.embed_query(row['chunk_doc'].page_content)
-            embedding_chunks.append({
-                "id": row['chunk_id'],
-                "embeddings": embedding_vector
-            })
+        # 1. 先查内容哈希缓存, chunk_id 即 page_content 的 sha1
+        cache = None
+        cached_vectors = {}
+        if settings.EMBEDDING_CACHE_ENABLED:
+            cache = get_embedding_cache(getattr(embeddings, "model_name", settings.EMBEDDING_MODEL))
+            cached_vectors = cache.get_many([row['chunk_id'] for row in chunks])
+            logger.info(f"Embedding cache hit {len(cached_vectors)}/{len(chunks)} chunks")
 
-        self.execute_query(CREATE_OR_UPDATE_CHUNK_EMBEDDING, param={"data": embedding_chunks, "f_name": file_name})
-        
+        def flush(rows, force=False):
+            """ 按 write_batch_size 分批写入, 返回未满一批的剩余行 """
+            while len(rows) >= write_batch_size or (force and rows):
+                self.execute_query(CREATE_OR_UPDATE_CHUNK_EMBEDDING, param={"data": rows[:write_batch_size], "f_name": file_name})
+                rows = rows[write_batch_size:]
+            return rows
 
-    def save_graph_documents(self, graph_documents: list[GraphDocument], max_retries=3, delay=1):
-        """ 保存知识图谱 """
-        retries = 0
-        while retries < max_retries:
-            try: 
-                self.graph.add_graph_documents(graph_documents)
-                return
-            except TransientError as e:
-                if "DeadlockDetected" in str(e):
-                    retries += 1
-                    logger.info(f"Deadlock detected. Retrying {retries}/{max_retries} in {delay} seconds...")
-                    time.sleep(delay)  # Wait before retrying
-                else:
-                    raise
-        logger.error("Failed to execute query after maximum retries due to persistent deadlocks.")
-        raise RuntimeError("Query execution failed after multiple retries due to deadlock.")
+        embedding_chunks = flush([{"id": chunk_id, "embeddings": vector} for chunk_id, vector in cached_vectors.items()])
 
+        # 2. 未命中的按文本长度排序, 让同一个micro-batch内的chunk长度接近, 减少padding浪费
+        missing_chunks = {row['chunk_id']: row for row in chunks if row['chunk_id'] not in cached_vectors}
+        ordered_chunks = sorted(missing_chunks.values(), key=lambda row: len(row['chunk_doc'].page_content))
 
-    def merge_relationship_between_chunk_and_graph_entities(self, graph_documents: list[GraphDocument]):
-        # 1. 一个graph_doc 对应多个 chunk
-        chunk_graph_docs = []
-        for graph_doc in graph_documents:
-            for chunk_id in graph_doc.source.metadata["combined_chunk_ids"]:
-                chunk_graph_docs.append({"graph_doc": graph_doc, "chunk_id": chunk_id})
-        
-        # 2. 构建入参
-        batch_data = []
-        for chunk_graph_doc in chunk_graph_docs:
-            for node in chunk_graph_doc['graph_doc'].nodes:
-                data = {
-                    "chunk_id": chunk_graph_doc["chunk_id"],
-                    "node_id": node.id,
-                    "node_type": node.type
-                }
-                batch_data.append(data)
+        # 3. micro-batch 调用 embed_documents, 结果按 write_batch_size 流式写入Neo4j
+        for i in range(0, len(ordered_chunks), embedding_batch_size):
+            batch = ordered_chunks[i : i + embedding_batch_size]
+            embedding_vectors = embeddings.embed_documents([row['chunk_doc'].page_content for row in batch])
+            if cache is not None:
+                cache.put_many([row['chunk_id'] for row in batch], embedding_vectors)
+            for row, embedding_vector in zip(batch, embedding_vectors):
+                embedding_chunks.append({
+                    "id": row['chunk_id'],
+                    "embeddings": embedding_vector
+                })
 
-        # 3. 批量创建关系
-        if batch_data:
-            self.execute_query(MERGE_CHUNK_AND_ENTITES_RELATION, param={"batch_data":batch_data})
-        
+            embedding_chunks = flush(embedding_chunks)
+
+        flush(embedding_chunks, force=True)
 
-    def node_relationship_consolidation(self,node_mapping, relation_mapping):
+
+    def save_graph_documents(self, graph_documents: list[GraphDocument], file_name):
+        """
+        保存知识图谱, 并在同一事务中建立chunk与实体的 HAS_ENTITY 关系
+        返回 新建的实体关系数, HAS_ENTITY关系数, 以及该文档新增的实体数
+        """
+        return BulkGraphWriter(self.graph).write(graph_documents, file_name)
+
+    def node_relationship_consolidation(self, node_mapping, relation_mapping, on_progress=None):
+        """ 按映射分批改写节点标签与关系类型(保留关系属性), 返回每个映射改写的数量 """
         try:
-            if node_mapping:
-                for old_label, new_label in node_mapping.items():
-                    query = f"""
-                            MATCH (n:`{old_label}`)
-                            SET n:`{new_label}`
-                            REMOVE n:`{old_label}`
-                            """
-                    self.execute_query(query)
-
-            for old_label, new_label in relation_mapping.items():
-                query = f"""
-                        MATCH (n)-[r:`{old_label}`]->(m)
-                        CREATE (n)-[r2:`{new_label}`]->(m)
-                        DELETE r
-                        """
-                self.execute_query(query)
+            consolidator = SchemaConsolidator(
+                self.graph,
+                batch_size=settings.CONSOLIDATION_BATCH_SIZE,
+                max_workers=settings.CONSOLIDATION_MAX_WORKERS,
+                on_progress=on_progress,
+            )
+            return consolidator.run(node_mapping, relation_mapping)
         except Exception as e:
             logger.error(f"Error in node_relationship_consolidation: {e}")
             raise e
@@ -347,65 +346,27 @@ class GraphDBDataAccess:
     # ========== 更新方法 =================
     def update_source_node(self, obj_source_node: SourceNode):
         try:
-            params = {}
-            if (
-                obj_source_node.file_name is not None
-                and obj_source_node.file_name != ""
-            ):
-                params["fileName"] = obj_source_node.file_name
-
-            if obj_source_node.status is not None and obj_source_node.status != "":
-                params["status"] = obj_source_node.status
-
-            if obj_source_node.created_at is not None:
-                params["createdAt"] = obj_source_node.created_at
-
-            if obj_source_node.updated_at is not None:
-                params["updatedAt"] = obj_source_node.updated_at
-
-            if (
-                obj_source_node.processing_time is not None
-                and obj_source_node.processing_time != 0
-            ):
-                params["processingTime"] = round(
-                    obj_source_node.processing_time.total_seconds(), 2
-                )
-
-            if obj_source_node.node_count is not None:
-                params["nodeCount"] = obj_source_node.node_count
-
-            if obj_source_node.relationship_count is not None:
-                params["relationshipCount"] = obj_source_node.relationship_count
-
-            if obj_source_node.model is not None and obj_source_node.model != "":
-                params["model"] = obj_source_node.model
-
-            if (
-                obj_source_node.total_chunks is not None
-                and obj_source_node.total_chunks != 0
-            ):
-                params["total_chunks"] = obj_source_node.total_chunks
-
-            if obj_source_node.is_cancelled is not None:
-                params["is_cancelled"] = obj_source_node.is_cancelled
-
-            if obj_source_node.processed_chunk is not None:
-                params["processed_chunk"] = obj_source_node.processed_chunk
-
-            if obj_source_node.retry_condition is not None:
-                params["retry_condition"] = obj_source_node.retry_condition
-
-            if obj_source_node.token_usage is not None:
-                params["token_usage"] = obj_source_node.token_usage
-            param = {"props": params}
-
-            cypher = "MERGE (d:Document {fileName: $props.fileName}) SET d += $props"
-            self.execute_query(cypher, param=param)
+            param = {"props": source_node_update_props(obj_source_node)}
+            self.execute_query(UPDATE_SOURCE_NODE, param=param)
         except Exception as e:
             error_message = str(e)
             self.update_exception_db(obj_source_node.file_name, error_message)
             raise Exception(error_message)
 
+    def increment_node_relationship_count(self, file_name, counts: dict):
+        """ 根据写入结果增量更新Document的节点和关系数量, 避免每批次全量统计 """
+        param = {
+            "f_name": file_name,
+            "chunkNodeCount": counts.get("chunkNodeCount", 0),
+            "chunkRelCount": counts.get("chunkRelCount", 0),
+            "entityNodeCount": counts.get("entityNodeCount", 0),
+            "entityEntityRelCount": counts.get("entityEntityRelCount", 0),
+        }
+        result = self.execute_query(INCREMENT_DOCUMENT_NODE_COUNT, param)
+        if not result:
+            return {"nodeCount": 0, "relationshipCount": 0}
+        return result[0]
+
     def update_node_relationship_count(self, file_name):
         """ 校准更新节点和关系数量 """
         logger.info("Updating node and relationship count!!")
@@ -476,26 +437,8 @@ class GraphDBDataAccess:
     # ========= 查询方法 ================
     def get_current_status_document_node(self, file_name):
         """查询文档节点的当前状态"""
-        query = """
-                MATCH(d:Document {fileName : $file_name}) 
-                RETURN d.status AS Status , d.processingTime AS processingTime, 
-                d.model as model,
-                d.nodeCount AS nodeCount,
-                d.relationshipCount as relationshipCount,
-                d.total_chunks AS total_chunks , d.fileSize as fileSize, 
-                d.processed_chunk as processed_chunk, d.fileSource as fileSource,
-                d.chunkNodeCount AS chunkNodeCount,
-                d.chunkRelCount AS chunkRelCount,
-                d.entityNodeCount AS entityNodeCount,
-                d.entityEntityRelCount AS entityEntityRelCount,
-                d.communityNodeCount AS communityNodeCount,
-                d.communityRelCount AS communityRelCount,
-                d.createdAt AS created_time,
-                d.is_cancelled as is_cancelled,
-                coalesce(d.token_usage, 0) AS token_usage
-                """
         param = {"file_name": file_name}
-        return self.execute_query(query, param)
+        return self.execute_query(GET_CURRENT_STATUS_DOCUMENT_NODE, param)
 
     def get_chunks_by_fileName(self, file_name):
         """根据文件名 获取其chunks"""
@@ -508,37 +451,24 @@ class GraphDBDataAccess:
         """
         return self.execute_query(query_chunks_by_fileName, param={"f_name": file_name})
 
-    def get_last_processed_chunk(self, file_name):
-        """根据文件名 找到第一个还没有Embedding的chunk"""
-        cypher = """
-            MATCH (d:Document {fileName: $f_name})
-            WITH d
-            MATCH (c:Chunk)-[:PART_OF]->(d)
-            WHERE c.embedding IS NULL
-            RETURN c.id as id, c.position as position
-            ORDER BY c.position LIMIT 1
-        """
-        return self.execute_query(cypher, param={"f_name": file_name})
+    def get_chunk_stages(self, file_name):
+        """根据文件名 获取全部chunk及其处理阶段位图(旧数据会按 embedding / HAS_ENTITY 回填)"""
+        return self.execute_query(GET_CHUNK_STAGES, param={"f_name": file_name})
 
-    def get_last_processed_without_entity_chunk(self, file_name):
-        """根据文件名 找到还没有进行 Entity实体抽取的 chunk"""
-        cypher = """
-            MATCH (d:Document {fileName: $f_name})
-            WITH d
-            MATCH (c:Chunk)-[:PART_OF]->(d)
-            WHERE NOT exists {(c)-[:HAS_ENTITY]->()}
-            RETURN c.id as id, c.position as position
-            ORDER BY c.position LIMIT 1
-        """
-        return self.execute_query(cypher, param={"f_name": file_name})
+    def reset_chunk_stages(self, file_name):
+        """从头重新处理前清空chunk的处理阶段"""
+        return self.execute_query(RESET_CHUNK_STAGES, param={"f_name": file_name})
 
-    def get_nodelabels_relationships(self):
-        """ 获取所有节点标签和关系类型 """
+    def get_nodelabels_relationships(self, file_names: list = None):
+        """ 获取所有节点标签和关系类型, file_names 不为空时只获取这些文件中实体的标签和关系类型 """
         try:
-            node_result = self.execute_query(GET_NODE_LABELS)
+            if file_names:
+                node_result = self.execute_query(GET_FILE_NODE_LABELS, {"file_names": file_names})
+                relationship_result = self.execute_query(GET_FILE_RELATIONSHIPS, {"file_names": file_names})
+            else:
+                node_result = self.execute_query(GET_NODE_LABELS)
+                relationship_result = self.execute_query(GET_RELATIONSHIPS)
             node_labels = [record["label"] for record in node_result]
-
-            relationship_result = self.execute_query(GET_RELATIONSHIPS)
             relationship_types = [record["relationshipType"] for record in relationship_result]
             
             return node_labels, relationship_types
@@ -548,6 +478,15 @@ class GraphDBDataAccess:
 
 
 
+    def get_pending_post_processing_files(self):
+        """ 自上次后处理以来新完成的文件 """
+        return [record["fileName"] for record in self.execute_query(GET_PENDING_POST_PROCESSING_FILES)]
+
+    def set_post_processing_watermark(self, file_names: list):
+        """ 记录文件的后处理水位线 """
+        if file_names:
+            self.execute_query(SET_POST_PROCESSING_WATERMARK, {"file_names": file_names, "now": datetime.now()})
+
     # ========= 连接相关 ===================
     def check_gds_version(self):
         """
@@ -687,80 +626,140 @@ class GraphDBDataAccess:
                 raise
 
    
-    def update_KNN_graph(self):
-        """ 根据embedding分数匹配更新具有相似关系的图节点 """
-
-        # 1. 获取vector索引
-        index = self.execute_query(GET_VECTOR_INDEX)
+    def update_KNN_graph(self, file_names: list = None):
+        """
+        根据embedding分数匹配更新具有相似关系的图节点
+        /
+        KNN_MODE=block 时在客户端分块计算 top-k 并分批写入, 否则逐chunk查询向量索引
+        file_names 不为空时只处理这些文件的chunk
+        """
 
         # 建立KNN相似度阈值
         knn_min_score = settings.KNN_MIN_SCORE
 
+        if settings.KNN_MODE == "block":
+            logger.info("Update KNN Graph with block KNN builder")
+            return BlockKNNBuilder(
+                self.graph,
+                top_k=settings.KNN_TOP_K,
+                min_score=knn_min_score,
+                page_size=settings.KNN_PAGE_SIZE,
+                block_size=settings.KNN_BLOCK_SIZE,
+                write_batch_size=settings.KNN_WRITE_BATCH_SIZE,
+                backend=settings.KNN_BACKEND,
+            ).run(file_names)
+
+        # 1. 获取vector索引
+        index = self.execute_query(GET_VECTOR_INDEX)
+
         if len(index) > 0:
             logger.info("Update KNN Graph")
             # 2. 创建或更新相似关系
-            self.execute_query(CREATE_OR_UPDATE_SIMILAR_CHUNK_RELATIONSHIP, param={"score":knn_min_score})
+            if file_names:
+                self.execute_query(CREATE_OR_UPDATE_SIMILAR_CHUNK_RELATIONSHIP_FOR_FILES, param={"score": knn_min_score, "file_names": file_names})
+            else:
+                self.execute_query(CREATE_OR_UPDATE_SIMILAR_CHUNK_RELATIONSHIP, param={"score":knn_min_score})
     
         else:
             logger.info("No vector index found, so KNN not update")
         
 
-    def create_fulltext_indexes(self, type):
-        """ 建立全文索引 """
-        start = time.time()
-        driver = self.graph._driver
+    def create_fulltext_indexes(self, type, on_progress=None):
+        """
+        在线维护全文索引: 比对已有索引的 标签/属性, 只创建缺失或定义变化的索引
+        /
+        定义变化时新索引填充完成(ONLINE)后才删除旧索引, 期间检索不受影响
+        """
+        definition = FULLTEXT_INDEX_DEFINITIONS[type]
+        labels = definition["labels"]
+        if labels is None:
+            # 针对 entities 过滤不需要创建fulltext的标签
+            labels = [record["label"] for record in self.execute_query("CALL db.labels()") if record["label"] not in FILTER_LABELS]
+            if not labels:
+                logger.info("Full text index is not created as labels are empty")
+                return None
         try:
-            with driver.session() as session:
-                # 1. drop
-                try:
-                    start_step = time.time()
-                    if type == "entities":
-                        drop_cypher = DROP_INDEX_ENTITIES
-                    elif type == "hybrid":
-                        drop_cypher = DROP_INDEX_HYBRID_SEARCH
-                    else:
-                        drop_cypher = DROP_INDEX_COMMUNITY
-                    session.run(drop_cypher)
-                    logger.info(f"Dropped existing index (if any) in {time.time() - start_step:.2f} seconds.")
-                except Exception as e:
-                    logger.error(f"Failed to drop index type:{type}, error:{e}")
-                    return
-
-                # 2. 针对 entities 过滤不需要创建fulltext的标签
-                try:
-                    if type == "entities":
-                        start_step = time.time()
-                        result = session.run("CALL db.labels()") # 查询所有标签
-                        labels = [record["label"] for record in result if record["label"] not in FILTER_LABELS]
-                         
-                        if labels:
-                            labels_str = ":" + "|".join([f"`{label}`" for label in labels])
-                            logger.info(f"Labels to be indexed: {labels_str}")
-                            logger.info(f"Fetched labels in {time.time() - start_step:.2f} seconds.")
-                        else:
-                            logger.info("Full text index is not created as labels are empty")
-                            return
-                except Exception as e:
-                    logger.error(f"Failed to fetch labels: {e}")
-                    return
-                
-                # 3. 创建索引
-                try:
-                    start_step = time.time()
-                    if type == "entities":
-                        fulltext_cypher = CREATE_FULL_TEXT_INDEX_ENTITIES.format(labels_str=labels_str)
-                    elif type == "hybrid":
-                        fulltext_cypher = CREATE_FULL_TEXT_INDEX_HYBRID_SEARCH
-                    else:
-                        fulltext_cypher = CREATE_FULL_TEXT_INDEX_COMMUNITY
-                    logger.info(f"Creating fulltext_cypher : {fulltext_cypher}")
-                    session.run(fulltext_cypher)
-                    logger.info(f"Created full-text index in {time.time() - start_step:.2f} seconds.")
-                except Exception as e:
-                    logger.error(f"Failed to create full-text index: {e}")
-                    return
+            return ensure_fulltext_index(
+                self.graph,
+                definition["name"],
+                labels,
+                definition["properties"],
+                wait_seconds=settings.FULLTEXT_INDEX_WAIT_SECONDS,
+                poll_interval=settings.FULLTEXT_INDEX_POLL_SECONDS,
+                on_progress=on_progress,
+            )
         except Exception as e:
-            logger.error(f"An error occurred during the session: {e}")
+            logger.error(f"Failed to maintain full-text index type:{type}, error:{e}")
             raise e
-        finally:
-            logger.info(f"Process completed in {time.time() - start:.2f} seconds.")
+
+
+class AsyncGraphDBDataAccess:
+    """
+    GraphDBDataAccess 的异步版本, 基于进程内共享的 neo4j.AsyncDriver
+    /
+    用于 async 路由和流水线中的轻量读写(状态, 进度, 异常), 不阻塞事件循环
+    """
+
+    def __init__(self, driver: AsyncDriver, database: str = None):
+        self.driver = driver
+        self.database = database
+
+    async def execute_query(self, query, param: dict = None):
+        """ 托管事务执行query, 驱动负责瞬时错误(死锁等)重试 """
+        records, _, _ = await self.driver.execute_query(
+            query, parameters_=param or {}, database_=self.database
+        )
+        return [record.data() for record in records]
+
+    async def update_exception_db(self, file_name, err_msg, retry_condition=None):
+        """ document Node 的错误更新 """
+        try:
+            job_status = "Failed"
+            result = await self.get_current_status_document_node(file_name)
+            if len(result) > 0 and bool(result[0]["is_cancelled"]) == True:
+                job_status = "Cancelled"
+
+            if retry_condition is not None:
+                await self.execute_query(
+                    UPDATE_DOCUMENT_EXCEPTION_AND_RETRY_CONDITION,
+                    {"fName": file_name, "status": job_status, "error_msg": err_msg, "retry_condition": None},
+                )
+            else:
+                await self.execute_query(
+                    UPDATE_DOCUMENT_EXCEPTION,
+                    {"fName": file_name, "status": job_status, "error_msg": err_msg},
+                )
+        except Exception as e:
+            logger.error(f"Error in updating document node status as failed: {e}")
+            raise e
+
+    async def create_source_node(self, obj_source_node: SourceNode):
+        """创建Document Node"""
+        try:
+            logger.info(f"Creating source node if does not exist in database.")
+            await self.execute_query(CREATE_SOURCE_NODE, source_node_create_params(obj_source_node))
+        except Exception as e:
+            error_message = str(e)
+            logger.error(f"error_message = {error_message}")
+            await self.update_exception_db(obj_source_node.file_name, error_message)
+            raise Exception(error_message)
+
+    async def update_source_node(self, obj_source_node: SourceNode):
+        try:
+            await self.execute_query(UPDATE_SOURCE_NODE, {"props": source_node_update_props(obj_source_node)})
+        except Exception as e:
+            error_message = str(e)
+            await self.update_exception_db(obj_source_node.file_name, error_message)
+            raise Exception(error_message)
+
+    async def get_current_status_document_node(self, file_name):
+        """查询文档节点的当前状态"""
+        return await self.execute_query(GET_CURRENT_STATUS_DOCUMENT_NODE, {"file_name": file_name})
+
+    async def set_documents_cancelled(self, file_names, pending_file_names=None):
+        """ 将正在处理(或仍在队列中)的文件标记为 Cancelled, 返回被标记的文件 """
+        result = await self.execute_query(
+            SET_DOCUMENTS_CANCELLED,
+            {"file_names": file_names, "pending_file_names": pending_file_names or [], "now": datetime.now()},
+        )
+        return [record["fileName"] for record in result]
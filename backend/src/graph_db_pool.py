@@ -0,0 +1,91 @@
+from langchain_neo4j import Neo4jGraph
+from neo4j import AsyncGraphDatabase, AsyncDriver
+
+from config import settings
+from .graph_schema import bootstrap_graph_schema_once
+
+from threading import Lock
+import asyncio
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+_lock = Lock()
+_graphs: dict = {}   # {credential_key: Neo4jGraph}
+# 异步驱动与事件循环绑定, 按loop分别维护 {loop: {credential_key: AsyncDriver}}
+_async_drivers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def _credential_key(credentials):
+    return (credentials.uri, credentials.userName, credentials.password, credentials.database)
+
+
+def _driver_config():
+    return {"user_agent": "LLM-Graph-Builder"} if settings.ENABLE_USER_AGENT else {}
+
+
+def get_graph(credentials) -> Neo4jGraph:
+    """ 进程内按凭证复用 Neo4jGraph(及其驱动连接池) """
+    key = _credential_key(credentials)
+    graph = _graphs.get(key)
+    if graph is not None:
+        return graph
+
+    with _lock:
+        graph = _graphs.get(key)
+        if graph is None:
+            graph = Neo4jGraph(
+                url=credentials.uri,
+                database=credentials.database,
+                username=credentials.userName,
+                password=credentials.password,
+                refresh_schema=False,
+                sanitize=True,
+                driver_config=_driver_config(),
+            )
+            _graphs[key] = graph
+            logger.info(f"Created pooled Neo4j connection for {credentials.uri}")
+
+    # 首次连接时创建缺失的约束与索引
+    if settings.SCHEMA_BOOTSTRAP_ON_CONNECT:
+        bootstrap_graph_schema_once(graph, key)
+    return graph
+
+
+def get_async_driver(credentials) -> AsyncDriver:
+    """ 进程内按凭证复用异步驱动 """
+    loop = asyncio.get_running_loop()
+    drivers = _async_drivers.setdefault(loop, {})
+    key = _credential_key(credentials)
+    driver = drivers.get(key)
+    if driver is None:
+        driver = AsyncGraphDatabase.driver(
+            credentials.uri,
+            auth=(credentials.userName, credentials.password),
+            **_driver_config(),
+        )
+        drivers[key] = driver
+        logger.info(f"Created pooled async Neo4j driver for {credentials.uri}")
+    return driver
+
+
+async def close_graph_database_connections():
+    """ 关闭所有连接池(应用退出时调用) """
+    with _lock:
+        graphs = list(_graphs.values())
+        _graphs.clear()
+    for graph in graphs:
+        try:
+            graph._driver.close()
+        except Exception as e:
+            logger.error(f"Error while closing Neo4j connection: {e}")
+
+    loop = asyncio.get_running_loop()
+    drivers = _async_drivers.pop(loop, {})
+    for driver in drivers.values():
+        try:
+            await driver.close()
+        except Exception as e:
+            logger.error(f"Error while closing async Neo4j driver: {e}")
@@ -3,12 +3,13 @@ from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.documents import Document
 from langchain_core.runnables import RunnableConfig
 
-import asyncio
 from typing import List, Union, Optional, Tuple, Dict, Any
 from pydantic import BaseModel, Field, create_model
 
 from langchain_neo4j.graphs.graph_document import GraphDocument, Node, Relationship
 
+from .scheduler import LLMRequestScheduler, estimate_tokens
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -359,11 +360,32 @@ class LLMGraphTransformer:
 
     async def convert_to_graph_documents(self, 
                                          documents: List[Document], 
-                                         config: Optional[RunnableConfig] = None
+                                         config: Optional[RunnableConfig] = None,
+                                         scheduler: Optional[LLMRequestScheduler] = None,
+                                         failed_chunk_ids: Optional[List[str]] = None
     ) -> List[GraphDocument]:
-        tasks = [
-            asyncio.create_task(self.process_response(document, config))
-            for document in documents
-        ]
-        results = await asyncio.gather(*tasks)
+        """
+        并发抽取知识图谱, 由scheduler控制并发与限流
+        /
+        单个文档失败不影响整批, 只返回成功的结果, 失败文档的 combined_chunk_ids 追加到 failed_chunk_ids;
+        全部失败时抛出第一个异常
+        token预算优先使用打包时记录的 metadata["input_tokens"]
+        """
+        if scheduler is None:
+            scheduler = LLMRequestScheduler()
+
+        results, failures = await scheduler.map(
+            lambda document: self.process_response(document, config),
+            documents,
+            token_estimator=lambda document: document.metadata.get("input_tokens") or estimate_tokens(document.page_content),
+        )
+        if failures:
+            for document, error in failures:
+                chunk_ids = document.metadata.get("combined_chunk_ids", [])
+                if failed_chunk_ids is not None:
+                    failed_chunk_ids.extend(chunk_ids)
+                logger.error(f"Failed to extract graph for chunks {chunk_ids}: {error}")
+            if not results:
+                raise failures[0][1]
+            logger.warning(f"Graph extraction partially failed: {len(failures)}/{len(documents)} documents")
         return results
@@ -0,0 +1,219 @@
+from config import settings
+from ..document_processors.text_splitter import count_tokens
+
+import asyncio
+import random
+import time
+import weakref
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+WINDOW_SECONDS = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    """ 输入token数, 与抽取请求打包使用同一个 tiktoken 计数 """
+    return max(1, count_tokens(text, settings.LLM_INPUT_TOKEN_ENCODING))
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """ 判断是否为服务商限流(429)错误 """
+    status_code = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if status_code == 429:
+        return True
+    name = type(e).__name__.lower()
+    message = str(e).lower()
+    return "ratelimit" in name or "429" in message or "rate limit" in message or "too many requests" in message
+
+
+def _retry_after_seconds(e: Exception) -> Optional[float]:
+    """ 读取服务商返回的 retry-after 头 """
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitBudget:
+    """ 60秒滑动窗口内的 请求数/token数 预算, 0 表示不限制 """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events: deque = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+
+    def _evict(self, now: float):
+        while self._events and now - self._events[0][0] >= WINDOW_SECONDS:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def wait_time(self, tokens: int) -> float:
+        """ 返回还需等待的秒数, 0 表示可以立即发送 """
+        now = time.monotonic()
+        self._evict(now)
+        waits = [0.0]
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            waits.append(self._events[0][0] + WINDOW_SECONDS - now)
+        if self.tokens_per_minute and self._events:
+            # 单个请求超过整个预算时只要求窗口为空, 避免永远等待
+            tokens = min(tokens, self.tokens_per_minute)
+            excess = self._tokens_in_window + tokens - self.tokens_per_minute
+            if excess > 0:
+                released = 0
+                for timestamp, event_tokens in self._events:
+                    released += event_tokens
+                    if released >= excess:
+                        waits.append(timestamp + WINDOW_SECONDS - now)
+                        break
+        return max(waits)
+
+    def record(self, tokens: int):
+        self._events.append((time.monotonic(), tokens))
+        self._tokens_in_window += tokens
+
+
+class LLMRequestScheduler:
+    """
+    LLM 请求调度器
+    /
+    - 并发上限(semaphore)
+    - 每分钟请求数/token数预算
+    - 限流错误的指数退避 + 随机抖动重试
+    - map 返回部分结果, 单个请求失败不影响整批
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 8,
+                 requests_per_minute: int = 0,
+                 tokens_per_minute: int = 0,
+                 max_retries: int = 5,
+                 retry_base_delay: float = 2.0,
+                 retry_max_delay: float = 60.0
+                 ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.budget = RateLimitBudget(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        # asyncio 原语与事件循环绑定, 按loop分别创建
+        self._loop_primitives: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[asyncio.Semaphore, asyncio.Lock]]" = weakref.WeakKeyDictionary()
+
+    def _primitives(self) -> Tuple[asyncio.Semaphore, asyncio.Lock]:
+        loop = asyncio.get_running_loop()
+        primitives = self._loop_primitives.get(loop)
+        if primitives is None:
+            primitives = (asyncio.Semaphore(self.max_concurrency), asyncio.Lock())
+            self._loop_primitives[loop] = primitives
+        return primitives
+
+    async def _acquire_budget(self, tokens: int):
+        _, budget_lock = self._primitives()
+        async with budget_lock:
+            while True:
+                wait = self.budget.wait_time(tokens)
+                if wait <= 0:
+                    self.budget.record(tokens)
+                    return
+                logger.info(f"LLM budget exhausted, waiting {wait:.2f} seconds")
+                await asyncio.sleep(wait)
+
+    def _backoff(self, attempt: int, e: Exception) -> float:
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)  # jitter, 避免并发请求同时重试
+        retry_after = _retry_after_seconds(e)
+        return max(delay, retry_after) if retry_after else delay
+
+    async def run(self, func: Callable[[], Awaitable[Any]], estimated_tokens: int = 1) -> Any:
+        """ 在并发和预算限制下执行一次请求, 限流错误自动重试 """
+        semaphore, _ = self._primitives()
+        attempt = 0
+        while True:
+            async with semaphore:
+                await self._acquire_budget(estimated_tokens)
+                try:
+                    return await func()
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff(attempt, e)
+            attempt += 1
+            logger.warning(f"Rate limited by LLM provider, retry {attempt}/{self.max_retries} in {delay:.2f} seconds")
+            await asyncio.sleep(delay)
+
+    async def map(self,
+                  func: Callable[[Any], Awaitable[Any]],
+                  items: List[Any],
+                  token_estimator: Callable[[Any], int] = lambda item: 1
+    ) -> Tuple[List[Any], List[Tuple[Any, Exception]]]:
+        """ 并发处理所有item, 返回 (成功结果列表(保持输入顺序), [(失败item, 异常)]) """
+
+        async def _run(item):
+            return await self.run(lambda: func(item), token_estimator(item))
+
+        outcomes = await asyncio.gather(*[_run(item) for item in items], return_exceptions=True)
+        results, failures = [], []
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, Exception):
+                failures.append((item, outcome))
+            else:
+                results.append(outcome)
+        return results, failures
+
+
+_schedulers: Dict[str, LLMRequestScheduler] = {}
+
+
+def get_llm_scheduler(model: str) -> LLMRequestScheduler:
+    """
+    根据 get_llm 的模型key获取共享的调度器
+    /
+    限额默认取 LLM_MAX_CONCURRENCY / LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE,
+    可通过 LLM_LIMIT_{model} = "并发数,每分钟请求数,每分钟token数" 按模型覆盖
+    """
+    model_key = model.lower().replace("-", "_").strip()
+    scheduler = _schedulers.get(model_key)
+    if scheduler is not None:
+        return scheduler
+
+    max_concurrency = settings.LLM_MAX_CONCURRENCY
+    requests_per_minute = settings.LLM_REQUESTS_PER_MINUTE
+    tokens_per_minute = settings.LLM_TOKENS_PER_MINUTE
+    limit_value = getattr(settings, f"LLM_LIMIT_{model_key}", "")
+    if limit_value:
+        try:
+            max_concurrency, requests_per_minute, tokens_per_minute = [int(v.strip() or 0) for v in limit_value.split(",")]
+        except ValueError:
+            logger.error(f"LLM_LIMIT_{model_key} must be formatted as 'concurrency,rpm,tpm', using defaults")
+
+    scheduler = LLMRequestScheduler(
+        max_concurrency=max_concurrency,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        max_retries=settings.LLM_MAX_RETRIES,
+        retry_base_delay=settings.LLM_RETRY_BASE_DELAY,
+    )
+    logger.info(f"LLM scheduler for {model_key}: concurrency={max_concurrency}, rpm={requests_per_minute}, tpm={tokens_per_minute}")
+    return _schedulers.setdefault(model_key, scheduler)
+
+
+def get_llm_input_token_budget(model: str) -> int:
+    """
+    每次抽取请求中chunk文本的token上限
+    /
+    默认取 LLM_INPUT_TOKEN_BUDGET, 可通过 LLM_INPUT_TOKENS_{model} 按模型覆盖, 0 表示不按token打包
+    """
+    model_key = model.lower().replace("-", "_").strip()
+    budget = getattr(settings, f"LLM_INPUT_TOKENS_{model_key}", None)
+    return settings.LLM_INPUT_TOKEN_BUDGET if budget is None else budget
+
@@ -0,0 +1,119 @@
+from langchain_neo4j import Neo4jGraph
+
+from threading import Lock
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# 热点 MATCH/MERGE 键的约束与索引
+# kind: unique 唯一约束(自带索引)  range: 普通范围索引(不同label的实体可能重名, __Entity__.id 不能唯一)
+SCHEMA_DEFINITIONS = [
+    {"name": "document_file_name_unique", "kind": "unique", "label": "Document", "property": "fileName"},
+    {"name": "chunk_id_unique", "kind": "unique", "label": "Chunk", "property": "id"},
+    {"name": "chunk_file_name_index", "kind": "range", "label": "Chunk", "property": "fileName"},
+    {"name": "entity_id_index", "kind": "range", "label": "__Entity__", "property": "id"},
+]
+
+SHOW_CONSTRAINTS = "SHOW CONSTRAINTS YIELD name, type, labelsOrTypes, properties RETURN name, type, labelsOrTypes, properties"
+SHOW_INDEXES = (
+    "SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, state, populationPercent "
+    "WHERE entityType = 'NODE' RETURN name, type, labelsOrTypes, properties, state, populationPercent"
+)
+
+_bootstrap_lock = Lock()
+_bootstrapped: set = set()
+
+
+def _create_statement(definition: dict) -> str:
+    label, prop, name = definition["label"], definition["property"], definition["name"]
+    if definition["kind"] == "unique":
+        return f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:`{label}`) REQUIRE n.`{prop}` IS UNIQUE"
+    return f"CREATE INDEX {name} IF NOT EXISTS FOR (n:`{label}`) ON (n.`{prop}`)"
+
+
+def verify_graph_schema(graph: Neo4jGraph) -> dict:
+    """
+    按 label/属性 比对已有约束与索引(不依赖名称)
+    /
+    返回 {"items": [...], "missing": [name, ...]}
+    唯一约束自带范围索引, 因此也满足 range 类型的要求
+    """
+    constraints = graph.query(SHOW_CONSTRAINTS)
+    indexes = graph.query(SHOW_INDEXES)
+
+    unique_keys = {
+        (tuple(c["labelsOrTypes"] or []), tuple(c["properties"] or []))
+        for c in constraints
+        if "UNIQUE" in (c["type"] or "") or "KEY" in (c["type"] or "")
+    }
+    range_indexes = {
+        (tuple(i["labelsOrTypes"] or []), tuple(i["properties"] or [])): i
+        for i in indexes
+        if i["type"] == "RANGE"
+    }
+
+    items = []
+    for definition in SCHEMA_DEFINITIONS:
+        key = ((definition["label"],), (definition["property"],))
+        index = range_indexes.get(key)
+        if definition["kind"] == "unique":
+            present = key in unique_keys
+        else:
+            present = key in unique_keys or index is not None
+        items.append({
+            **definition,
+            "present": present,
+            "state": index["state"] if index else None,
+            "populationPercent": index["populationPercent"] if index else None,
+        })
+    return {"items": items, "missing": [item["name"] for item in items if not item["present"]]}
+
+
+def ensure_graph_schema(graph: Neo4jGraph, wait_seconds: int = 0) -> dict:
+    """
+    幂等地创建缺失的约束与索引, 返回创建后的校验结果
+    /
+    创建失败(例如历史数据中存在重复值)只记录错误, 不影响后续写入
+    wait_seconds > 0 时等待新建索引 ONLINE
+    """
+    report = verify_graph_schema(graph)
+    errors = {}
+    created = []
+    for item in report["items"]:
+        if item["present"]:
+            continue
+        try:
+            graph.query(_create_statement(item))
+            created.append(item["name"])
+            logger.info(f"Created {item['kind']} schema {item['name']} on :{item['label']}({item['property']})")
+        except Exception as e:
+            errors[item["name"]] = str(e)
+            logger.error(f"Unable to create schema {item['name']}: {e}")
+
+    if created and wait_seconds > 0:
+        try:
+            graph.query("CALL db.awaitIndexes($timeout)", {"timeout": wait_seconds})
+        except Exception as e:
+            logger.warning(f"Indexes are still populating: {e}")
+
+    report = verify_graph_schema(graph) if created else report
+    report["created"] = created
+    report["errors"] = errors
+    return report
+
+
+def bootstrap_graph_schema_once(graph: Neo4jGraph, key) -> None:
+    """ 每个连接(凭证)在进程内只做一次schema引导 """
+    if key in _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if key in _bootstrapped:
+            return
+        try:
+            report = ensure_graph_schema(graph)
+            if report["missing"]:
+                logger.warning(f"Graph schema is incomplete, missing: {report['missing']}")
+        except Exception as e:
+            logger.error(f"Graph schema bootstrap failed: {e}")
+        _bootstrapped.add(key)
@@ -0,0 +1,120 @@
+from langchain_neo4j import Neo4jGraph
+from langchain_neo4j.graphs.graph_document import GraphDocument
+
+from .common.cyphers import (
+    BULK_MERGE_ENTITY_NODES,
+    BULK_MERGE_ENTITY_RELATIONSHIPS,
+    BULK_MERGE_CHUNK_ENTITY_RELATIONS,
+    MARK_CHUNK_STAGE,
+)
+from config import CHUNK_STAGE_EXTRACTED
+
+from collections import defaultdict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def escape_label(label: str) -> str:
+    """ label / 关系类型 转义为 Cypher 标识符 """
+    return "`" + str(label).replace("`", "``") + "`"
+
+
+class BulkGraphWriter:
+    """
+    知识图谱批量写入
+    /
+    - 在客户端对整批 GraphDocument 的节点、关系、HAS_ENTITY 去重
+    - 按 label / 关系类型分组, 每组一条参数化的 UNWIND MERGE (不使用 apoc 动态 label)
+    - 实体、实体关系、chunk与实体的关系在同一个事务中写入, 由驱动负责瞬时错误(死锁)重试
+    - 同一事务中置位本批chunk的 extracted 阶段, 断点续跑时不会重复抽取
+    """
+
+    def __init__(self, graph: Neo4jGraph, batch_size: int = 1000):
+        self.graph = graph
+        self.batch_size = batch_size
+
+    @staticmethod
+    def group_graph_documents(graph_documents: list[GraphDocument]):
+        """ 去重并分组: 节点按label, 关系按(起点label, 类型, 终点label), HAS_ENTITY按实体label """
+        nodes = defaultdict(dict)           # {label: {id: properties}}
+        relationships = defaultdict(dict)   # {(source_label, type, target_label): {(source_id, target_id): properties}}
+        chunk_entities = defaultdict(set)   # {label: {(chunk_id, node_id)}}
+
+        def add_node(node, chunk_ids):
+            properties = nodes[node.type].setdefault(node.id, {})
+            properties.update(node.properties or {})
+            for chunk_id in chunk_ids:
+                chunk_entities[node.type].add((chunk_id, node.id))
+
+        for graph_document in graph_documents:
+            chunk_ids = graph_document.source.metadata.get("combined_chunk_ids", [])
+            for node in graph_document.nodes:
+                add_node(node, chunk_ids)
+            for rel in graph_document.relationships:
+                # 关系两端的实体同样出现在这段文本中, 一并写入并关联chunk
+                add_node(rel.source, chunk_ids)
+                add_node(rel.target, chunk_ids)
+                key = (rel.source.type, rel.type, rel.target.type)
+                properties = relationships[key].setdefault((rel.source.id, rel.target.id), {})
+                properties.update(rel.properties or {})
+        return nodes, relationships, chunk_entities
+
+    def _batches(self, rows: list):
+        for i in range(0, len(rows), self.batch_size):
+            yield rows[i : i + self.batch_size]
+
+    def _write_tx(self, tx, nodes, relationships, chunk_entities, file_name, extracted_chunk_ids):
+        counts = {"entityEntityRelCount": 0, "hasEntityRelCount": 0, "entityNodeCount": 0}
+
+        # 1. 实体节点, 按固定顺序写入以减少并发事务间的死锁
+        for label in sorted(nodes):
+            rows = [{"id": node_id, "properties": properties} for node_id, properties in sorted(nodes[label].items(), key=lambda item: str(item[0]))]
+            query = BULK_MERGE_ENTITY_NODES.format(label=escape_label(label))
+            for batch in self._batches(rows):
+                tx.run(query, rows=batch).consume()
+
+        # 2. 实体间关系
+        for source_label, rel_type, target_label in sorted(relationships):
+            items = relationships[(source_label, rel_type, target_label)]
+            rows = [
+                {"source_id": source_id, "target_id": target_id, "properties": properties}
+                for (source_id, target_id), properties in sorted(items.items(), key=lambda item: (str(item[0][0]), str(item[0][1])))
+            ]
+            query = BULK_MERGE_ENTITY_RELATIONSHIPS.format(
+                source_label=escape_label(source_label),
+                rel_type=escape_label(rel_type),
+                target_label=escape_label(target_label),
+            )
+            for batch in self._batches(rows):
+                counts["entityEntityRelCount"] += tx.run(query, rows=batch).consume().counters.relationships_created
+
+        # 3. chunk 与实体的 HAS_ENTITY
+        for label in sorted(chunk_entities):
+            rows = [{"chunk_id": chunk_id, "node_id": node_id} for chunk_id, node_id in sorted(chunk_entities[label], key=lambda item: (item[0], str(item[1])))]
+            query = BULK_MERGE_CHUNK_ENTITY_RELATIONS.format(label=escape_label(label))
+            for batch in self._batches(rows):
+                result = tx.run(query, rows=batch, f_name=file_name)
+                record = result.single()
+                counts["entityNodeCount"] += record["newEntityCount"] if record else 0
+                counts["hasEntityRelCount"] += result.consume().counters.relationships_created
+
+        # 4. chunk 处理阶段: 抽取结果与 HAS_ENTITY 在本事务中写入, 参与本批抽取的chunk(包括没有抽取到实体的)置位 extracted
+        for batch in self._batches(extracted_chunk_ids):
+            tx.run(MARK_CHUNK_STAGE, ids=batch, bit=CHUNK_STAGE_EXTRACTED).consume()
+        return counts
+
+    def write(self, graph_documents: list[GraphDocument], file_name: str):
+        """ 写入一批 GraphDocument, 返回 实体关系/HAS_ENTITY 新建数 以及该文档新增实体数 """
+        nodes, relationships, chunk_entities = self.group_graph_documents(graph_documents)
+        extracted_chunk_ids = sorted({
+            chunk_id
+            for graph_document in graph_documents
+            for chunk_id in graph_document.source.metadata.get("combined_chunk_ids", [])
+        })
+        logger.info(
+            f"Bulk writing {sum(len(v) for v in nodes.values())} nodes in {len(nodes)} labels, "
+            f"{sum(len(v) for v in relationships.values())} relationships in {len(relationships)} groups"
+        )
+        with self.graph._driver.session(database=self.graph._database) as session:
+            return session.execute_write(self._write_tx, nodes, relationships, chunk_entities, file_name, extracted_chunk_ids)
@@ -0,0 +1,301 @@
+from contextlib import contextmanager
+from typing import List, Optional
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+ACTIVE_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+FINISHED_JOB_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    dedupe_key TEXT NOT NULL,
+    file_name TEXT,
+    source_type TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    result TEXT,
+    progress TEXT,
+    cancelled_files TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs(dedupe_key, status);
+"""
+
+# 对外展示的字段(不包含带凭证的 payload)
+_PUBLIC_COLUMNS = (
+    "id, file_name, source_type, status, attempts, max_attempts, worker_id, "
+    "result, progress, cancelled_files, error, created_at, started_at, updated_at"
+)
+
+
+def _redact_payload(payload: str) -> str:
+    """ 任务结束后不再需要凭证, 去掉 payload 中的 Neo4j 密码(保留文件列表等字段) """
+    data = json.loads(payload)
+    if isinstance(data.get("credentials"), dict):
+        data["credentials"] = {**data["credentials"], "password": None}
+    return json.dumps(data)
+
+
+def _to_job(row: sqlite3.Row, with_payload: bool = False) -> dict:
+    job = dict(row)
+    for key in ("result", "progress", "cancelled_files"):
+        if job.get(key):
+            job[key] = json.loads(job[key])
+    if with_payload:
+        job["payload"] = json.loads(job["payload"])
+    else:
+        job.pop("payload", None)
+    return job
+
+
+class ExtractionJobQueue:
+    """
+    基于 SQLite 的持久化抽取任务队列
+    /
+    - 多个 worker 进程通过 BEGIN IMMEDIATE 原子地领取任务, 领取后持有租约(lease), 运行期间定期续约
+    - 租约过期(worker 崩溃/被杀)的任务会被重新放回队列, 超过 max_attempts 后标记为 failed
+    - payload 中包含 Neo4j 凭证, 数据库文件权限为 0600, 查询接口不返回 payload;
+      任务结束(完成/失败/取消)时清除 payload 中的密码, 结束的任务超过保留时间后删除
+    每次操作使用独立连接, 可在多线程/多进程中共享同一个实例的配置
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("progress", "cancelled_files"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            # 之前结束的任务可能仍保存着密码
+            for row in conn.execute(
+                "SELECT id, payload FROM jobs WHERE status IN (?, ?, ?)", FINISHED_JOB_STATUSES
+            ).fetchall():
+                redacted = _redact_payload(row["payload"])
+                if redacted != row["payload"]:
+                    conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (redacted, row["id"]))
+        try:
+            os.chmod(db_path, 0o600)
+        except OSError:
+            pass
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """ 写事务, BEGIN IMMEDIATE 保证领取/回收在多进程间互斥 """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, payload: dict, dedupe_key: str, file_name: str = None, source_type: str = None) -> dict:
+        """ 提交任务, 同一 dedupe_key 已有排队/运行中的任务时直接返回该任务 """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"SELECT {_PUBLIC_COLUMNS} FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) LIMIT 1",
+                (dedupe_key, *ACTIVE_JOB_STATUSES),
+            ).fetchone()
+            if row is not None:
+                return {**_to_job(row), "deduplicated": True}
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, dedupe_key, file_name, source_type, payload, status, max_attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, dedupe_key, file_name, source_type, json.dumps(payload), JOB_QUEUED, self.max_attempts, now, now),
+            )
+        logger.info(f"Queued extraction job {job_id} for {file_name}")
+        return {**self.get(job_id), "deduplicated": False}
+
+    def reclaim_expired(self) -> List[dict]:
+        """
+        回收租约过期的任务
+        /
+        未超过最大尝试次数的重新排队, 其余标记为 failed 并返回(带 payload), 由调用方同步 Document 状态
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            expired = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND lease_expires_at < ?", (JOB_RUNNING, now)
+            ).fetchall()
+            exhausted = []
+            for row in expired:
+                if row["attempts"] < row["max_attempts"]:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                        (JOB_QUEUED, now, row["id"]),
+                    )
+                    logger.warning(f"Reclaimed job {row['id']} from worker {row['worker_id']} (attempt {row['attempts']})")
+                else:
+                    # 返回的任务仍带凭证(调用方需要同步 Document 状态), 数据库中的 payload 去掉密码
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, payload = ?, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                        (JOB_FAILED, "Worker lost the job too many times", _redact_payload(row["payload"]), now, row["id"]),
+                    )
+                    exhausted.append(_to_job(row, with_payload=True))
+        return exhausted
+
+    def release_worker(self, worker_id: str) -> None:
+        """ worker 进程退出时立即让其租约过期, 下一次 reclaim_expired 即可回收 """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires_at = 0 WHERE status = ? AND worker_id = ?", (JOB_RUNNING, worker_id)
+            )
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[dict]:
+        """ 领取最早排队的任务(带 payload), 没有任务时返回 None """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, lease_expires_at = ?, "
+                "started_at = COALESCE(started_at, ?), updated_at = ? WHERE id = ?",
+                (JOB_RUNNING, worker_id, now + lease_seconds, now, now, row["id"]),
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        return _to_job(job, with_payload=True)
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """ 续约, 任务已被回收(不再属于该 worker)时返回 False """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + lease_seconds, now, job_id, worker_id, JOB_RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def update_progress(self, job_id: str, worker_id: str, progress: dict) -> bool:
+        """ 记录运行中任务的进度(例如批量任务中每个文件的进度) """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+                (json.dumps(progress, default=str), now, job_id, worker_id, JOB_RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def request_cancel(self, dedupe_prefix: str, file_names: List[str]) -> List[dict]:
+        """
+        取消包含这些文件的排队/运行中任务(dedupe_key 以 dedupe_prefix 开头, 即同一个数据库)
+        /
+        排队中且全部文件都被取消的任务直接标记为 cancelled, 其余任务记录 cancelled_files,
+        由运行任务的 worker 轮询后置位进程内的取消信号; 返回受影响的任务
+        """
+        now = time.time()
+        names = set(file_names)
+        affected = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND substr(dedupe_key, 1, ?) = ?",
+                (*ACTIVE_JOB_STATUSES, len(dedupe_prefix), dedupe_prefix),
+            ).fetchall()
+            for row in rows:
+                payload = json.loads(row["payload"])
+                job_files = set(payload["file_paths"]) if "file_paths" in payload else {row["file_name"]}
+                hit = job_files & names
+                if not hit:
+                    continue
+                cancelled = set(json.loads(row["cancelled_files"] or "[]")) | hit
+                if row["status"] == JOB_QUEUED and cancelled >= job_files:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, cancelled_files = ?, payload = ?, updated_at = ? WHERE id = ?",
+                        (JOB_CANCELLED, json.dumps(sorted(cancelled)), _redact_payload(row["payload"]), now, row["id"]),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET cancelled_files = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(sorted(cancelled)), now, row["id"]),
+                    )
+                affected.append({"id": row["id"], "status": row["status"], "cancelled_files": sorted(hit)})
+        return affected
+
+    def get_cancelled_files(self, job_id: str) -> List[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancelled_files FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["cancelled_files"]) if row and row["cancelled_files"] else []
+
+    def finish(self, job_id: str, worker_id: str, status: str, result: dict = None, error: str = None) -> bool:
+        """ 记录任务结果并清除 payload 中的密码, 仅当任务仍属于该 worker 时生效 """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT payload FROM jobs WHERE id = ? AND worker_id = ? AND status = ?", (job_id, worker_id, JOB_RUNNING)
+            ).fetchone()
+            if row is None:
+                return False
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, payload = ?, lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, default=str) if result is not None else None, error,
+                 _redact_payload(row["payload"]), now, job_id),
+            )
+            return True
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """ 删除结束超过 older_than_seconds 的任务, 返回删除数量 """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+                (*FINISHED_JOB_STATUSES, time.time() - older_than_seconds),
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {_PUBLIC_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _to_job(row) if row else None
+
+    def list(self, status: str = None, file_name: str = None, limit: int = 100) -> List[dict]:
+        clauses, args = [], []
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        if file_name:
+            clauses.append("file_name = ?")
+            args.append(file_name)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {_PUBLIC_COLUMNS} FROM jobs {where} ORDER BY created_at DESC LIMIT ?", (*args, limit)
+            ).fetchall()
+        return [_to_job(row) for row in rows]
@@ -0,0 +1,200 @@
+from config import settings
+from .job_queue import ExtractionJobQueue, JOB_FAILED
+from .cancellation import cancellation_key, get_cancellation_registry
+
+from threading import Event, Lock, Thread
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+PURGE_INTERVAL_SECONDS = 3600  # 清理过期任务的间隔
+DEFAULT_JOB_QUEUE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "jobs", "extract_jobs.db")
+
+_queue = None
+_queue_lock = Lock()
+_pool = None
+
+
+def get_job_queue() -> ExtractionJobQueue:
+    """ 进程内共享的任务队列 """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ExtractionJobQueue(settings.JOB_QUEUE_DB_PATH or DEFAULT_JOB_QUEUE_DB, settings.JOB_MAX_ATTEMPTS)
+        return _queue
+
+
+def _watch_job(queue: ExtractionJobQueue, job: dict, worker_id: str, lease_seconds: float, cancel_poll_seconds: float, done: Event):
+    """
+    任务运行期间的监视线程
+    /
+    - 每 1/3 租约续约一次, 租约丢失(任务已被其他 worker 回收)时取消本进程中该任务的全部文件
+    - 每 cancel_poll_seconds 读取一次取消接口记录的文件, 置位进程内的取消信号
+    批量任务中尚未开始的文件没有注册取消信号, 会在之后的轮询中重试
+    """
+    credentials = job["payload"]["credentials"]
+    registry = get_cancellation_registry()
+    job_files = list(job["payload"]["file_paths"]) if "file_paths" in job["payload"] else [job["payload"]["params"]["file_name"]]
+
+    def key(file_name):
+        return cancellation_key(credentials["uri"], credentials["database"], file_name)
+
+    notified = set()
+    next_heartbeat = time.time() + lease_seconds / 3
+    while not done.wait(min(cancel_poll_seconds, lease_seconds / 3)):
+        try:
+            for file_name in set(queue.get_cancelled_files(job["id"])) - notified:
+                if registry.cancel(key(file_name)):
+                    notified.add(file_name)
+            if time.time() >= next_heartbeat:
+                next_heartbeat = time.time() + lease_seconds / 3
+                if not queue.heartbeat(job["id"], worker_id, lease_seconds):
+                    logger.warning(f"Worker {worker_id} lost the lease of job {job['id']}, cancelling it")
+                    for file_name in job_files:
+                        registry.cancel(key(file_name))
+                    return
+        except Exception as e:
+            logger.error(f"Unable to watch job {job['id']}: {e}")
+
+
+def worker_main(db_path: str, worker_id: str, max_attempts: int, lease_seconds: float, poll_seconds: float, stop_event):
+    """
+    worker 进程入口: 循环 回收过期任务 -> 领取任务 -> 运行抽取 -> 记录结果
+    /
+    所有任务在同一个事件循环中运行, 使进程内缓存的异步驱动可以跨任务复用
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import service  # 只在 worker 进程中加载抽取相关的重依赖
+
+    queue = ExtractionJobQueue(db_path, max_attempts)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    logger.info(f"Extraction worker {worker_id} started (pid {os.getpid()})")
+
+    # 非 daemon 进程, API 进程异常退出时由 worker 自己发现并退出
+    parent = multiprocessing.parent_process()
+    while not stop_event.is_set() and (parent is None or parent.is_alive()):
+        try:
+            for job in queue.reclaim_expired():
+                loop.run_until_complete(service.fail_extraction_job_document(job, job["error"] or "Worker lost the job"))
+            job = queue.claim(worker_id, lease_seconds)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} unable to claim jobs: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(poll_seconds)
+            continue
+
+        done = Event()
+        Thread(
+            target=_watch_job,
+            args=(queue, job, worker_id, lease_seconds, settings.JOB_CANCEL_POLL_SECONDS, done),
+            daemon=True,
+        ).start()
+        try:
+            status, result = loop.run_until_complete(service.run_extraction_job(job))
+            queue.finish(job["id"], worker_id, status, result=result)
+        except Exception as e:
+            logger.error(f"Extraction job {job['id']} failed: {e}")
+            queue.finish(job["id"], worker_id, JOB_FAILED, error=str(e))
+        finally:
+            done.set()
+
+    loop.close()
+    logger.info(f"Extraction worker {worker_id} stopped")
+
+
+class JobWorkerPool:
+    """
+    抽取 worker 进程池
+    /
+    监控线程发现 worker 进程退出时, 立即让其持有的租约过期并拉起新的 worker, 任务由其他 worker 回收重跑;
+    同时每小时删除超过 JOB_RETENTION_SECONDS 的结束任务
+    """
+
+    def __init__(self, queue: ExtractionJobQueue, workers: int, lease_seconds: float, poll_seconds: float):
+        self.queue = queue
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._stopped = Event()
+        self._processes = {}
+        self._monitor_thread = None
+
+    def _spawn(self, slot: int):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{slot}-{uuid.uuid4().hex[:6]}"
+        process = self._context.Process(
+            target=worker_main,
+            args=(self.queue.db_path, worker_id, self.queue.max_attempts, self.lease_seconds, self.poll_seconds, self._stop_event),
+            name=f"extract-worker-{slot}",
+            daemon=False,  # worker 内部的PDF解析/分块还会创建子进程, daemon 进程不允许有子进程
+        )
+        process.start()
+        self._processes[slot] = (worker_id, process)
+
+    def _purge_finished_jobs(self):
+        if settings.JOB_RETENTION_SECONDS <= 0:
+            return
+        try:
+            purged = self.queue.purge_finished(settings.JOB_RETENTION_SECONDS)
+            if purged:
+                logger.info(f"Purged {purged} finished extraction jobs")
+        except Exception as e:
+            logger.error(f"Unable to purge finished extraction jobs: {e}")
+
+    def _monitor(self):
+        next_purge = 0.0
+        while not self._stopped.wait(self.poll_seconds):
+            if time.time() >= next_purge:
+                next_purge = time.time() + PURGE_INTERVAL_SECONDS
+                self._purge_finished_jobs()
+            for slot, (worker_id, process) in list(self._processes.items()):
+                if process.is_alive() or self._stopped.is_set():
+                    continue
+                logger.warning(f"Extraction worker {worker_id} exited with code {process.exitcode}, restarting")
+                self.queue.release_worker(worker_id)
+                self._spawn(slot)
+
+    def start(self):
+        for slot in range(self.workers):
+            self._spawn(slot)
+        self._monitor_thread = Thread(target=self._monitor, name="extract-worker-monitor", daemon=True)
+        self._monitor_thread.start()
+        logger.info(f"Started {self.workers} extraction workers")
+
+    def stop(self, timeout: float = 10):
+        """ 通知 worker 在当前任务结束后退出, 超时仍未退出的进程被终止, 其任务在重启后回收 """
+        self._stopped.set()
+        self._stop_event.set()
+        deadline = time.time() + timeout
+        for worker_id, process in self._processes.values():
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+                self.queue.release_worker(worker_id)
+
+
+def start_job_workers():
+    """ 应用启动时拉起 worker 进程, JOB_QUEUE_WORKERS 为0时 /extract 在请求内同步执行 """
+    global _pool
+    if settings.JOB_QUEUE_WORKERS <= 0 or _pool is not None:
+        return
+    _pool = JobWorkerPool(get_job_queue(), settings.JOB_QUEUE_WORKERS, settings.JOB_LEASE_SECONDS, settings.JOB_POLL_SECONDS)
+    _pool.start()
+
+
+def stop_job_workers():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
@@ -0,0 +1,186 @@
+from langchain_neo4j import Neo4jGraph
+import numpy as np
+
+from .common.cyphers import (
+    GET_CHUNK_EMBEDDINGS_PAGE,
+    GET_FILE_CHUNK_EMBEDDINGS_PAGE,
+    MERGE_SIMILAR_CHUNK_RELATIONSHIPS,
+)
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_to_index_score(cosine: np.ndarray) -> np.ndarray:
+    """ 与 Neo4j cosine 向量索引的分数保持一致: (1 + cos) / 2 """
+    return (1.0 + cosine) / 2.0
+
+
+class BlockKNNBuilder:
+    """
+    分块计算 Chunk 之间的 KNN 并写入 SIMILAR 关系
+    /
+    - 按 Chunk.id 键集分页读取 embedding, 每页归一化为 float32 矩阵
+    - 语料同样按 block_size 切块, 查询块与语料块做矩阵乘, 每个查询保留滚动合并的 top-k (安装了 faiss 时可用 IndexFlatIP)
+    - 相似对去重为无向边后按 write_batch_size 分批 UNWIND MERGE
+    - file_names 不为空时只加载这些文件的 chunk 作为查询(增量), 全库语料逐页读取, 不整体驻留内存
+    """
+
+    def __init__(self,
+                 graph: Neo4jGraph,
+                 top_k: int = 5,
+                 min_score: float = 0.8,
+                 page_size: int = 10000,
+                 block_size: int = 4096,
+                 write_batch_size: int = 1000,
+                 backend: str = "numpy"
+                 ):
+        self.graph = graph
+        self.top_k = top_k
+        self.min_score = min_score
+        self.page_size = page_size
+        self.block_size = block_size
+        self.write_batch_size = write_batch_size
+        self.backend = backend
+
+    def _iter_embedding_pages(self, file_names: Optional[List[str]] = None) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """ 键集分页读取 (chunk ids, 归一化后的 embedding 矩阵) """
+        after = ""
+        query = GET_FILE_CHUNK_EMBEDDINGS_PAGE if file_names else GET_CHUNK_EMBEDDINGS_PAGE
+        while True:
+            rows = self.graph.query(query, {"after": after, "limit": self.page_size, "file_names": file_names or []})
+            if not rows:
+                break
+            ids = [row["id"] for row in rows]
+            yield ids, _normalize(np.asarray([row["embedding"] for row in rows], dtype=np.float32))
+            after = ids[-1]
+            if len(rows) < self.page_size:
+                break
+
+    def _load_embeddings(self, file_names: Optional[List[str]] = None) -> Tuple[List[str], Optional[np.ndarray]]:
+        """ 读取全部 (chunk id, embedding), 用作查询矩阵 """
+        ids, pages = [], []
+        for page_ids, page in self._iter_embedding_pages(file_names):
+            ids.extend(page_ids)
+            pages.append(page)
+        if not ids:
+            return [], None
+        return ids, pages[0] if len(pages) == 1 else np.concatenate(pages)
+
+    def _corpus_tiles(self, pages: Iterable[Tuple[List[str], np.ndarray]], corpus_ids: List[str]) -> Iterator[Tuple[int, np.ndarray]]:
+        """ 把语料页切成不超过 block_size 的块, 返回 (全局偏移, 块), 同时把 id 追加到 corpus_ids """
+        for page_ids, page in pages:
+            offset = len(corpus_ids)
+            corpus_ids.extend(page_ids)
+            for start in range(0, page.shape[0], self.block_size):
+                yield offset + start, page[start : start + self.block_size]
+
+    def _top_k_numpy(self, queries: np.ndarray, corpus_tiles: Iterable[Tuple[int, np.ndarray]], k: int):
+        """
+        查询与语料都分块做矩阵乘, 滚动合并 top-k
+        /
+        返回 (scores, indices) 均为 [n_query, k] 按分数降序, 语料不足 k 个时用 (-inf, -1) 补齐
+        """
+        best_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        best_indices = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for offset, tile in corpus_tiles:
+            tile_indices = np.arange(offset, offset + tile.shape[0], dtype=np.int64)
+            for start in range(0, queries.shape[0], self.block_size):
+                end = start + self.block_size
+                block = queries[start:end] @ tile.T
+                scores = np.concatenate((best_scores[start:end], block), axis=1)
+                indices = np.concatenate(
+                    (best_indices[start:end], np.broadcast_to(tile_indices, block.shape)), axis=1
+                )
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                best_scores[start:end] = np.take_along_axis(scores, keep, axis=1)
+                best_indices[start:end] = np.take_along_axis(indices, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_indices, order, axis=1)
+
+    def _top_k_faiss(self, queries: np.ndarray, corpus_tiles: Iterable[Tuple[int, np.ndarray]], k: int):
+        import faiss
+
+        index = faiss.IndexFlatIP(queries.shape[1])
+        for _, tile in corpus_tiles:
+            index.add(np.ascontiguousarray(tile))
+        scores, indices = index.search(np.ascontiguousarray(queries), k)
+        return scores, indices
+
+    def compute_pairs(self,
+                      query_ids: List[str],
+                      queries: np.ndarray,
+                      corpus_ids: List[str],
+                      corpus_tiles: Iterable[Tuple[int, np.ndarray]]
+                      ) -> List[dict]:
+        """
+        计算相似对(去掉自身, 无向去重, 分数不低于 min_score)
+        /
+        corpus_tiles 为 (全局偏移, 块) 序列, 遍历结束后 corpus_ids 需覆盖全部偏移
+        """
+        k = self.top_k + 1  # 多取一个, 排除自身
+        top_k = self._top_k_numpy
+        if self.backend == "faiss":
+            try:
+                import faiss  # noqa: F401
+                top_k = self._top_k_faiss
+            except ImportError:
+                logger.warning("faiss is not installed, falling back to numpy KNN")
+        cosine, indices = top_k(queries, corpus_tiles, k)
+        scores = cosine_to_index_score(cosine)
+
+        pairs = {}
+        for row, source in enumerate(query_ids):
+            kept = 0
+            for score, index in zip(scores[row], indices[row]):
+                if kept >= self.top_k or index < 0:
+                    break
+                target = corpus_ids[index]
+                if target == source:
+                    continue
+                kept += 1
+                if score < self.min_score:
+                    break
+                key = (source, target) if source < target else (target, source)
+                pairs[key] = max(float(score), pairs.get(key, 0.0))
+        return [{"source": s, "target": t, "score": score} for (s, t), score in pairs.items()]
+
+    def write_pairs(self, pairs: List[dict]) -> int:
+        created = 0
+        for i in range(0, len(pairs), self.write_batch_size):
+            result = self.graph.query(MERGE_SIMILAR_CHUNK_RELATIONSHIPS, {"rows": pairs[i : i + self.write_batch_size]})
+            created += result[0]["count"] if result else 0
+        return created
+
+    def run(self, file_names: Optional[List[str]] = None) -> dict:
+        """ 计算并写入 SIMILAR 关系, file_names 为空时处理全库 """
+        start = time.time()
+        query_ids, queries = self._load_embeddings(file_names)
+        if queries is None:
+            logger.info(f"No chunk embeddings found for {file_names or 'all chunks'}, skip KNN")
+            return {"chunks": 0, "similarPairs": 0}
+
+        corpus_ids: List[str] = []
+        if file_names:
+            # 增量: 只有查询向量驻留内存, 全库语料逐页读取
+            pages = self._iter_embedding_pages()
+        else:
+            # 全量: 查询即语料, 复用同一个矩阵
+            pages = [(query_ids, queries)]
+
+        pairs = self.compute_pairs(query_ids, queries, corpus_ids, self._corpus_tiles(pages, corpus_ids))
+        written = self.write_pairs(pairs)
+        logger.info(
+            f"Block KNN: {len(query_ids)} query chunks against {len(corpus_ids)} chunks, "
+            f"{written} SIMILAR relationships written in {time.time() - start:.2f} seconds"
+        )
+        return {"chunks": len(query_ids), "similarPairs": written}
@@ -5,6 +5,7 @@ from collections import defaultdict, deque
 
 from .utils import * 
 from .storage.base import BaseStorage
+from ..embedding_cache import with_embedding_cache
 
 
 
@@ -15,7 +16,7 @@ class LongTermMemory:
 
     def __init__(self, embedding_func: Embeddings, storage: BaseStorage, knowledge_capacity: int=100):
         
-        self.embedding_func = embedding_func
+        self.embedding_func = with_embedding_cache(embedding_func)
         self.storage = storage
         self.knowledge_capacity = knowledge_capacity
 
@@ -7,6 +7,7 @@ from langchain_core.embeddings import Embeddings
 
 from .multitask_llm import MultiTaskLLM
 from .storage.base import BaseStorage
+from ..embedding_cache import with_embedding_cache
 from .utils import *
 
 import logging
@@ -26,7 +27,7 @@ class MidTermMemory:
                  max_capacity: int = 2000
     ):
         self.multitask_llm = multitask_llm
-        self.embedding_func = embedding_func
+        self.embedding_func = with_embedding_cache(embedding_func)
         self.max_capacity = max_capacity
         self.storage = storage
 
@@ -9,6 +9,7 @@ from typing import Any, List, Type
 from pydantic import BaseModel, Field, ConfigDict
 
 from src.embedding import load_embedding_model
+from src.fulltext_index import FULLTEXT_INDEX_DEFINITIONS, resolve_fulltext_index_name
 from src.common.cyphers import RETRIEVER_QUERY
 from config import settings
 
@@ -137,7 +138,7 @@ class GraphRetrieveTool(BaseTool):
                 node_label="Chunk",
                 embedding_node_property="embedding",
                 text_node_properties=["text"],
-                keyword_index_name="keyword"
+                keyword_index_name=resolve_fulltext_index_name(self.graph, FULLTEXT_INDEX_DEFINITIONS["hybrid"]["name"])
             )
             search_kwargs["fileName"] = {'$in': file_names}
             
@@ -0,0 +1,140 @@
+from langchain_neo4j import Neo4jGraph
+from neo4j.exceptions import TransientError
+
+from .common.cyphers import (
+    COUNT_LABEL_NODES,
+    COUNT_TYPE_RELATIONSHIPS,
+    RELABEL_NODES_IN_TRANSACTIONS,
+    RETYPE_RELATIONSHIPS_IN_TRANSACTIONS,
+)
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(name: str) -> str:
+    """ 标签/关系类型放在反引号中拼接, 转义其中的反引号 """
+    return name.replace("`", "``")
+
+
+def _group_by_target(mapping: Dict[str, str]) -> Dict[str, List[str]]:
+    """ {old: new} -> {new: [old, ...]}, 同一目标的改写在一个任务内顺序执行, 避免并发锁同一批节点 """
+    groups = defaultdict(list)
+    for old, new in mapping.items():
+        if old != new:
+            groups[new].append(old)
+    return dict(groups)
+
+
+class SchemaConsolidator:
+    """
+    按 LLM 给出的映射整合节点标签与关系类型
+    /
+    - 每个 (旧 -> 新) 改写用 CALL { } IN TRANSACTIONS 分批提交, 事务内存不随数据量增长
+    - 关系改写会复制旧关系的全部属性
+    - 映射按目标名称分组, 不同分组并发执行; 先整合节点标签再整合关系类型
+    - 改写是幂等的(只处理仍带有旧标签/类型的数据), 死锁等瞬时错误时整条改写重试, 已提交的批次不会重复处理
+    """
+
+    def __init__(self,
+                 graph: Neo4jGraph,
+                 batch_size: int = 10000,
+                 max_workers: int = 4,
+                 max_retries: int = 3,
+                 on_progress: Optional[Callable[[dict], None]] = None
+                 ):
+        self.graph = graph
+        self.batch_size = batch_size
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.on_progress = on_progress
+        self._progress_lock = Lock()
+        self._progress = {}
+
+    def _run(self, query: str) -> tuple:
+        """ 在自动提交事务中执行(CALL IN TRANSACTIONS 不能在显式事务中运行) """
+        with self.graph._driver.session(database=self.graph._database) as session:
+            result = session.run(query, batch_size=self.batch_size)
+            records = [record.data() for record in result]
+            return records, result.consume().counters
+
+    def _report(self, phase: str, target: str, old: str, done: int, total: int):
+        with self._progress_lock:
+            progress = self._progress.setdefault(phase, {"done": 0, "total": 0})
+            progress["done"] += done
+            event = {
+                "phase": phase,
+                "target": target,
+                "source": old,
+                "count": done,
+                "done": progress["done"],
+                "total": progress["total"],
+            }
+        logger.info(f"Consolidated {phase} {old} -> {target}: {done} ({event['done']}/{event['total']})")
+        if self.on_progress:
+            self.on_progress(event)
+
+    def _rewrite(self, phase: str, target: str, old: str, total: int) -> int:
+        template = RELABEL_NODES_IN_TRANSACTIONS if phase == "nodes" else RETYPE_RELATIONSHIPS_IN_TRANSACTIONS
+        query = template.format(old=_escape(old), new=_escape(target))
+        retries = 0
+        while True:
+            try:
+                _, counters = self._run(query)
+                break
+            except TransientError as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                logger.warning(f"Transient error while consolidating {old} -> {target}, retry {retries}/{self.max_retries}: {e}")
+                time.sleep(retries)
+        # 重试时前面已提交的批次不在本次计数中, 以改写前的数量为准
+        return total if retries else (counters.labels_added if phase == "nodes" else counters.relationships_created)
+
+    def _consolidate_group(self, phase: str, target: str, olds: List[str], totals: Dict[str, int]) -> dict:
+        rewritten = {}
+        for old in olds:
+            if not totals[old]:
+                continue
+            rewritten[old] = self._rewrite(phase, target, old, totals[old])
+            self._report(phase, target, old, rewritten[old], totals[old])
+        return rewritten
+
+    def _consolidate(self, phase: str, mapping: Dict[str, str]) -> dict:
+        groups = _group_by_target(mapping)
+        if not groups:
+            return {}
+        count_query = COUNT_LABEL_NODES if phase == "nodes" else COUNT_TYPE_RELATIONSHIPS
+        totals = {
+            old: self._run(count_query.format(old=_escape(old)))[0][0]["count"]
+            for olds in groups.values()
+            for old in olds
+        }
+        self._progress[phase] = {"done": 0, "total": sum(totals.values())}
+        logger.info(f"Consolidating {len(totals)} {phase} into {len(groups)} targets, {self._progress[phase]['total']} items")
+
+        result = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as executor:
+            futures = {
+                executor.submit(self._consolidate_group, phase, target, olds, totals): target
+                for target, olds in groups.items()
+            }
+            for future in as_completed(futures):
+                result[futures[future]] = future.result()
+        return result
+
+    def run(self, node_mapping: Dict[str, str], relation_mapping: Dict[str, str]) -> dict:
+        """ 返回 {"nodes": {新标签: {旧标签: 数量}}, "relationships": {...}} """
+        start = time.time()
+        report = {
+            "nodes": self._consolidate("nodes", node_mapping or {}),
+            "relationships": self._consolidate("relationships", relation_mapping or {}),
+        }
+        logger.info(f"Schema consolidation finished in {time.time() - start:.2f} seconds")
+        return report
@@ -0,0 +1,331 @@
+from threading import Lock
+from typing import BinaryIO, Dict, Optional
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+BUFFER_SIZE = 1024 * 1024  # 每次读写 1MiB, 上传大文件时内存占用恒定
+CHECKSUM_SIZE = 32         # sha256 digest 字节数
+SESSION_DIR_NAME = "sessions"
+
+_locks_guard = Lock()
+_file_locks: Dict[str, Lock] = {}
+
+
+def _file_lock(path: str) -> Lock:
+    """ 进程内按目标文件加锁 """
+    with _locks_guard:
+        return _file_locks.setdefault(path, Lock())
+
+
+def part_size(part: BinaryIO) -> int:
+    """ 获取上传分片的字节数(不读入内存) """
+    position = part.tell()
+    part.seek(0, os.SEEK_END)
+    size = part.tell()
+    part.seek(position)
+    return size
+
+
+class UploadAssembler:
+    """
+    分片上传的服务端组装
+    /
+    - 分片直接写入目标文件的最终偏移 (chunkNumber-1)*chunkSize, 不再单独落盘后二次合并
+    - {file}.uploading:  正在组装的目标文件, 已知文件大小时预分配
+    - {file}.parts:      分片位图, 每个分片一个字节, 1 表示已接收, 分片可乱序到达
+    - {file}.sums:       每个分片 32 字节 sha256, 偏移为 (chunkNumber-1)*32
+    - {file}.meta:       chunkSize / totalChunks / fileSize / uploadId
+    全部分片到齐后 os.replace 到 merged_dir, 整个文件只写一次磁盘
+    """
+
+    def __init__(self, file_name: str, chunk_dir: str):
+        self.file_name = file_name
+        self.chunk_dir = chunk_dir
+        os.makedirs(chunk_dir, exist_ok=True)
+        self.target_path = os.path.join(chunk_dir, f"{file_name}.uploading")
+        self.bitmap_path = os.path.join(chunk_dir, f"{file_name}.parts")
+        self.meta_path = os.path.join(chunk_dir, f"{file_name}.meta")
+        self.checksum_path = os.path.join(chunk_dir, f"{file_name}.sums")
+
+    # ---------- session ----------
+    @staticmethod
+    def _session_path(chunk_dir: str, upload_id: str) -> str:
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(chunk_dir, SESSION_DIR_NAME, upload_id)
+
+    @classmethod
+    def from_session(cls, upload_id: str, chunk_dir: str) -> "UploadAssembler":
+        """ 根据 uploadId 找到对应文件的组装器 """
+        session_path = cls._session_path(chunk_dir, upload_id)
+        if not os.path.exists(session_path):
+            raise ValueError(f"Upload session {upload_id} does not exist or has been completed")
+        with open(session_path, "r", encoding="utf8") as f:
+            return cls(f.read(), chunk_dir)
+
+    def create_session(self, file_size: int, chunk_size: int, total_chunks: int) -> dict:
+        """
+        创建上传会话
+        /
+        同一文件以相同的 fileSize/chunkSize 再次创建时复用已有会话(断点续传),
+        参数不同则丢弃之前的分片重新开始
+        """
+        if chunk_size <= 0 or total_chunks <= 0 or file_size < 0:
+            raise ValueError("fileSize, chunkSize and totalChunks must be positive")
+        if total_chunks != max(1, -(-file_size // chunk_size)):
+            raise ValueError(f"totalChunks {total_chunks} does not match fileSize {file_size} / chunkSize {chunk_size}")
+
+        with open(self.bitmap_path, "ab") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                meta = self.read_meta()
+                resumable = (
+                    meta.get("uploadId")
+                    and os.path.exists(self._session_path(self.chunk_dir, meta["uploadId"]))
+                    and (meta.get("fileSize"), meta.get("chunkSize"), meta.get("totalChunks")) == (file_size, chunk_size, total_chunks)
+                )
+                if not resumable:
+                    self._reset_locked(meta)
+                    meta = {"uploadId": uuid.uuid4().hex, "fileSize": file_size, "chunkSize": chunk_size, "totalChunks": total_chunks}
+                    self._write_meta(meta)
+                    session_path = self._session_path(self.chunk_dir, meta["uploadId"])
+                    os.makedirs(os.path.dirname(session_path), exist_ok=True)
+                    with open(session_path, "w", encoding="utf8") as f:
+                        f.write(self.file_name)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return self.status()
+
+    def _reset_locked(self, meta: dict):
+        """ 丢弃之前(可能已放弃)的上传留下的分片、位图、校验和与meta, 调用方需持有位图文件锁 """
+        self._discard_session(meta.get("uploadId"))
+        for path in (self.target_path, self.checksum_path, self.meta_path):
+            if os.path.exists(path):
+                os.unlink(path)
+        os.truncate(self.bitmap_path, 0)
+
+    def _discard_session(self, upload_id: Optional[str]):
+        if not upload_id:
+            return
+        session_path = self._session_path(self.chunk_dir, upload_id)
+        if os.path.exists(session_path):
+            os.unlink(session_path)
+
+    def status(self) -> dict:
+        """ 会话状态: 已接收的分片及其校验和 """
+        meta = self.read_meta()
+        checksums = self.part_checksums()
+        received = self.received_parts()
+        return {
+            "uploadId": meta.get("uploadId"),
+            "fileName": self.file_name,
+            "fileSize": meta.get("fileSize"),
+            "chunkSize": meta.get("chunkSize"),
+            "totalChunks": meta.get("totalChunks"),
+            "receivedParts": received,
+            "checksums": {part: checksums.get(part) for part in received},
+        }
+
+    # ---------- meta ----------
+    def read_meta(self) -> dict:
+        if not os.path.exists(self.meta_path):
+            return {}
+        with open(self.meta_path, "r", encoding="utf8") as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: dict):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _resolve_meta(self, chunk_number: int, total_chunks: int, size: int,
+                      chunk_size: Optional[int], file_size: Optional[int], restart: bool = False) -> dict:
+        """
+        确定分片大小: 优先使用客户端传入的 chunkSize, 否则以非最后分片的大小为准
+        /
+        restart 为 True 时这是一次新上传的开始, 先丢弃同名文件之前留下的上传状态
+        """
+        meta = self.read_meta()
+        if restart and (meta or self.received_parts() or os.path.exists(self.target_path)):
+            logger.info(f"Discarding stale upload state of {self.file_name}, received parts {self.received_parts()}")
+            self._reset_locked(meta)
+            meta = {}
+        if meta.get("totalChunks") not in (None, total_chunks):
+            raise ValueError(f"totalChunks changed from {meta['totalChunks']} to {total_chunks} while uploading {self.file_name}")
+        meta["totalChunks"] = total_chunks
+        if chunk_size:
+            if meta.get("chunkSize") not in (None, chunk_size):
+                raise ValueError(f"chunkSize changed from {meta['chunkSize']} to {chunk_size} while uploading {self.file_name}")
+            meta["chunkSize"] = chunk_size
+        elif meta.get("chunkSize") is None and (chunk_number < total_chunks or total_chunks == 1):
+            meta["chunkSize"] = size
+        if file_size:
+            meta["fileSize"] = file_size
+        if meta.get("chunkSize") is None:
+            # 旧客户端先发最后一个分片且未携带 chunkSize, 无法确定偏移
+            raise ValueError(f"chunkSize is required to place part {chunk_number} of {self.file_name}")
+        self._write_meta(meta)
+        return meta
+
+    # ---------- bitmap ----------
+    def received_parts(self) -> list:
+        """ 已接收的分片编号(从1开始) """
+        if not os.path.exists(self.bitmap_path):
+            return []
+        with open(self.bitmap_path, "rb") as f:
+            bitmap = f.read()
+        return [i + 1 for i, flag in enumerate(bitmap) if flag]
+
+    def part_checksums(self) -> Dict[int, str]:
+        """ 已记录的分片 sha256 {chunkNumber: hex} """
+        if not os.path.exists(self.checksum_path):
+            return {}
+        with open(self.checksum_path, "rb") as f:
+            data = f.read()
+        checksums = {}
+        for i in range(0, len(data) - CHECKSUM_SIZE + 1, CHECKSUM_SIZE):
+            digest = data[i : i + CHECKSUM_SIZE]
+            if any(digest):
+                checksums[i // CHECKSUM_SIZE + 1] = digest.hex()
+        return checksums
+
+    def is_complete(self, total_chunks: int) -> bool:
+        if not os.path.exists(self.bitmap_path):
+            return False
+        with open(self.bitmap_path, "rb") as f:
+            bitmap = f.read(total_chunks)
+        return len(bitmap) == total_chunks and all(bitmap)
+
+    # ---------- write ----------
+    def write_part(self, part: BinaryIO, chunk_number: int, total_chunks: int,
+                   chunk_size: Optional[int] = None, file_size: Optional[int] = None,
+                   checksum: Optional[str] = None, restart: bool = False) -> int:
+        """
+        将分片流式写入目标文件的对应偏移, 返回写入字节数
+        /
+        写入时同时计算 sha256, 与客户端传入的 checksum 不一致时不标记该分片
+        restart: 没有上传会话(uploadId)的旧接口按顺序发送分片, 第1个分片表示新的上传开始,
+                 需要丢弃同名文件被放弃的上传留下的位图/meta, 否则旧分片会被当作已接收
+        """
+        if not 1 <= chunk_number <= total_chunks:
+            raise ValueError(f"chunkNumber {chunk_number} is out of range 1..{total_chunks}")
+        size = part_size(part)
+
+        with open(self.bitmap_path, "ab") as lock_file:
+            # meta 的读写需要在多进程之间串行
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                meta = self._resolve_meta(chunk_number, total_chunks, size, chunk_size, file_size, restart)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        offset = (chunk_number - 1) * meta["chunkSize"]
+        fd = os.open(self.target_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if meta.get("fileSize") and os.fstat(fd).st_size < meta["fileSize"]:
+                self._preallocate(fd, meta["fileSize"])
+
+            buffer = bytearray(BUFFER_SIZE)
+            view = memoryview(buffer)
+            part.seek(0)
+            sha256 = hashlib.sha256()
+            written = 0
+            while True:
+                n = part.readinto(buffer) if hasattr(part, "readinto") else self._read_into(part, buffer)
+                if not n:
+                    break
+                pos = 0
+                while pos < n:
+                    pos += os.pwrite(fd, view[pos:n], offset + written + pos)
+                sha256.update(view[:n])
+                written += n
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if written != size:
+            raise ValueError(f"Part {chunk_number} of {self.file_name} was truncated: {written}/{size} bytes")
+        expected_size = self._expected_part_size(meta, chunk_number)
+        if expected_size is not None and written != expected_size:
+            raise ValueError(f"Part {chunk_number} of {self.file_name} should be {expected_size} bytes, got {written}")
+        digest = sha256.digest()
+        if checksum and digest.hex() != checksum.lower():
+            raise ValueError(f"Checksum mismatch for part {chunk_number} of {self.file_name}")
+
+        checksum_fd = os.open(self.checksum_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(checksum_fd, digest, (chunk_number - 1) * CHECKSUM_SIZE)
+        finally:
+            os.close(checksum_fd)
+
+        # 分片数据落盘后再置位图, 保证位图为1的分片一定完整
+        bitmap_fd = os.open(self.bitmap_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(bitmap_fd, b"\x01", chunk_number - 1)
+        finally:
+            os.close(bitmap_fd)
+        logger.info(f"Part {chunk_number}/{total_chunks} of {self.file_name} written at offset {offset} ({written} bytes)")
+        return written
+
+    @staticmethod
+    def _expected_part_size(meta: dict, chunk_number: int) -> Optional[int]:
+        """ 已知文件大小时, 每个分片的大小是确定的 """
+        file_size, chunk_size = meta.get("fileSize"), meta.get("chunkSize")
+        if file_size is None or not chunk_size:
+            return None
+        return max(0, min(chunk_size, file_size - (chunk_number - 1) * chunk_size))
+
+    @staticmethod
+    def _read_into(part: BinaryIO, buffer: bytearray) -> int:
+        data = part.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    @staticmethod
+    def _preallocate(fd: int, file_size: int):
+        try:
+            os.posix_fallocate(fd, 0, file_size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, file_size)
+
+    # ---------- finalize ----------
+    def finalize(self, total_chunks: int, merged_dir: str) -> int:
+        """ 校验全部分片已到齐, 移动到 merged_dir 并返回文件大小 """
+        os.makedirs(merged_dir, exist_ok=True)
+        merged_file_path = os.path.join(merged_dir, self.file_name)
+        with _file_lock(self.target_path):
+            if not os.path.exists(self.target_path) and os.path.exists(merged_file_path):
+                # 重复的完成请求
+                return os.path.getsize(merged_file_path)
+            if not self.is_complete(total_chunks):
+                missing = sorted(set(range(1, total_chunks + 1)) - set(self.received_parts()))
+                raise ValueError(f"Upload of {self.file_name} is incomplete, missing parts: {missing[:20]}")
+
+            meta = self.read_meta()
+            file_size = meta.get("fileSize")
+            if file_size and os.path.getsize(self.target_path) != file_size:
+                raise ValueError(f"Assembled size {os.path.getsize(self.target_path)} of {self.file_name} does not match {file_size}")
+            try:
+                os.replace(self.target_path, merged_file_path)
+            except OSError:
+                # chunk_dir 与 merged_dir 不在同一文件系统
+                shutil.move(self.target_path, merged_file_path)
+            self.cleanup()
+        logger.info(f"Upload of {self.file_name} assembled into {merged_file_path}")
+        return os.path.getsize(merged_file_path)
+
+    def cleanup(self):
+        """ 删除会话、位图、校验和与meta """
+        self._discard_session(self.read_meta().get("uploadId"))
+        for path in (self.bitmap_path, self.checksum_path, self.meta_path):
+            if os.path.exists(path):
+                os.unlink(path)
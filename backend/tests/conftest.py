@@ -0,0 +1,25 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# config.Settings 的必填项, 单元测试不连接数据库/模型, 只需要能实例化
+_REQUIRED_SETTINGS = {
+    "NEO4J_URI": "bolt://localhost:7687",
+    "NEO4J_USERNAME": "neo4j",
+    "NEO4J_PASSWORD": "password",
+    "NEO4J_DATABASE": "neo4j",
+    "UPDATE_GRPAH_CHUNK_BATCH_SIZE": "20",
+    "MAX_TOKEN_CHUNK_SIZE": "10000",
+    "KNN_MIN_SCORE": "0.8",
+    "ENABLE_USER_AGENT": "false",
+    "EMBEDDING_MODEL": "all-MiniLM-L6-v2",
+    "LLM_MODEL_deepseek_deepseek_chat": "deepseek-chat",
+    "LLM_MODEL_dashscope_qwen3_max": "qwen3-max",
+    "GRAPH_CLEAN_MODEL": "deepseek_deepseek_chat",
+    "GENERATE_CYPHER_MODEL": "deepseek_deepseek_chat",
+}
+for key, value in _REQUIRED_SETTINGS.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,159 @@
+import json
+import sqlite3
+
+import pytest
+
+from src import job_queue
+from src.job_queue import (
+    JOB_CANCELLED,
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    ExtractionJobQueue,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(job_queue.time, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return ExtractionJobQueue(str(tmp_path / "jobs.db"), max_attempts=2)
+
+
+def _payload(*file_names):
+    payload = {"credentials": {"uri": "bolt://localhost:7687", "userName": "neo4j", "password": "secret"}}
+    if len(file_names) == 1:
+        payload["file_name"] = file_names[0]
+    else:
+        payload["file_paths"] = list(file_names)
+    return payload
+
+
+def _enqueue(queue, clock, *file_names):
+    clock.now += 1
+    key = f"neo4j|{','.join(file_names)}"
+    return queue.enqueue(_payload(*file_names), key, file_name=file_names[0], source_type="local file")
+
+
+def _stored_payloads(queue):
+    with sqlite3.connect(queue.db_path) as conn:
+        return {row[0]: json.loads(row[1]) for row in conn.execute("SELECT id, payload FROM jobs")}
+
+
+def test_enqueue_deduplicates_active_jobs(queue, clock):
+    first = _enqueue(queue, clock, "a.pdf")
+    second = _enqueue(queue, clock, "a.pdf")
+
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True and second["id"] == first["id"]
+    assert "payload" not in first
+
+
+def test_claim_is_fifo_and_exclusive(queue, clock):
+    first = _enqueue(queue, clock, "a.pdf")
+    second = _enqueue(queue, clock, "b.pdf")
+
+    job = queue.claim("w1", lease_seconds=60)
+    assert job["id"] == first["id"]
+    assert job["status"] == JOB_RUNNING and job["attempts"] == 1
+    assert job["payload"]["credentials"]["password"] == "secret"
+    assert queue.claim("w2", lease_seconds=60)["id"] == second["id"]
+    assert queue.claim("w3", lease_seconds=60) is None
+
+
+def test_expired_lease_is_requeued_then_failed(queue, clock):
+    job = _enqueue(queue, clock, "a.pdf")
+    queue.claim("w1", lease_seconds=60)
+
+    clock.now += 30
+    assert queue.heartbeat(job["id"], "w1", lease_seconds=60)
+    clock.now += 61
+    assert queue.reclaim_expired() == []
+    assert queue.get(job["id"])["status"] == JOB_QUEUED
+    # 被回收后原 worker 不能再续约或提交结果
+    assert not queue.heartbeat(job["id"], "w1", lease_seconds=60)
+
+    queue.claim("w2", lease_seconds=60)
+    assert not queue.finish(job["id"], "w1", JOB_COMPLETED)
+    queue.release_worker("w2")
+    exhausted = queue.reclaim_expired()
+
+    assert [j["id"] for j in exhausted] == [job["id"]]
+    assert exhausted[0]["payload"]["credentials"]["password"] == "secret"
+    assert queue.get(job["id"])["status"] == JOB_FAILED
+    assert _stored_payloads(queue)[job["id"]]["credentials"]["password"] is None
+
+
+def test_finish_records_result_and_scrubs_password(queue, clock):
+    job = _enqueue(queue, clock, "a.pdf")
+    queue.claim("w1", lease_seconds=60)
+
+    assert queue.finish(job["id"], "w1", JOB_COMPLETED, result={"chunkNodeCount": 3})
+    stored = queue.get(job["id"])
+    assert stored["status"] == JOB_COMPLETED and stored["result"] == {"chunkNodeCount": 3}
+    payload = _stored_payloads(queue)[job["id"]]
+    assert payload["credentials"]["password"] is None
+    assert payload["file_name"] == "a.pdf"
+
+
+def test_cancel_queued_job(queue, clock):
+    job = _enqueue(queue, clock, "a.pdf")
+
+    affected = queue.request_cancel("neo4j|", ["a.pdf"])
+    assert affected == [{"id": job["id"], "status": JOB_QUEUED, "cancelled_files": ["a.pdf"]}]
+    assert queue.get(job["id"])["status"] == JOB_CANCELLED
+    assert _stored_payloads(queue)[job["id"]]["credentials"]["password"] is None
+    assert queue.claim("w1", lease_seconds=60) is None
+
+
+def test_cancel_part_of_batch_and_running_job(queue, clock):
+    batch = _enqueue(queue, clock, "a.pdf", "b.pdf")
+    running = _enqueue(queue, clock, "c.pdf")
+    other_db = queue.enqueue(_payload("a.pdf"), "other|a.pdf", file_name="a.pdf")
+    queue.claim("w1", lease_seconds=60)
+    queue.claim("w2", lease_seconds=60)
+
+    queue.request_cancel("neo4j|", ["a.pdf", "c.pdf"])
+
+    assert queue.get(batch["id"])["status"] == JOB_RUNNING
+    assert queue.get_cancelled_files(batch["id"]) == ["a.pdf"]
+    assert queue.get(running["id"])["status"] == JOB_RUNNING
+    assert queue.get_cancelled_files(running["id"]) == ["c.pdf"]
+    assert queue.get_cancelled_files(other_db["id"]) == []
+    assert _stored_payloads(queue)[running["id"]]["credentials"]["password"] == "secret"
+
+
+def test_purge_finished_jobs(queue, clock):
+    old = _enqueue(queue, clock, "a.pdf")
+    queue.claim("w1", lease_seconds=60)
+    queue.finish(old["id"], "w1", JOB_COMPLETED)
+    clock.now += 100
+    active = _enqueue(queue, clock, "b.pdf")
+
+    assert queue.purge_finished(older_than_seconds=200) == 0
+    assert queue.purge_finished(older_than_seconds=50) == 1
+    assert queue.get(old["id"]) is None
+    assert queue.get(active["id"])["status"] == JOB_QUEUED
+
+
+def test_existing_finished_jobs_are_scrubbed_on_open(queue, clock):
+    job = _enqueue(queue, clock, "a.pdf")
+    with sqlite3.connect(queue.db_path) as conn:
+        conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (JOB_FAILED, job["id"]))
+
+    ExtractionJobQueue(queue.db_path)
+    assert _stored_payloads(queue)[job["id"]]["credentials"]["password"] is None
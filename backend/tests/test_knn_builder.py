@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_neo4j")
+
+from src.knn_builder import BlockKNNBuilder, _normalize, cosine_to_index_score
+
+
+class FakeGraph:
+    """ 按 GET_(FILE_)CHUNK_EMBEDDINGS_PAGE 的键集分页语义返回 embedding """
+
+    def __init__(self, ids, vectors, file_of):
+        self.ids = ids
+        self.vectors = vectors
+        self.file_of = file_of
+        self.pages = 0
+        self.written = []
+
+    def query(self, query, params):
+        if "rows" in params:
+            self.written.extend(params["rows"])
+            return [{"count": len(params["rows"])}]
+        self.pages += 1
+        selected = [
+            i for i, chunk_id in enumerate(self.ids)
+            if chunk_id > params["after"] and (not params["file_names"] or self.file_of[chunk_id] in params["file_names"])
+        ]
+        return [{"id": self.ids[i], "embedding": self.vectors[i].tolist()} for i in selected[: params["limit"]]]
+
+
+@pytest.fixture
+def graph():
+    rng = np.random.default_rng(7)
+    ids = [f"chunk{i:03d}" for i in range(61)]
+    vectors = rng.normal(size=(61, 16)).astype(np.float32)
+    file_of = {chunk_id: f"file{i % 4}.pdf" for i, chunk_id in enumerate(ids)}
+    return FakeGraph(ids, vectors, file_of)
+
+
+def _brute_force(queries, corpus, k):
+    scores = queries @ corpus.T
+    indices = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(scores, indices, axis=1), indices
+
+
+def test_tiled_top_k_matches_brute_force(graph):
+    builder = BlockKNNBuilder(graph, page_size=9, block_size=5)
+    query_ids, queries = builder._load_embeddings()
+    corpus_ids = []
+    scores, indices = builder._top_k_numpy(queries, builder._corpus_tiles(builder._iter_embedding_pages(), corpus_ids), 6)
+
+    expected_scores, expected_indices = _brute_force(queries, _normalize(graph.vectors), 6)
+    assert corpus_ids == graph.ids == query_ids
+    assert np.array_equal(indices, expected_indices)
+    assert np.allclose(scores, expected_scores, atol=1e-6)
+
+
+def test_small_corpus_is_padded(graph):
+    builder = BlockKNNBuilder(graph, block_size=2)
+    queries = _normalize(graph.vectors[:3])
+    scores, indices = builder._top_k_numpy(queries, [(0, queries[:2])], 4)
+
+    assert (indices[:, 2:] == -1).all()
+    assert np.isneginf(scores[:, 2:]).all()
+    assert indices[0, 0] == 0 and indices[1, 0] == 1
+
+
+def test_compute_pairs_skips_self_and_deduplicates(graph):
+    builder = BlockKNNBuilder(graph, top_k=3, min_score=0.0)
+    ids, vectors = graph.ids[:10], _normalize(graph.vectors[:10])
+    pairs = builder.compute_pairs(ids, vectors, ids, [(0, vectors)])
+
+    keys = [(pair["source"], pair["target"]) for pair in pairs]
+    assert len(keys) == len(set(keys))
+    assert all(source < target for source, target in keys)
+
+    expected_scores, expected_indices = _brute_force(vectors, vectors, 4)
+    expected = set()
+    for row, source in enumerate(ids):
+        for index in expected_indices[row][1:]:
+            expected.add(tuple(sorted((source, ids[index]))))
+    assert set(keys) == expected
+    assert min(pair["score"] for pair in pairs) >= cosine_to_index_score(expected_scores[:, 1:]).min() - 1e-6
+
+
+def test_min_score_filters_pairs(graph):
+    builder = BlockKNNBuilder(graph, top_k=5, min_score=1.0)
+    ids, vectors = graph.ids[:10], _normalize(graph.vectors[:10])
+    assert builder.compute_pairs(ids, vectors, ids, [(0, vectors)]) == []
+
+
+def test_incremental_run_only_queries_given_files(graph):
+    builder = BlockKNNBuilder(graph, top_k=2, min_score=0.0, page_size=8, block_size=3, write_batch_size=4)
+    result = builder.run(["file1.pdf"])
+
+    query_ids = [chunk_id for chunk_id in graph.ids if graph.file_of[chunk_id] == "file1.pdf"]
+    assert result["chunks"] == len(query_ids)
+    assert result["similarPairs"] == len(graph.written)
+    assert all(pair["source"] in query_ids or pair["target"] in query_ids for pair in graph.written)
+
+    # 逐页读取语料的结果与一次性在内存中计算一致
+    in_memory = BlockKNNBuilder(graph, top_k=2, min_score=0.0)
+    rows = [graph.ids.index(chunk_id) for chunk_id in query_ids]
+    corpus = _normalize(graph.vectors)
+    expected = in_memory.compute_pairs(query_ids, corpus[rows], graph.ids, [(0, corpus)])
+    assert {(p["source"], p["target"]) for p in graph.written} == {(p["source"], p["target"]) for p in expected}
+
+
+def test_run_without_embeddings(graph):
+    empty = FakeGraph([], np.empty((0, 16), dtype=np.float32), {})
+    assert BlockKNNBuilder(empty).run() == {"chunks": 0, "similarPairs": 0}
+    assert BlockKNNBuilder(graph).run(["missing.pdf"]) == {"chunks": 0, "similarPairs": 0}
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pydantic_settings")
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_text_splitters")
+
+from src.graph_llm import scheduler
+from src.graph_llm.scheduler import LLMRequestScheduler, RateLimitBudget, is_rate_limit_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(scheduler.time, "monotonic", fake)
+    return fake
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+# ---------- RateLimitBudget ----------
+def test_requests_per_minute(clock):
+    budget = RateLimitBudget(requests_per_minute=2)
+    budget.record(1)
+    clock.now += 10
+    budget.record(1)
+    assert budget.wait_time(1) == pytest.approx(50)
+
+    clock.now += 50
+    assert budget.wait_time(1) == 0
+
+
+def test_tokens_per_minute_waits_for_enough_tokens_to_expire(clock):
+    budget = RateLimitBudget(tokens_per_minute=100)
+    budget.record(60)
+    clock.now += 20
+    budget.record(30)
+
+    assert budget.wait_time(10) == 0
+    # 需要释放 60+30+40-100=30 个token, 第一条记录过期即可
+    assert budget.wait_time(40) == pytest.approx(40)
+    # 需要释放 80 个token, 两条记录都要过期
+    assert budget.wait_time(90) == pytest.approx(60)
+
+
+def test_request_larger_than_budget_only_needs_empty_window(clock):
+    budget = RateLimitBudget(tokens_per_minute=100)
+    assert budget.wait_time(500) == 0
+    budget.record(500)
+    assert budget.wait_time(500) == pytest.approx(60)
+    clock.now += 60
+    assert budget.wait_time(500) == 0
+
+
+def test_unlimited_budget_never_waits(clock):
+    budget = RateLimitBudget()
+    for _ in range(1000):
+        budget.record(10000)
+    assert budget.wait_time(10000) == 0
+
+
+# ---------- LLMRequestScheduler ----------
+def test_map_returns_partial_results_in_order():
+    async def func(item):
+        await asyncio.sleep(0.001 * (5 - item))
+        if item % 2:
+            raise ValueError(f"bad item {item}")
+        return item * 10
+
+    results, failures = asyncio.run(LLMRequestScheduler(max_concurrency=2).map(func, [0, 1, 2, 3, 4]))
+
+    assert results == [0, 20, 40]
+    assert [item for item, _ in failures] == [1, 3]
+    assert all(isinstance(e, ValueError) for _, e in failures)
+
+
+def test_rate_limit_errors_are_retried():
+    attempts = []
+
+    async def func():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RateLimitError("too many requests")
+        return "ok"
+
+    llm_scheduler = LLMRequestScheduler(max_retries=5, retry_base_delay=0)
+    assert asyncio.run(llm_scheduler.run(func)) == "ok"
+    assert len(attempts) == 3
+
+
+def test_retries_are_bounded_and_other_errors_are_not_retried():
+    attempts = []
+
+    async def rate_limited():
+        attempts.append(1)
+        raise RateLimitError("429")
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(LLMRequestScheduler(max_retries=2, retry_base_delay=0).run(rate_limited))
+    assert len(attempts) == 3
+
+    attempts.clear()
+
+    async def broken():
+        attempts.append(1)
+        raise ValueError("invalid output")
+
+    with pytest.raises(ValueError):
+        asyncio.run(LLMRequestScheduler(max_retries=2, retry_base_delay=0).run(broken))
+    assert len(attempts) == 1
+
+
+def test_concurrency_is_limited():
+    running, peak = 0, 0
+
+    async def func(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return item
+
+    results, failures = asyncio.run(LLMRequestScheduler(max_concurrency=3).map(func, list(range(10))))
+    assert results == list(range(10)) and failures == []
+    assert peak == 3
+
+
+def test_is_rate_limit_error():
+    assert is_rate_limit_error(RateLimitError())
+    assert is_rate_limit_error(Exception("Error code: 429"))
+    assert not is_rate_limit_error(ValueError("invalid json"))
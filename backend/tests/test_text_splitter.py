@@ -0,0 +1,134 @@
+import pytest
+
+pytest.importorskip("pydantic_settings")
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_text_splitters")
+pytest.importorskip("tiktoken")
+
+from langchain_core.documents import Document
+
+from src.document_processors import text_splitter
+from src.document_processors.text_splitter import TokenOffsetSplitter, get_tiktoken_encoding, pack_chunks_by_token_budget
+
+ENCODING = "gpt2"
+
+
+@pytest.fixture(scope="module")
+def encoding():
+    try:
+        return get_tiktoken_encoding(ENCODING)
+    except Exception as e:  # 编码文件需要联网下载
+        pytest.skip(f"tiktoken encoding {ENCODING} is not available: {e}")
+
+
+def _splitter(chunk_size, chunk_overlap):
+    return TokenOffsetSplitter(chunk_size, chunk_overlap, ENCODING)
+
+
+def test_chunks_are_slices_of_the_original_text(encoding):
+    text = "Graph builders split documents into chunks. " * 20
+    chunks = _splitter(16, 4).split_text(text)
+
+    assert len(chunks) > 1
+    position = 0
+    for chunk in chunks:
+        position = text.index(chunk, position)
+        assert len(encoding.encode_ordinary(chunk)) <= 16
+    assert text.startswith(chunks[0])
+    assert text.endswith(chunks[-1])
+
+
+def test_windows_follow_token_stride(encoding):
+    text = " ".join(f"word{i}" for i in range(200))
+    tokens = encoding.encode_ordinary(text)
+    _, offsets = encoding.decode_with_offsets(tokens)
+    chunks = _splitter(20, 5).split_text(text)
+
+    for i, chunk in enumerate(chunks):
+        start = i * 15
+        end = min(start + 20, len(tokens))
+        assert chunk == text[offsets[start] : offsets[end] if end < len(tokens) else len(text)]
+    assert (len(chunks) - 1) * 15 + 20 >= len(tokens)
+
+
+def test_overlap_repeats_tail_of_previous_chunk(encoding):
+    text = " ".join(f"token{i}" for i in range(100))
+    tokens = encoding.encode_ordinary(text)
+    _, offsets = encoding.decode_with_offsets(tokens)
+    chunks = _splitter(12, 4).split_text(text)
+
+    for i, (previous, current) in enumerate(zip(chunks, chunks[1:]), start=1):
+        overlap = text[offsets[i * 8] : offsets[i * 8 + 4]]
+        assert overlap
+        assert previous.endswith(overlap)
+        assert current.startswith(overlap)
+
+
+def test_multibyte_characters_are_not_cut(encoding):
+    text = "知识图谱构建需要把长文档切分成多个片段。" * 10
+    chunks = _splitter(10, 2).split_text(text)
+
+    assert len(chunks) > 1
+    assert text.startswith(chunks[0]) and text.endswith(chunks[-1])
+    position = 0
+    for chunk in chunks:
+        assert chunk.encode("utf8").decode("utf8") == chunk
+        position = text.index(chunk, position)
+
+
+def test_short_and_blank_text(encoding):
+    splitter = _splitter(50, 10)
+    assert splitter.split_text("") == []
+    assert splitter.split_text("   ") == []
+    assert splitter.split_text("short text") == ["short text"]
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TokenOffsetSplitter(10, 10, ENCODING)
+
+
+# ---------- pack_chunks_by_token_budget ----------
+@pytest.fixture
+def word_count(monkeypatch):
+    """ 用单词数代替token数, 不依赖编码文件 """
+    monkeypatch.setattr(text_splitter, "count_tokens", lambda text, encoding_name: len(text.split()))
+
+
+def _chunks(*sizes):
+    return [
+        {"chunk_id": f"c{i}", "chunk_doc": Document(page_content=" ".join(["w"] * size))}
+        for i, size in enumerate(sizes)
+    ]
+
+
+def _packed_ids(groups):
+    return [([chunk["chunk_id"] for chunk in group], tokens) for group, tokens in groups]
+
+
+def test_adjacent_chunks_are_packed_up_to_budget(word_count):
+    groups = pack_chunks_by_token_budget(_chunks(3, 4, 2, 5, 1), 7, ENCODING)
+    assert _packed_ids(groups) == [(["c0", "c1"], 7), (["c2", "c3"], 7), (["c4"], 1)]
+
+
+def test_oversized_chunk_is_sent_alone(word_count):
+    groups = pack_chunks_by_token_budget(_chunks(2, 20, 3), 10, ENCODING)
+    assert _packed_ids(groups) == [(["c0"], 2), (["c1"], 20), (["c2"], 3)]
+
+
+def test_max_chunks_caps_each_group(word_count):
+    groups = pack_chunks_by_token_budget(_chunks(1, 1, 1, 1, 1), 100, ENCODING, max_chunks=2)
+    assert _packed_ids(groups) == [(["c0", "c1"], 2), (["c2", "c3"], 2), (["c4"], 1)]
+
+
+def test_zero_budget_groups_by_max_chunks(word_count):
+    assert _packed_ids(pack_chunks_by_token_budget(_chunks(5, 50, 500), 0, ENCODING)) == [
+        (["c0"], 5), (["c1"], 50), (["c2"], 500)
+    ]
+    assert _packed_ids(pack_chunks_by_token_budget(_chunks(5, 50, 500), 0, ENCODING, max_chunks=2)) == [
+        (["c0", "c1"], 55), (["c2"], 500)
+    ]
+
+
+def test_empty_input(word_count):
+    assert pack_chunks_by_token_budget([], 10, ENCODING) == []
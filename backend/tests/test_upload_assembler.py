@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from src.upload_assembler import UploadAssembler
+
+CHUNK_SIZE = 4
+
+
+def _parts(data: bytes, chunk_size: int = CHUNK_SIZE):
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return str(tmp_path / "chunks"), str(tmp_path / "merged")
+
+
+def test_out_of_order_parts_are_assembled(dirs):
+    chunk_dir, merged_dir = dirs
+    data = b"abcdefghijklmn"
+    parts = _parts(data)
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    for number in (3, 1, 4, 2):
+        assembler.write_part(io.BytesIO(parts[number - 1]), number, len(parts),
+                             chunk_size=CHUNK_SIZE, file_size=len(data))
+
+    assert assembler.received_parts() == [1, 2, 3, 4]
+    assert assembler.finalize(len(parts), merged_dir) == len(data)
+    with open(os.path.join(merged_dir, "a.txt"), "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(assembler.bitmap_path)
+    assert not os.path.exists(assembler.meta_path)
+
+
+def test_finalize_reports_missing_parts(dirs):
+    chunk_dir, merged_dir = dirs
+    parts = _parts(b"abcdefghijkl")
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    assembler.write_part(io.BytesIO(parts[0]), 1, 3, chunk_size=CHUNK_SIZE)
+    assembler.write_part(io.BytesIO(parts[2]), 3, 3, chunk_size=CHUNK_SIZE)
+
+    with pytest.raises(ValueError, match=r"missing parts: \[2\]"):
+        assembler.finalize(3, merged_dir)
+
+
+def test_session_resume_keeps_received_parts(dirs):
+    chunk_dir, _ = dirs
+    data = b"abcdefghij"
+    parts = _parts(data)
+    status = UploadAssembler("a.txt", chunk_dir).create_session(len(data), CHUNK_SIZE, len(parts))
+    assembler = UploadAssembler.from_session(status["uploadId"], chunk_dir)
+    assembler.write_part(io.BytesIO(parts[1]), 2, len(parts))
+
+    resumed = UploadAssembler("a.txt", chunk_dir).create_session(len(data), CHUNK_SIZE, len(parts))
+    assert resumed["uploadId"] == status["uploadId"]
+    assert resumed["receivedParts"] == [2]
+    assert resumed["checksums"] == {2: hashlib.sha256(parts[1]).hexdigest()}
+
+
+def test_session_with_different_size_starts_over(dirs):
+    chunk_dir, _ = dirs
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    first = assembler.create_session(10, CHUNK_SIZE, 3)
+    assembler.write_part(io.BytesIO(b"abcd"), 1, 3)
+
+    second = assembler.create_session(6, CHUNK_SIZE, 2)
+    assert second["uploadId"] != first["uploadId"]
+    assert second["receivedParts"] == []
+    with pytest.raises(ValueError):
+        UploadAssembler.from_session(first["uploadId"], chunk_dir)
+
+
+def test_checksum_mismatch_does_not_mark_part(dirs):
+    chunk_dir, _ = dirs
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        assembler.write_part(io.BytesIO(b"abcd"), 1, 2, chunk_size=CHUNK_SIZE,
+                             checksum=hashlib.sha256(b"other").hexdigest())
+    assert assembler.received_parts() == []
+
+    assembler.write_part(io.BytesIO(b"abcd"), 1, 2, chunk_size=CHUNK_SIZE,
+                         checksum=hashlib.sha256(b"abcd").hexdigest().upper())
+    assert assembler.received_parts() == [1]
+
+
+def test_part_with_unexpected_size_is_rejected(dirs):
+    chunk_dir, _ = dirs
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    with pytest.raises(ValueError, match="should be 4 bytes"):
+        assembler.write_part(io.BytesIO(b"abc"), 1, 3, chunk_size=CHUNK_SIZE, file_size=10)
+    assert assembler.received_parts() == []
+
+
+def test_legacy_restart_discards_stale_parts(dirs):
+    chunk_dir, merged_dir = dirs
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    # 被放弃的上传留下了全部分片的位图
+    for number, part in enumerate(_parts(b"XXXXXXXXXXXX"), start=1):
+        assembler.write_part(io.BytesIO(part), number, 3, restart=number == 1)
+
+    data = b"abcdefghijkl"
+    parts = _parts(data)
+    assembler.write_part(io.BytesIO(parts[0]), 1, 3, restart=True)
+    assert assembler.received_parts() == [1]
+    assert not assembler.is_complete(3)
+
+    for number in (2, 3):
+        assembler.write_part(io.BytesIO(parts[number - 1]), number, 3)
+    assembler.finalize(3, merged_dir)
+    with open(os.path.join(merged_dir, "a.txt"), "rb") as f:
+        assert f.read() == data
+
+
+def test_legacy_restart_allows_changed_chunk_count(dirs):
+    chunk_dir, merged_dir = dirs
+    assembler = UploadAssembler("a.txt", chunk_dir)
+    assembler.write_part(io.BytesIO(b"XXXX"), 1, 3, restart=True)
+
+    with pytest.raises(ValueError, match="totalChunks changed"):
+        assembler.write_part(io.BytesIO(b"abcd"), 1, 2)
+
+    assembler.write_part(io.BytesIO(b"abcd"), 1, 2, restart=True)
+    assembler.write_part(io.BytesIO(b"ef"), 2, 2)
+    assert assembler.finalize(2, merged_dir) == 6
@@ -1,5 +1,6 @@
 import os
 import re
+import unicodedata
 from pathlib import Path
 
 
@@ -18,18 +19,67 @@ def validate_file_path(directory: str, filename: str) -> str:
     return abs_file_path
 
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class TextNormalizer:
+    """
+    基于 str.translate 的文本清洗, 删除/替换字符在一次遍历中完成
+    /
+    unicode_form: 可选 NFC/NFKC 等规范化(先于字符替换执行, 避免全角引号等漏删)
+    delete_chars: 删除的字符
+    replace_chars: {原字符: 替换字符串}
+    collapse_whitespace: 连续空白折叠为一个空格并去掉首尾空白
+    """
+
+    def __init__(self, delete_chars: str = "", replace_chars: dict = None,
+                 unicode_form: str = None, collapse_whitespace: bool = False):
+        table = {ord(ch): None for ch in delete_chars}
+        table.update({ord(ch): value for ch, value in (replace_chars or {}).items()})
+        self.table = table
+        self.unicode_form = unicode_form or None
+        self.collapse_whitespace = collapse_whitespace
+
+    def __call__(self, text: str) -> str:
+        if not text:
+            return ""
+        if self.unicode_form:
+            text = unicodedata.normalize(self.unicode_form, text)
+        text = text.translate(self.table)
+        if self.collapse_whitespace:
+            text = _WHITESPACE_RE.sub(" ", text).strip()
+        return text
+
+
+# 分块前的页面清洗: 去掉引号, 换行折叠为空格
+CHUNK_TEXT_NORMALIZER = TextNormalizer(delete_chars="\"'", replace_chars={"\n": " "})
+
+# 按数据源类型配置页面清洗, 未配置的类型使用 CHUNK_TEXT_NORMALIZER
+TEXT_NORMALIZERS = {
+    "local_file": CHUNK_TEXT_NORMALIZER,
+}
+
+
+def get_text_normalizer(source_type: str = None) -> TextNormalizer:
+    """ 获取数据源对应的页面清洗器 """
+    return TEXT_NORMALIZERS.get(source_type, CHUNK_TEXT_NORMALIZER)
+
+
+# 提示词: {} 转为 [] 防止模板注入, 空白折叠
+INSTRUCTION_NORMALIZER = TextNormalizer(replace_chars={"{": "[", "}": "]"}, collapse_whitespace=True)
+_INJECTION_RE = re.compile(
+    "|".join([r"os\.getenv\(", r"eval\(", r"exec\(", r"subprocess\.", r"import os", r"import subprocess"]),
+    flags=re.IGNORECASE,
+)
+
+
 def sanitize_additional_instruction(instruction: str) -> str:
     """ 提示词消毒 """
     if not instruction or instruction.strip() == "": 
         return ""
-    instruction = instruction.replace("{", "[").replace("}", "]")  # Convert `{}` to `[]` for safety
-    # Step 2: Block dangerous function calls
-    injection_patterns = [r"os\.getenv\(", r"eval\(", r"exec\(", r"subprocess\.", r"import os", r"import subprocess"]
-    for pattern in injection_patterns:
-        instruction = re.sub(pattern, "[BLOCKED]", instruction, flags=re.IGNORECASE)
-    # Step 4: Normalize spaces
-    instruction = re.sub(r'\s+', ' ', instruction).strip()
-    return instruction
+    # Block dangerous function calls, then convert `{}` to `[]` and normalize spaces
+    instruction = _INJECTION_RE.sub("[BLOCKED]", instruction)
+    return INSTRUCTION_NORMALIZER(instruction)
 
 
 def clean_nodes_and_relationships(graph_document_list):
@@ -61,38 +61,92 @@ export const testConnectionApi = async (config) => {
 }
 
 // ===== File Upload =====
+const UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024 // 5MB
+const UPLOAD_CONCURRENCY = 4
+const UPLOAD_PART_RETRIES = 3
+
+const sha256Hex = async (blob) => {
+  // crypto.subtle 仅在安全上下文(https/localhost)可用, 否则不携带校验和
+  if (!window.crypto?.subtle) return ''
+  const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer())
+  return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('')
+}
+
+const postForm = async (url, fields) => {
+  const formData = new FormData()
+  Object.entries(fields).forEach(([key, value]) => {
+    if (Array.isArray(value)) formData.append(key, ...value)
+    else formData.append(key, value)
+  })
+  const response = await api.post(url, formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data'
+    }
+  })
+  if (response.status !== 'Success') {
+    throw new Error(response.error || response.message || '请求失败')
+  }
+  return response.data
+}
+
 export const uploadFileApi = async (file, model, neo4jConfig, onProgress) => {
-  const CHUNK_SIZE = 5 * 1024 * 1024 // 5MB
-  const totalChunks = Math.ceil(file.size / CHUNK_SIZE)
+  const totalChunks = Math.max(1, Math.ceil(file.size / UPLOAD_CHUNK_SIZE))
 
   try {
+    // 1. 创建(或恢复)上传会话, 已接收的分片不再重复发送
+    const session = await postForm('/upload/session', {
+      originalname: file.name,
+      fileSize: file.size,
+      chunkSize: UPLOAD_CHUNK_SIZE,
+      totalChunks
+    })
+    const uploadId = session.uploadId
+    const received = new Set(session.receivedParts)
+    const pending = []
     for (let chunkNumber = 1; chunkNumber <= totalChunks; chunkNumber++) {
-      const start = (chunkNumber - 1) * CHUNK_SIZE
-      const end = Math.min(chunkNumber * CHUNK_SIZE, file.size)
-      const chunk = file.slice(start, end)
-
-      const formData = new FormData()
-      formData.append('file', chunk, file.name)
-      formData.append('chunkNumber', chunkNumber)
-      formData.append('totalChunks', totalChunks)
-      formData.append('originalname', file.name)
-      formData.append('model', model)
-      formData.append('uri', neo4jConfig.uri)
-      formData.append('userName', neo4jConfig.username)
-      formData.append('password', neo4jConfig.password)
-      formData.append('database', neo4jConfig.database)
-
-      await api.post('/upload', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data'
-        }
-      })
+      if (!received.has(chunkNumber)) pending.push(chunkNumber)
+    }
 
-      if (onProgress) {
-        const progress = Math.round((chunkNumber / totalChunks) * 100)
-        onProgress(progress)
+    const reportProgress = () => {
+      if (onProgress) onProgress(Math.round((received.size / totalChunks) * 100))
+    }
+    reportProgress()
+
+    // 2. 并发上传剩余分片, 单个分片失败时重试
+    const uploadPart = async (chunkNumber) => {
+      const start = (chunkNumber - 1) * UPLOAD_CHUNK_SIZE
+      const chunk = file.slice(start, Math.min(start + UPLOAD_CHUNK_SIZE, file.size))
+      const checksum = await sha256Hex(chunk)
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await postForm(`/upload/session/${uploadId}/part`, {
+            file: [chunk, file.name],
+            chunkNumber,
+            checksum
+          })
+          break
+        } catch (error) {
+          if (attempt >= UPLOAD_PART_RETRIES) throw error
+        }
+      }
+      received.add(chunkNumber)
+      reportProgress()
+    }
+    const worker = async () => {
+      while (pending.length) {
+        await uploadPart(pending.shift())
       }
     }
+    await Promise.all(Array.from({ length: Math.min(UPLOAD_CONCURRENCY, pending.length) }, worker))
+
+    // 3. 完成组装, 创建Document Node
+    await postForm(`/upload/session/${uploadId}/complete`, {
+      model,
+      uri: neo4jConfig.uri,
+      userName: neo4jConfig.username,
+      password: neo4jConfig.password,
+      database: neo4jConfig.database
+    })
 
     return {
       success: true,
@@ -108,6 +162,26 @@ export const uploadFileApi = async (file, model, neo4jConfig, onProgress) => {
 }
 
 // ===== Graph Extraction =====
+const EXTRACT_JOB_POLL_INTERVAL = 3000
+
+export const getExtractJobApi = async (jobId) => {
+  const response = await api.get(`/extract/jobs/${jobId}`)
+  if (response.status !== 'Success') {
+    throw new Error(response.message || '查询任务失败')
+  }
+  return response.data
+}
+
+const waitForExtractJob = async (jobId) => {
+  while (true) {
+    const job = await getExtractJobApi(jobId)
+    if (!['queued', 'running'].includes(job.status)) {
+      return job
+    }
+    await new Promise((resolve) => setTimeout(resolve, EXTRACT_JOB_POLL_INTERVAL))
+  }
+}
+
 export const extractGraphApi = async (model, config, neo4jConfig) => {
   const formData = new FormData()
   formData.append('uri', neo4jConfig.uri)
@@ -134,6 +208,20 @@ export const extractGraphApi = async (model, config, neo4jConfig) => {
         'Content-Type': 'multipart/form-data'
       }
     })
+    if (response.status !== 'Success') {
+      throw new Error(response.message || '提取失败')
+    }
+
+    // 启用任务队列时返回任务, 轮询直到任务结束
+    const job = response.data
+    if (job && job.id) {
+      const finished = await waitForExtractJob(job.id)
+      return {
+        success: finished.status === 'completed',
+        message: finished.status === 'completed' ? '提取成功' : (finished.error || `任务${finished.status}`),
+        data: finished
+      }
+    }
 
     return {
       success: true,